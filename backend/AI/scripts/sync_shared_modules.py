@@ -0,0 +1,50 @@
+"""
+Shared Module Sync
+Vendors the document recommender's query_log and fast_json into the HS service
+"""
+import argparse
+import os
+import shutil
+import sys
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), '..', 'services')
+SOURCE_DIR = os.path.normpath(os.path.join(BASE_DIR, 'document_recommender'))
+TARGET_DIR = os.path.normpath(os.path.join(BASE_DIR, 'hs_service'))
+SHARED_MODULES = ('query_log.py', 'fast_json.py')
+
+
+def stale_modules():
+    """Modules whose HS service copy is missing or differs from the source."""
+    stale = []
+    for name in SHARED_MODULES:
+        target = os.path.join(TARGET_DIR, name)
+        with open(os.path.join(SOURCE_DIR, name), 'rb') as f:
+            source = f.read()
+        if not os.path.exists(target):
+            stale.append(name)
+            continue
+        with open(target, 'rb') as f:
+            if f.read() != source:
+                stale.append(name)
+    return stale
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy shared modules into the HS service')
+    parser.add_argument('--check', action='store_true', help='Only report copies that are out of date')
+    args = parser.parse_args()
+
+    stale = stale_modules()
+    if args.check:
+        for name in stale:
+            print(f"Out of date: {os.path.join(TARGET_DIR, name)}")
+        sys.exit(1 if stale else 0)
+
+    for name in stale:
+        shutil.copyfile(os.path.join(SOURCE_DIR, name), os.path.join(TARGET_DIR, name))
+        print(f"Synced: {os.path.join(TARGET_DIR, name)}")
+    print(f"Shared modules up to date in {TARGET_DIR}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ __version__ = "1.0.0"
 __author__ = "Pre-Clear Team"
 
 from .predict_documents import (
+    DocumentHit,
     DocumentPredictor,
     DocumentPredictionRequest,
     DocumentPredictionResponse,
@@ -13,15 +14,22 @@ from .predict_documents import (
 from .api_integration import (
     ComplianceProvider,
     ComplianceIntegration,
+    HTTPClientConfig,
+    ProviderResultCache,
+    RuleTableProvider,
     create_default_integration,
 )
 
 __all__ = [
+    "DocumentHit",
     "DocumentPredictor",
     "DocumentPredictionRequest",
     "DocumentPredictionResponse",
     "PredictedDocument",
     "ComplianceProvider",
     "ComplianceIntegration",
+    "HTTPClientConfig",
+    "ProviderResultCache",
+    "RuleTableProvider",
     "create_default_integration",
 ]
@@ -3,16 +3,27 @@ API Integration Layer for Document Requirements
 Interfaces with external compliance/regulatory APIs to retrieve document requirements
 """
 import asyncio
+import json
 import logging
+import queue
+import random
+import sqlite3
+import threading
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict, Any
-from dataclasses import dataclass
+from collections import OrderedDict, defaultdict
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Dict, Any, Sequence, Tuple
+from dataclasses import asdict, dataclass, field
 from enum import Enum
 import aiohttp
 from requests.adapters import Retry
 from requests.packages.urllib3.util.retry import Retry as UrllibRetry
 import time
 
+from rule_engine import Shipment, load_rule_table
+from service_metrics import STAGE_BUCKETS_MS, Histogram
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -35,13 +46,553 @@ class ComplianceMode(str, Enum):
     HYBRID = "hybrid"
 
 
+# Alias used by serve_app and callers that share the predictor's naming
+DocumentRecommendationMode = ComplianceMode
+
+
+@dataclass
+class HTTPClientConfig:
+    """Connection pool and timeout settings for provider HTTP calls."""
+    limit: int = 100                 # open connections across all hosts
+    limit_per_host: int = 10         # open connections to any one provider host
+    keepalive_timeout: float = 30.0  # seconds an idle connection stays pooled
+    dns_cache_ttl: int = 300         # seconds resolved addresses are reused
+    connect_timeout: float = 5.0
+    read_timeout: Optional[float] = None
+    total_timeout: float = 30.0
+
+
+class SharedHTTPClient:
+    """
+    One pooled aiohttp session shared by every HTTP-based provider.
+
+    Connections are kept alive and reused across shipments, so a lookup pays
+    DNS resolution and the TCP/TLS handshake only when the pool has no idle
+    connection to that host. A session is created lazily per event loop (or
+    by `start`), since aiohttp sessions are bound to one loop; `close`
+    releases all of them.
+    """
+    
+    def __init__(self, config: Optional[HTTPClientConfig] = None):
+        self.config = config or HTTPClientConfig()
+        self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+    
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+        
+        async def on_request_start(session, ctx, params):
+            self.requests += 1
+        
+        async def on_connection_create_end(session, ctx, params):
+            self.connections_created += 1
+        
+        async def on_connection_reuseconn(session, ctx, params):
+            self.connections_reused += 1
+        
+        async def on_dns_cache_hit(session, ctx, params):
+            self.dns_cache_hits += 1
+        
+        async def on_dns_cache_miss(session, ctx, params):
+            self.dns_cache_misses += 1
+        
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+    
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The pooled session for the current event loop, created when needed."""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            # Nothing can run on a closed loop to close its session; let it be collected
+            for other in [l for l in self._sessions if l.is_closed()]:
+                del self._sessions[other]
+            connector = aiohttp.TCPConnector(
+                limit=self.config.limit,
+                limit_per_host=self.config.limit_per_host,
+                keepalive_timeout=self.config.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.config.dns_cache_ttl,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout(),
+                trace_configs=[self._trace_config()],
+            )
+            self._sessions[loop] = session
+        return session
+    
+    def timeout(self, total: Optional[float] = None) -> aiohttp.ClientTimeout:
+        """Configured timeouts, with `total` overriding the overall budget."""
+        return aiohttp.ClientTimeout(
+            total=total if total is not None else self.config.total_timeout,
+            connect=self.config.connect_timeout,
+            sock_read=self.config.read_timeout,
+        )
+    
+    async def start(self):
+        """Open the session ahead of the first request."""
+        self.session
+    
+    async def close(self):
+        """Close the sessions of every event loop, each on its own loop."""
+        current = asyncio.get_running_loop()
+        sessions, self._sessions = self._sessions, {}
+        for loop, session in sessions.items():
+            if session.closed or loop.is_closed():
+                continue
+            if loop is current:
+                await session.close()
+            elif loop.is_running():
+                # Serving another thread; close it there
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+            else:
+                await asyncio.to_thread(loop.run_until_complete, session.close())
+    
+    def stats(self) -> Dict[str, Any]:
+        """Request and connection reuse counters for monitoring."""
+        return {
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "dns_cache_hits": self.dns_cache_hits,
+            "dns_cache_misses": self.dns_cache_misses,
+            "limit_per_host": self.config.limit_per_host,
+        }
+
+
+def provider_cache_key(
+    hs_code: str,
+    origin_country: str,
+    destination_country: str,
+    product_description: str,
+) -> str:
+    """
+    Lookup key shared by identical shipments, ignoring case and spacing in the text.
+    
+    Codes are kept as given: the rule-table providers match them exactly, so
+    "EU-DE" and " EU-DE" are different lookups.
+    """
+    return json.dumps([
+        hs_code,
+        origin_country,
+        destination_country,
+        " ".join(product_description.lower().split()),
+    ], separators=(",", ":"))
+
+
+class ProviderResultCache:
+    """
+    Per-provider TTL cache of document lookups with stale-while-revalidate.
+
+    A fresh entry is returned as is. Once its provider's TTL has passed the
+    stale value is still returned immediately, for up to `max_stale` seconds,
+    while a background task refreshes it; only a missing or too-old entry waits
+    for the provider. Failed lookups are never cached. With `db_path` entries
+    are also written to SQLite, so a restart does not start cold.
+    
+    Only the in-memory LRU is touched on the event loop: disk reads for
+    memory misses run in the default executor, and writes are handed to a
+    background writer thread that commits them in batches. When the write
+    queue is full the entry stays in memory only and is counted as dropped.
+    """
+    
+    def __init__(
+        self,
+        ttls: Optional[Dict[str, float]] = None,
+        max_stale: float = 86400.0,
+        max_entries: int = 10000,
+        db_path: Optional[str] = None,
+        write_queue_size: int = 10000,
+    ):
+        self.ttls = ttls or {}
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[DocumentRequirement]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._metrics: Dict[str, Dict[str, int]] = defaultdict(lambda: {
+            "hits": 0, "stale_hits": 0, "disk_hits": 0, "misses": 0,
+            "refreshes": 0, "refresh_failures": 0,
+        })
+        
+        self.dropped_writes = 0
+        self._db = None
+        self._reader = None
+        self._reader_lock = threading.Lock()
+        self._writes: "queue.Queue[Optional[Tuple[str, str, float, List[DocumentRequirement]]]]" = queue.Queue(
+            maxsize=write_queue_size
+        )
+        self._writer: Optional[threading.Thread] = None
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS provider_results ("
+                " provider TEXT NOT NULL, key TEXT NOT NULL, stored_at REAL NOT NULL, documents TEXT NOT NULL,"
+                " PRIMARY KEY (provider, key))"
+            )
+            self._db.commit()
+            # WAL lets the executor read on its own connection while the writer commits
+            self._reader = sqlite3.connect(db_path, check_same_thread=False)
+            self._writer = threading.Thread(target=self._write_loop, name="provider-cache-writer", daemon=True)
+            self._writer.start()
+    
+    def ttl_for(self, provider: "ComplianceProvider") -> float:
+        """Configured TTL for a provider, else its own default; 0 disables caching."""
+        return self.ttls.get(provider.name, provider.cache_ttl)
+    
+    async def get_or_fetch(
+        self,
+        provider: "ComplianceProvider",
+        key: str,
+        fetch: Callable[[], Awaitable[List[DocumentRequirement]]],
+    ) -> List[DocumentRequirement]:
+        """
+        Cached documents for `key`, calling `fetch` on a miss or refreshing in the background.
+        
+        A miss fetches and stores in a task of its own, so a caller that times
+        out or is cancelled still leaves the result cached for the next lookup.
+        """
+        if self.ttl_for(provider) <= 0:
+            return await fetch()
+        
+        documents, stale = await self.lookup(provider, key)
+        if documents is not None:
+            if stale:
+                self._schedule_refresh(provider.name, key, fetch)
+            return documents
+        
+        async def fetch_and_store():
+            documents = await fetch()
+            self._put(provider.name, key, documents)
+            return documents
+        
+        task = asyncio.get_running_loop().create_task(fetch_and_store())
+        # Mark a failure retrieved even if the caller has gone away
+        task.add_done_callback(lambda finished: finished.cancelled() or finished.exception())
+        return await asyncio.shield(task)
+    
+    async def lookup(
+        self,
+        provider: "ComplianceProvider",
+        key: str,
+    ) -> Tuple[Optional[List[DocumentRequirement]], bool]:
+        """(documents, stale) for `key` without fetching; documents is None on a miss."""
+        return (await self.lookup_many(provider, [key]))[key]
+    
+    async def lookup_many(
+        self,
+        provider: "ComplianceProvider",
+        keys: Sequence[str],
+    ) -> Dict[str, Tuple[Optional[List[DocumentRequirement]], bool]]:
+        """`lookup` for several keys, with one disk read for all the memory misses."""
+        ttl = self.ttl_for(provider)
+        if ttl <= 0:
+            return {key: (None, False) for key in keys}
+        
+        metrics = self._metrics[provider.name]
+        entries = {key: self._get(provider.name, key) for key in keys}
+        on_disk = [key for key, entry in entries.items() if entry is None]
+        if on_disk and self._reader is not None:
+            loaded = await asyncio.get_running_loop().run_in_executor(
+                None, self._read, provider.name, on_disk
+            )
+            for key, entry in loaded.items():
+                with self._lock:
+                    self._insert((provider.name, key), entry)
+                entries[key] = entry
+                metrics["disk_hits"] += 1
+        
+        now = time.time()
+        results = {}
+        for key, entry in entries.items():
+            if entry is not None:
+                stored_at, documents = entry
+                age = now - stored_at
+                if age <= ttl:
+                    metrics["hits"] += 1
+                    results[key] = (documents, False)
+                    continue
+                if age <= ttl + self.max_stale:
+                    metrics["stale_hits"] += 1
+                    results[key] = (documents, True)
+                    continue
+            metrics["misses"] += 1
+            results[key] = (None, False)
+        return results
+    
+    def put(self, provider: "ComplianceProvider", key: str, documents: List[DocumentRequirement]):
+        """Store documents fetched outside `get_or_fetch`, e.g. by a bulk call."""
+        if self.ttl_for(provider) > 0:
+            self._put(provider.name, key, documents)
+    
+    def schedule_refresh(
+        self,
+        provider: "ComplianceProvider",
+        key: str,
+        fetch: Callable[[], Awaitable[List[DocumentRequirement]]],
+    ):
+        """Refresh a stale entry in the background, once per key at a time."""
+        self._schedule_refresh(provider.name, key, fetch)
+    
+    def _schedule_refresh(self, provider_name: str, key: str, fetch):
+        if (provider_name, key) in self._refreshing:
+            return
+        
+        async def refresh():
+            metrics = self._metrics[provider_name]
+            try:
+                self._put(provider_name, key, await fetch())
+                metrics["refreshes"] += 1
+            except Exception as e:
+                # The stale value keeps being served until a refresh succeeds
+                metrics["refresh_failures"] += 1
+                logger.warning(f"Background refresh for {provider_name} failed: {e}")
+            finally:
+                self._refreshing.pop((provider_name, key), None)
+        
+        self._refreshing[(provider_name, key)] = asyncio.get_running_loop().create_task(refresh())
+    
+    def _get(self, provider_name: str, key: str):
+        with self._lock:
+            entry = self._entries.get((provider_name, key))
+            if entry is not None:
+                self._entries.move_to_end((provider_name, key))
+            return entry
+    
+    def _read(self, provider_name: str, keys: List[str]) -> Dict[str, Tuple[float, List[DocumentRequirement]]]:
+        """Executor: persisted entries for `keys`, in chunks below SQLite's parameter limit."""
+        entries = {}
+        with self._reader_lock:
+            if self._reader is None:
+                return entries
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._reader.execute(
+                    "SELECT key, stored_at, documents FROM provider_results"
+                    f" WHERE provider = ? AND key IN ({','.join('?' * len(chunk))})",
+                    (provider_name, *chunk),
+                ).fetchall()
+                for key, stored_at, documents in rows:
+                    entries[key] = (stored_at, [DocumentRequirement(**doc) for doc in json.loads(documents)])
+        return entries
+    
+    def _put(self, provider_name: str, key: str, documents: List[DocumentRequirement]):
+        entry = (time.time(), list(documents))
+        with self._lock:
+            self._insert((provider_name, key), entry)
+        if self._writer is not None:
+            try:
+                self._writes.put_nowait((provider_name, key, *entry))
+            except queue.Full:
+                self.dropped_writes += 1
+    
+    def _write_loop(self):
+        """Writer thread: drain queued entries and commit each drained batch once."""
+        while True:
+            items = [self._writes.get()]
+            while True:
+                try:
+                    items.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            
+            rows = [
+                (provider_name, key, stored_at, json.dumps([asdict(doc) for doc in documents]))
+                for provider_name, key, stored_at, documents in filter(None, items)
+            ]
+            if rows:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO provider_results (provider, key, stored_at, documents)"
+                        " VALUES (?, ?, ?, ?)",
+                        rows,
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Provider cache write failed: {e}")
+            if None in items:
+                return
+    
+    def _insert(self, cache_key: Tuple[str, str], entry):
+        self._entries[cache_key] = entry
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    async def wait_for_refreshes(self):
+        """Wait for background refreshes currently in flight."""
+        if self._refreshing:
+            await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Per-provider hit, miss and refresh counters."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "persistent": self._db is not None,
+            "pending_writes": self._writes.qsize(),
+            "dropped_writes": self.dropped_writes,
+            "refreshing": len(self._refreshing),
+            "providers": {name: dict(counts) for name, counts in self._metrics.items()},
+        }
+    
+    def close(self):
+        """Cancel refreshes, flush queued writes and close the database."""
+        for task in self._refreshing.values():
+            task.cancel()
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join(timeout=5)
+            if self._writer.is_alive():
+                # Closing the connection under a live writer would lose its batch
+                logger.warning("Provider cache writer did not finish within 5s; leaving the database open")
+                return
+            self._writer = None
+        with self._reader_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+ATTEMPT_LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class ProviderHTTPError(Exception):
+    """Non-200 response from a provider API."""
+    
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"API returned {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How provider requests are retried.
+    
+    Waits use full jitter, a uniform draw from [0, min(max_delay, base_delay *
+    2**attempt)], so clients that failed together do not retry together. A
+    Retry-After header replaces the drawn wait. No attempt or wait may run
+    past `total_timeout` seconds from the first attempt.
+    """
+    max_attempts: int = 3
+    base_delay: float = 0.25
+    max_delay: float = 4.0
+    total_timeout: float = 15.0
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+    respect_retry_after: bool = True
+    
+    def __post_init__(self):
+        if self.max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, got {self.max_attempts}")
+    
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number `attempt + 1` (0-based attempt)."""
+        if retry_after is not None and self.respect_retry_after:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+    
+    def classify(self, error: BaseException) -> Tuple[str, bool]:
+        """(outcome label, retryable) for a failed attempt."""
+        if isinstance(error, ProviderHTTPError):
+            if error.status == 429:
+                return "http_429", True
+            label = "http_5xx" if error.status >= 500 else "http_4xx"
+            return label, error.status in self.retry_statuses
+        if isinstance(error, asyncio.TimeoutError):
+            return "timeout", True
+        if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+            return "connection_error", True
+        # Malformed bodies and programming errors will not get better on retry
+        return "error", False
+
+
+class RetryMetrics:
+    """Per-attempt latency and outcome counters for one provider."""
+    
+    def __init__(self):
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self.attempt_latency_ms = Histogram(ATTEMPT_LATENCY_BUCKETS_MS)
+        self.requests = 0
+        self.retries = 0
+        self.gave_up = 0  # stopped early because the total time cap would be exceeded
+        self.backoff_seconds = 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "gave_up": self.gave_up,
+            "backoff_seconds": round(self.backoff_seconds, 4),
+            "outcomes": dict(self.outcomes),
+            "attempt_latency_ms": self.attempt_latency_ms.snapshot(),
+        }
+
+
 class ComplianceProvider(ABC):
     """Abstract base class for compliance data providers."""
     
-    def __init__(self, name: str, max_retries: int = 3, timeout: int = 10):
+    # Seconds a result stays fresh in ProviderResultCache; 0 means never cached
+    cache_ttl: float = 0.0
+    
+    # Providers with a bulk endpoint override get_required_documents_batch and
+    # set this; ComplianceIntegration then sends them one call per chunk of
+    # `max_batch_size` shipments instead of one per shipment
+    supports_batch: bool = False
+    max_batch_size: int = 500
+    
+    def __init__(
+        self,
+        name: str,
+        max_retries: int = 3,
+        timeout: int = 10,
+        http_client: Optional[SharedHTTPClient] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ):
         self.name = name
         self.max_retries = max_retries
         self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=max_retries)
+        self.retry_metrics = RetryMetrics()
+        # Set by ComplianceIntegration.register_provider; standalone providers pool their own
+        self.http_client = http_client
+    
+    def get_session(self) -> aiohttp.ClientSession:
+        """Pooled session for this provider's HTTP calls."""
+        if self.http_client is None:
+            self.http_client = SharedHTTPClient()
+        return self.http_client.session
     
     @abstractmethod
     async def get_required_documents(
@@ -55,6 +606,25 @@ class ComplianceProvider(ABC):
         """Get required documents for a shipment."""
         pass
     
+    async def get_required_documents_batch(
+        self,
+        shipments: Sequence[Shipment],
+        concurrency: int = 8,
+    ) -> List[List[DocumentRequirement]]:
+        """
+        Get required documents for many (hs_code, origin, destination, description) shipments.
+        
+        The default calls get_required_documents per shipment, `concurrency`
+        at a time. Results are in input order; the first failure is raised.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def one(shipment: Shipment) -> List[DocumentRequirement]:
+            async with semaphore:
+                return await self.get_required_documents(*shipment)
+        
+        return list(await asyncio.gather(*(one(shipment) for shipment in shipments)))
+    
     async def _retry_request(
         self,
         session: aiohttp.ClientSession,
@@ -62,35 +632,69 @@ class ComplianceProvider(ABC):
         url: str,
         **kwargs
     ) -> Any:
-        """Execute HTTP request with exponential backoff."""
-        for attempt in range(self.max_retries):
+        """Execute an HTTP request under the provider's retry policy."""
+        policy = self.retry_policy
+        metrics = self.retry_metrics
+        metrics.requests += 1
+        started = time.monotonic()
+        
+        for attempt in range(policy.max_attempts):
+            remaining = policy.total_timeout - (time.monotonic() - started)
+            # Each attempt gets the provider timeout, cut short by what is left of the cap
+            total = max(0.001, min(self.timeout, remaining))
+            if self.http_client:
+                timeout = self.http_client.timeout(total)
+            else:
+                timeout = aiohttp.ClientTimeout(total=total)
+            
+            attempt_start = time.perf_counter()
+            error = None
             try:
-                async with session.request(method, url, timeout=self.timeout, **kwargs) as resp:
-                    if resp.status == 200:
-                        return await resp.json()
-                    elif resp.status >= 500:
-                        if attempt < self.max_retries - 1:
-                            wait_time = 2 ** attempt
-                            logger.warning(
-                                f"{self.name}: Server error (attempt {attempt + 1}/{self.max_retries}), "
-                                f"retrying in {wait_time}s"
-                            )
-                            await asyncio.sleep(wait_time)
-                            continue
-                    raise Exception(f"API returned {resp.status}")
-            except asyncio.TimeoutError:
-                if attempt < self.max_retries - 1:
-                    logger.warning(f"{self.name}: Timeout (attempt {attempt + 1}/{self.max_retries})")
-                    await asyncio.sleep(2 ** attempt)
-                    continue
-                raise
+                async with session.request(method, url, timeout=timeout, **kwargs) as resp:
+                    if resp.status != 200:
+                        raise ProviderHTTPError(resp.status, parse_retry_after(resp.headers.get("Retry-After")))
+                    data = await resp.json()
+            except Exception as e:
+                error = e
+            metrics.attempt_latency_ms.observe((time.perf_counter() - attempt_start) * 1000)
+            
+            if error is None:
+                metrics.outcomes["success"] += 1
+                return data
+            
+            outcome, retryable = policy.classify(error)
+            metrics.outcomes[outcome] += 1
+            if not retryable or attempt == policy.max_attempts - 1:
+                raise error
+            
+            wait = policy.backoff(attempt, getattr(error, "retry_after", None))
+            if time.monotonic() - started + wait >= policy.total_timeout:
+                metrics.gave_up += 1
+                logger.warning(f"{self.name}: {outcome}, retry budget of {policy.total_timeout}s exhausted")
+                raise error
+            
+            logger.warning(
+                f"{self.name}: {outcome} (attempt {attempt + 1}/{policy.max_attempts}), "
+                f"retrying in {wait:.2f}s"
+            )
+            metrics.retries += 1
+            metrics.backoff_seconds += wait
+            await asyncio.sleep(wait)
         
-        raise Exception(f"Failed after {self.max_retries} attempts")
+        # Only reachable if max_attempts was set below 1 after construction
+        raise ValueError(f"{self.name}: retry policy allows no attempts (max_attempts={policy.max_attempts})")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Retry policy and per-attempt metrics for monitoring."""
+        return {"retries": self.retry_metrics.stats()}
 
 
 class DescartesProvider(ComplianceProvider):
     """Descartes compliance data provider."""
     
+    # Regulations change rarely; every lookup is an external round trip
+    cache_ttl = 3600.0
+    
     def __init__(
         self,
         api_key: str,
@@ -124,8 +728,7 @@ class DescartesProvider(ComplianceProvider):
         headers = {"Authorization": f"Bearer {self.api_key}"}
         
         try:
-            async with aiohttp.ClientSession() as session:
-                data = await self._retry_request(session, "GET", endpoint, params=params, headers=headers)
+            data = await self._retry_request(self.get_session(), "GET", endpoint, params=params, headers=headers)
             
             documents = []
             if isinstance(data, dict) and "documents" in data:
@@ -141,15 +744,27 @@ class DescartesProvider(ComplianceProvider):
             return documents
         
         except Exception as e:
+            # Raised rather than returned as [] so the failure is never cached as "no documents"
             logger.error(f"Descartes API error: {e}")
-            return []
+            raise
 
 
-class USDAProvider(ComplianceProvider):
-    """USDA food/agricultural import requirements provider."""
+class RuleTableProvider(ComplianceProvider):
+    """
+    Provider answering from a declarative rule table (compliance_rules.yaml).
     
-    def __init__(self, **kwargs):
-        super().__init__(name="USDA", **kwargs)
+    Rules are indexed by destination, HS chapter and keyword, and all keywords
+    are matched in one pass over the description, so adding rules or
+    jurisdictions is a table edit rather than new code.
+    """
+    
+    # A whole batch is one in-process table scan
+    supports_batch = True
+    max_batch_size = 10000
+    
+    def __init__(self, name: str, rules_path: Optional[str] = None, **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.engine = load_rule_table(rules_path)[name]
     
     async def get_required_documents(
         self,
@@ -159,104 +774,302 @@ class USDAProvider(ComplianceProvider):
         product_description: str,
         **kwargs
     ) -> List[DocumentRequirement]:
-        """Get USDA agricultural requirements."""
-        
-        # For food/agriculture products
-        is_food = any(kw in product_description.lower() for kw in ["food", "agricultural", "plant", "meat", "dairy"])
-        
-        if not is_food:
-            return []
-        
-        documents = []
-        
-        # USDA requires specific documents for food imports
-        documents.append(DocumentRequirement(
-            name="Health Certificate",
-            provider="USDA",
-            confidence=0.98,
-            description="Food safety certificate from origin country",
-            regulatory_basis="21 CFR Part 1 (FDA)",
-            required=True
-        ))
-        
-        documents.append(DocumentRequirement(
-            name="Phytosanitary Certificate",
-            provider="USDA",
-            confidence=0.95,
-            description="Plant health certificate",
-            regulatory_basis="IPPC Standards",
-            required="plant" in product_description.lower()
-        ))
-        
-        # Specific for meat products
-        if "meat" in product_description.lower() or "poultry" in product_description.lower():
-            documents.append(DocumentRequirement(
-                name="FSIS Import Permit",
-                provider="USDA",
-                confidence=0.99,
-                description="USDA FSIS permit for meat/poultry",
-                regulatory_basis="FSIS Regulations",
-                required=True
-            ))
-        
-        return documents
+        """Get the documents the rule table requires."""
+        return [
+            DocumentRequirement(**doc)
+            for doc in self.engine.evaluate(hs_code, origin_country, destination_country, product_description)
+        ]
+    
+    def evaluate_batch(self, shipments: Sequence[Shipment]) -> List[List[DocumentRequirement]]:
+        """Documents for many (hs_code, origin, destination, description) shipments in one pass."""
+        return [
+            [DocumentRequirement(**doc) for doc in docs]
+            for docs in self.engine.evaluate_batch(shipments)
+        ]
+    
+    async def get_required_documents_batch(
+        self,
+        shipments: Sequence[Shipment],
+        concurrency: int = 8,
+    ) -> List[List[DocumentRequirement]]:
+        """Get the documents the rule table requires for a batch of shipments."""
+        return self.evaluate_batch(shipments)
 
 
-class EuropeanComplianceProvider(ComplianceProvider):
+class USDAProvider(RuleTableProvider):
+    """USDA food/agricultural import requirements provider."""
+    
+    def __init__(self, **kwargs):
+        super().__init__(name="USDA", **kwargs)
+
+
+class EuropeanComplianceProvider(RuleTableProvider):
     """European Union/EMCS compliance provider."""
     
     def __init__(self, **kwargs):
         super().__init__(name="EUCompliance", **kwargs)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-provider breaker: after `failure_threshold` consecutive failed calls the
+    provider is skipped for `reset_timeout` seconds, then a single trial call
+    decides whether it closes again or stays open.
+    """
     
-    async def get_required_documents(
-        self,
-        hs_code: str,
-        origin_country: str,
-        destination_country: str,
-        product_description: str,
-        **kwargs
-    ) -> List[DocumentRequirement]:
-        """Get EU compliance requirements."""
-        
-        if not destination_country.startswith("EU-"):
-            return []
-        
-        documents = []
-        
-        # Check for CE marking required products
-        if any(kw in product_description.lower() for kw in ["electronic", "machinery", "medical", "toys"]):
-            documents.append(DocumentRequirement(
-                name="CE Declaration of Conformity",
-                provider="EU",
-                confidence=0.98,
-                description="EU CE marking declaration of conformity",
-                regulatory_basis="EU 2016/425",
-                required=True
-            ))
-        
-        # All imports to EU need customs documentation
-        documents.append(DocumentRequirement(
-            name="EUR-1 Form",
-            provider="EU",
-            confidence=0.95,
-            description="EU form of proof of origin",
-            regulatory_basis="EC 2454/93",
-            required=True
-        ))
-        
-        return documents
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._trial_in_flight = False
+    
+    def allow(self) -> bool:
+        """Whether a call may go out now."""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        if self.state == "closed":
+            return True
+        self.rejected += 1
+        return False
+    
+    def record(self, success: bool):
+        self._trial_in_flight = False
+        if success:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+@dataclass
+class ProviderResults:
+    """Merged documents from one lookup, plus the providers that did not contribute."""
+    documents: Dict[str, DocumentRequirement]
+    timed_out: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)  # circuit breaker open
+    # Seconds each provider took for this lookup, cache hits included
+    timings: Dict[str, float] = field(default_factory=dict)
+    
+    @property
+    def unavailable(self) -> List[str]:
+        return self.timed_out + self.failed + self.skipped
+    
+    @property
+    def partial(self) -> bool:
+        return bool(self.unavailable)
 
 
 class ComplianceIntegration:
     """Orchestrates multiple compliance providers."""
     
-    def __init__(self, mode: ComplianceMode = ComplianceMode.HYBRID):
+    def __init__(
+        self,
+        mode: ComplianceMode = ComplianceMode.HYBRID,
+        http_config: Optional[HTTPClientConfig] = None,
+        result_cache: Optional[ProviderResultCache] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        hedge_after: Optional[float] = None,
+        batch_concurrency: int = 16,
+    ):
         self.mode = mode
         self.providers: Dict[str, ComplianceProvider] = {}
+        self.http_client = SharedHTTPClient(http_config)
+        self.result_cache = result_cache
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # Seconds to wait on an upstream call before racing a second, identical one
+        self.hedge_after = hedge_after
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._hedge_counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hedged": 0, "hedge_wins": 0})
+        # One upstream call per (provider, lookup key) at a time; later callers join it
+        self._in_flight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._flight_counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"upstream_calls": 0, "coalesced": 0})
+        # Per-shipment calls in flight per provider during a batch lookup
+        self.batch_concurrency = batch_concurrency
+        self._batch_counts = {"batches": 0, "shipments": 0, "unique_keys": 0}
+        self._bulk_counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"bulk_calls": 0, "bulk_items": 0})
+        # Upstream call latency and outcomes (success, error, cancelled, circuit_open, deadline) per provider
+        self.provider_latency_ms: Dict[str, Histogram] = defaultdict(lambda: Histogram(STAGE_BUCKETS_MS))
+        self.provider_outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
     
     def register_provider(self, provider: ComplianceProvider):
-        """Register a compliance provider."""
+        """Register a compliance provider; it shares the integration's HTTP pool."""
+        if provider.http_client is None:
+            provider.http_client = self.http_client
         self.providers[provider.name] = provider
+        self.breakers[provider.name] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+    
+    async def start(self):
+        """Open the shared HTTP session (call from the app's startup)."""
+        await self.http_client.start()
+    
+    async def close(self):
+        """Close the shared HTTP session (call from the app's shutdown)."""
+        if self.result_cache:
+            self.result_cache.close()
+        await self.http_client.close()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http": self.http_client.stats(),
+            "result_cache": self.result_cache.stats() if self.result_cache else None,
+            "single_flight": {
+                "in_flight": len(self._in_flight),
+                "providers": {name: dict(counts) for name, counts in self._flight_counts.items()},
+            },
+            "providers": {name: provider.stats() for name, provider in self.providers.items()},
+            "provider_calls": {
+                name: {
+                    "latency_ms": self.provider_latency_ms[name].snapshot(),
+                    "outcomes": dict(self.provider_outcomes[name]),
+                }
+                for name in self.providers
+            },
+            "circuit_breakers": {name: breaker.stats() for name, breaker in self.breakers.items()},
+            "hedging": {
+                "hedge_after": self.hedge_after,
+                "providers": {name: dict(counts) for name, counts in self._hedge_counts.items()},
+            },
+            "batching": {
+                **self._batch_counts,
+                "concurrency": self.batch_concurrency,
+                "providers": {name: dict(counts) for name, counts in self._bulk_counts.items()},
+            },
+        }
+    
+    async def _guarded(
+        self,
+        provider: ComplianceProvider,
+        call: Callable[[], Awaitable[List[DocumentRequirement]]],
+    ) -> List[DocumentRequirement]:
+        """One upstream call behind the provider's circuit breaker, hedged if configured."""
+        breaker = self.breakers.setdefault(
+            provider.name, CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        )
+        outcomes = self.provider_outcomes[provider.name]
+        if not breaker.allow():
+            outcomes["circuit_open"] += 1
+            raise CircuitOpenError(f"{provider.name} circuit open")
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            result = await self._hedged(provider, call)
+            outcome = "success"
+            return result
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            breaker.record(outcome == "success")
+            self.provider_latency_ms[provider.name].observe((time.perf_counter() - start) * 1000)
+            outcomes[outcome] += 1
+    
+    async def _hedged(
+        self,
+        provider: ComplianceProvider,
+        call: Callable[[], Awaitable[List[DocumentRequirement]]],
+    ) -> List[DocumentRequirement]:
+        """Race a second call if the first is slower than `hedge_after`; the first success wins."""
+        if not self.hedge_after:
+            return await call()
+        
+        loop = asyncio.get_running_loop()
+        primary = loop.create_task(call())
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return primary.result()
+            
+            counts = self._hedge_counts[provider.name]
+            counts["hedged"] += 1
+            hedge = loop.create_task(call())
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            counts["hedge_wins"] += 1
+                        return task.result()
+            raise primary.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _single_flight(
+        self,
+        provider: ComplianceProvider,
+        key: str,
+        fetch: Callable[[], Awaitable[List[DocumentRequirement]]],
+    ) -> List[DocumentRequirement]:
+        """
+        Share one in-flight provider call between concurrent identical lookups.
+        
+        The call runs as its own task, so a caller that is cancelled or times out
+        does not cancel it for the others; every waiter gets the same result or
+        the same exception.
+        """
+        flight_key = (provider.name, key)
+        counts = self._flight_counts[provider.name]
+        task = self._in_flight.get(flight_key)
+        if task is not None:
+            counts["coalesced"] += 1
+        else:
+            counts["upstream_calls"] += 1
+            task = asyncio.get_running_loop().create_task(fetch())
+            self._in_flight[flight_key] = task
+            
+            def done(finished: asyncio.Task):
+                self._in_flight.pop(flight_key, None)
+                # Mark the exception retrieved even if every waiter has gone away
+                if not finished.cancelled():
+                    finished.exception()
+            
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+    
+    async def _lookup(
+        self,
+        provider: ComplianceProvider,
+        hs_code: str,
+        origin_country: str,
+        destination_country: str,
+        product_description: str,
+    ) -> List[DocumentRequirement]:
+        """One provider's documents, through the result cache when configured."""
+        shipment = (hs_code, origin_country, destination_country, product_description)
+        key = provider_cache_key(*shipment)
+        fetch = self._single_fetch(provider, key, shipment)
+        if self.result_cache is None:
+            return await fetch()
+        return await self.result_cache.get_or_fetch(provider, key, fetch)
     
     async def get_documents_from_providers(
         self,
@@ -264,39 +1077,230 @@ class ComplianceIntegration:
         origin_country: str,
         destination_country: str,
         product_description: str,
+        deadline: Optional[float] = None,
     ) -> Dict[str, DocumentRequirement]:
         """Get documents from all registered providers."""
+        results = await self.lookup_documents(
+            hs_code, origin_country, destination_country, product_description, deadline=deadline
+        )
+        return results.documents
+    
+    async def lookup_documents(
+        self,
+        hs_code: str,
+        origin_country: str,
+        destination_country: str,
+        product_description: str,
+        deadline: Optional[float] = None,
+    ) -> ProviderResults:
+        """
+        Get documents from all registered providers within an optional deadline.
         
-        results = {}
+        `deadline` is a `time.monotonic()` timestamp. Providers that have not
+        answered by then are reported as timed out rather than waited for; their
+        calls keep running and still fill the result cache for later requests.
+        """
+        timings: Dict[str, float] = {}
+        
+        async def timed(provider: ComplianceProvider) -> List[DocumentRequirement]:
+            start = time.perf_counter()
+            try:
+                return await self._lookup(provider, hs_code, origin_country, destination_country, product_description)
+            finally:
+                timings[provider.name] = time.perf_counter() - start
         
         # Run all provider calls concurrently
-        tasks = [
-            provider.get_required_documents(
+        tasks = [timed(provider) for provider in self.providers.values()]
+        if deadline is not None:
+            remaining = max(0.0, deadline - time.monotonic())
+            tasks = [asyncio.wait_for(task, remaining) for task in tasks]
+        
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        results = self._merge(responses)
+        results.timings = timings
+        return results
+    
+    async def get_documents_batch(
+        self,
+        shipments: Sequence[Shipment],
+        deadline: Optional[float] = None,
+    ) -> List[Dict[str, DocumentRequirement]]:
+        """Get documents from all registered providers for each shipment of a batch."""
+        return [results.documents for results in await self.lookup_documents_batch(shipments, deadline)]
+    
+    async def lookup_documents_batch(
+        self,
+        shipments: Sequence[Shipment],
+        deadline: Optional[float] = None,
+    ) -> List[ProviderResults]:
+        """
+        Look up a batch of (hs_code, origin, destination, description) shipments.
+        
+        Shipments with the same lookup key are looked up once and share one
+        ProviderResults. Providers with `supports_batch` get the distinct
+        uncached keys in bulk calls; the others are called per key, at most
+        `batch_concurrency` at a time. The cache, single-flight, circuit
+        breakers and `deadline` apply per key as in `lookup_documents`.
+        """
+        keys = [provider_cache_key(*shipment) for shipment in shipments]
+        unique: Dict[str, Shipment] = {}
+        for key, shipment in zip(keys, shipments):
+            unique.setdefault(key, tuple(shipment))
+        self._batch_counts["batches"] += 1
+        self._batch_counts["shipments"] += len(shipments)
+        self._batch_counts["unique_keys"] += len(unique)
+        
+        per_provider = await asyncio.gather(*(
+            self._lookup_bulk(provider, unique, deadline) if provider.supports_batch
+            else self._lookup_each(provider, unique, deadline)
+            for provider in self.providers.values()
+        ))
+        merged = {key: self._merge([responses[key] for responses in per_provider]) for key in unique}
+        return [merged[key] for key in keys]
+    
+    def _bounded(self, call: Awaitable, deadline: Optional[float]) -> Awaitable:
+        if deadline is None:
+            return call
+        return asyncio.wait_for(call, max(0.0, deadline - time.monotonic()))
+    
+    async def _lookup_each(
+        self,
+        provider: ComplianceProvider,
+        shipments: Dict[str, Shipment],
+        deadline: Optional[float],
+    ) -> Dict[str, Any]:
+        """Per-key lookups for a provider without a bulk endpoint; errors are returned, not raised."""
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        
+        async def one(shipment: Shipment) -> List[DocumentRequirement]:
+            async with semaphore:
+                return await self._lookup(provider, *shipment)
+        
+        responses = await asyncio.gather(
+            *(self._bounded(one(shipment), deadline) for shipment in shipments.values()),
+            return_exceptions=True,
+        )
+        return dict(zip(shipments, responses))
+    
+    async def _lookup_bulk(
+        self,
+        provider: ComplianceProvider,
+        shipments: Dict[str, Shipment],
+        deadline: Optional[float],
+    ) -> Dict[str, Any]:
+        """
+        Bulk lookups for a provider with `supports_batch`; errors are returned, not raised.
+        
+        Cached keys are answered from the cache (stale ones refreshed one by
+        one in the background) and keys already in flight are joined; the rest
+        go to the provider in chunks of `max_batch_size`, each chunk one call
+        behind the circuit breaker.
+        """
+        responses: Dict[str, Any] = {}
+        missing: Dict[str, Shipment] = {}
+        cache = self.result_cache
+        cached = await cache.lookup_many(provider, list(shipments)) if cache is not None else {}
+        for key, shipment in shipments.items():
+            documents, stale = cached.get(key, (None, False))
+            if stale:
+                cache.schedule_refresh(provider, key, self._single_fetch(provider, key, shipment))
+            if documents is None:
+                missing[key] = shipment
+            else:
+                responses[key] = documents
+        if not missing:
+            return responses
+        
+        loop = asyncio.get_running_loop()
+        to_fetch = [key for key in missing if (provider.name, key) not in self._in_flight]
+        chunks: Dict[str, Tuple[asyncio.Task, int]] = {}
+        for start in range(0, len(to_fetch), provider.max_batch_size):
+            chunk = to_fetch[start:start + provider.max_batch_size]
+            task = loop.create_task(self._bulk_call(provider, [missing[key] for key in chunk]))
+            for index, key in enumerate(chunk):
+                chunks[key] = (task, index)
+        
+        async def pick(key: str) -> List[DocumentRequirement]:
+            if key in chunks:
+                task, index = chunks[key]
+                documents = (await asyncio.shield(task))[index]
+            else:
+                # Its in-flight call finished before this batch could join it
+                documents = await self._guarded(provider, lambda: provider.get_required_documents(*missing[key]))
+            if cache is not None:
+                cache.put(provider, key, documents)
+            return documents
+        
+        # Keys in flight elsewhere are joined; the others are registered so
+        # concurrent single lookups join this batch's bulk call instead
+        fetched = await asyncio.gather(
+            *(
+                self._bounded(self._single_flight(provider, key, lambda key=key: pick(key)), deadline)
+                for key in missing
+            ),
+            return_exceptions=True,
+        )
+        responses.update(zip(missing, fetched))
+        return responses
+    
+    async def _bulk_call(self, provider: ComplianceProvider, shipments: List[Shipment]) -> List[List[DocumentRequirement]]:
+        counts = self._bulk_counts[provider.name]
+        counts["bulk_calls"] += 1
+        counts["bulk_items"] += len(shipments)
+        return await self._guarded(provider, lambda: provider.get_required_documents_batch(shipments))
+    
+    def _single_fetch(
+        self,
+        provider: ComplianceProvider,
+        key: str,
+        shipment: Shipment,
+    ) -> Callable[[], Awaitable[List[DocumentRequirement]]]:
+        """One provider call for one shipment, coalesced and behind the breaker."""
+        hs_code, origin_country, destination_country, product_description = shipment
+        
+        def call_provider():
+            return provider.get_required_documents(
                 hs_code=hs_code,
                 origin_country=origin_country,
                 destination_country=destination_country,
                 product_description=product_description,
             )
-            for provider in self.providers.values()
-        ]
         
-        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        # Cache misses and background refreshes are both coalesced; a fresh or
+        # stale cached value is still served while the breaker is open
+        async def fetch():
+            return await self._single_flight(provider, key, lambda: self._guarded(provider, call_provider))
         
+        return fetch
+    
+    def _merge(self, responses: Sequence[Any]) -> ProviderResults:
+        """Merge one response (or exception) per registered provider, in registration order."""
+        results = ProviderResults(documents={})
         for provider, response in zip(self.providers.values(), responses):
+            if isinstance(response, CircuitOpenError):
+                results.skipped.append(provider.name)
+                continue
+            if isinstance(response, asyncio.TimeoutError):
+                self.provider_outcomes[provider.name]["deadline"] += 1
+                logger.warning(f"Provider {provider.name} missed the request deadline")
+                results.timed_out.append(provider.name)
+                continue
             if isinstance(response, Exception):
                 logger.error(f"Provider {provider.name} error: {response}")
+                results.failed.append(provider.name)
                 continue
             
+            documents = results.documents
             for doc in response:
-                if doc.name not in results:
-                    results[doc.name] = doc
+                if doc.name not in documents:
+                    documents[doc.name] = doc
                 else:
                     # Keep highest confidence
                     if doc.confidence and (
-                        not results[doc.name].confidence or
-                        doc.confidence > results[doc.name].confidence
+                        not documents[doc.name].confidence or
+                        doc.confidence > documents[doc.name].confidence
                     ):
-                        results[doc.name] = doc
+                        documents[doc.name] = doc
         
         return results
 
@@ -304,10 +1308,19 @@ class ComplianceIntegration:
 def create_default_integration(
     mode: ComplianceMode = ComplianceMode.HYBRID,
     descartes_api_key: Optional[str] = None,
+    http_config: Optional[HTTPClientConfig] = None,
+    result_cache: Optional[ProviderResultCache] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    **integration_kwargs,
 ) -> ComplianceIntegration:
     """Create a compliance integration with default providers."""
     
-    integration = ComplianceIntegration(mode=mode)
+    integration = ComplianceIntegration(
+        mode=mode,
+        http_config=http_config,
+        result_cache=result_cache,
+        **integration_kwargs,
+    )
     
     # Register rule-based providers
     integration.register_provider(USDAProvider())
@@ -315,6 +1328,6 @@ def create_default_integration(
     
     # Register API-based provider if credentials available
     if descartes_api_key:
-        integration.register_provider(DescartesProvider(api_key=descartes_api_key))
+        integration.register_provider(DescartesProvider(api_key=descartes_api_key, retry_policy=retry_policy))
     
     return integration
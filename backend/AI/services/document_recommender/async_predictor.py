@@ -0,0 +1,327 @@
+"""
+Async Predictor Facade
+Runs CPU-bound DocumentPredictor inference on a thread or process pool so async
+handlers never block the event loop, with optional micro-batching of single requests
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from predict_documents import DocumentHit, DocumentPredictionRequest, DocumentPredictor
+from service_metrics import STAGE_BUCKETS_MS, Histogram, StageTimings
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_KINDS = ("thread", "process")
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_TIME_BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100)
+
+# Errors a single bad request can cause; anything else fails the whole batch
+REQUEST_ERRORS = (ValueError, TypeError)
+
+# Predictor owned by each process-pool worker
+_worker_predictor: Optional[DocumentPredictor] = None
+
+
+def _init_process_worker(model_path: str, fingerprint: str, predictor_kwargs: Dict[str, Any]):
+    """
+    Load the parent's model version once per worker.
+
+    `model_path` is the version directory the parent loaded, not the models
+    directory, so a version published since then is never picked up here.
+    Memory-mapped weights are shared between workers.
+    """
+    global _worker_predictor
+    _worker_predictor = DocumentPredictor(models_dir=model_path, **predictor_kwargs)
+    _worker_predictor.load_model()
+    if _worker_predictor.model_fingerprint != fingerprint:
+        raise RuntimeError(
+            f"Worker loaded model {_worker_predictor.model_fingerprint} from {model_path}, "
+            f"expected {fingerprint}"
+        )
+
+
+def _predict_in_worker(
+    requests: List[DocumentPredictionRequest],
+    confidence_threshold: float,
+) -> Tuple[List[List[DocumentHit]], StageTimings]:
+    timings = StageTimings()
+    results = _worker_predictor.predict_batch(requests, confidence_threshold=confidence_threshold, timings=timings)
+    return results, timings
+
+
+class AsyncDocumentPredictor:
+    """
+    Awaitable front for a loaded DocumentPredictor.
+
+    With `executor="thread"` inference runs on a thread pool against the shared
+    predictor; NumPy and torch release the GIL during the heavy work. With
+    `executor="process"` every worker loads its own copy of the model version the
+    parent predictor loaded, which sidesteps the GIL entirely. At most `max_concurrency` inference calls
+    are handed to the pool at once; further callers wait on a semaphore.
+    """
+
+    def __init__(
+        self,
+        predictor: DocumentPredictor,
+        executor: str = "thread",
+        max_workers: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        predictor_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        if executor not in EXECUTOR_KINDS:
+            raise ValueError(f"executor must be one of {EXECUTOR_KINDS}, got {executor!r}")
+
+        self.predictor = predictor
+        self.executor_kind = executor
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_concurrency = max_concurrency or self.max_workers
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._executor: Executor
+        if executor == "process":
+            if predictor.model_path is None:
+                raise ValueError("Load the predictor's model before starting process workers")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_process_worker,
+                initargs=(str(predictor.model_path), predictor.model_fingerprint, predictor_kwargs or {}),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference",
+            )
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        # Per inference call: encode/transform/score/select, plus time waiting for a worker
+        self.stage_ms: Dict[str, Histogram] = {}
+
+    @property
+    def model_components(self):
+        return self.predictor.model_components
+
+    async def predict(
+        self,
+        request: DocumentPredictionRequest,
+        confidence_threshold: float = 0.5,
+        timings: Optional[StageTimings] = None,
+    ) -> List[DocumentHit]:
+        """Predict documents for one shipment off the event loop."""
+        return (await self.predict_batch([request], confidence_threshold, timings))[0]
+
+    async def predict_batch(
+        self,
+        requests: List[DocumentPredictionRequest],
+        confidence_threshold: float = 0.5,
+        timings: Optional[StageTimings] = None,
+    ) -> List[List[DocumentHit]]:
+        """
+        Predict documents for a batch of shipments in one pool call.
+
+        The call's stage timings are recorded in `stage_ms` and, when given,
+        added to `timings`.
+        """
+        loop = asyncio.get_running_loop()
+        call_timings = StageTimings()
+        if self.executor_kind == "process":
+            fn = partial(_predict_in_worker, requests, confidence_threshold)
+        else:
+            fn = partial(self.predictor.predict_batch, requests, confidence_threshold, timings=call_timings)
+
+        self.waiting += 1
+        try:
+            with call_timings.stage("pool_wait"):
+                await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            result = await loop.run_in_executor(self._executor, fn)
+            if self.executor_kind == "process":
+                result, worker_timings = result
+                call_timings.update(worker_timings)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._observe(call_timings)
+            if timings is not None:
+                timings.update(call_timings)
+
+    def _observe(self, timings: StageTimings):
+        for stage, seconds in timings.items():
+            if stage not in self.stage_ms:
+                self.stage_ms[stage] = Histogram(STAGE_BUCKETS_MS)
+            self.stage_ms[stage].observe(seconds * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool counters for monitoring."""
+        return {
+            "executor": self.executor_kind,
+            "max_workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "stage_ms": {stage: histogram.snapshot() for stage, histogram in self.stage_ms.items()},
+        }
+
+    def close(self):
+        """Stop the pool, letting running inference finish."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class MicroBatcher:
+    """
+    Groups concurrent single predictions into one batched inference call.
+
+    Requests queue up and are dispatched when `max_batch_size` is reached or
+    the oldest has waited `max_delay_ms`. The delay only applies under load:
+    when no batch is in flight and nothing else is queued, a request is
+    dispatched at once, so an idle service adds no latency. Each batch is
+    split back per caller; requests with different thresholds are scored in
+    separate calls. When a call fails on a request error (REQUEST_ERRORS) its
+    requests are split in half and re-scored, so only the request that fails
+    on its own gets the error; any other failure is systemic and fails every
+    request in the call without retrying.
+    """
+
+    def __init__(
+        self,
+        predictor: AsyncDocumentPredictor,
+        max_batch_size: int = 32,
+        max_delay_ms: float = 2.0,
+    ):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_times_ms = Histogram(QUEUE_TIME_BUCKETS_MS)
+        self.in_flight = 0
+        self.failed_splits = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._dispatches = set()
+        self._loop = None
+
+    def _ensure_running(self):
+        """Start the collector on the current event loop (restarting it if the loop changed)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._collector is None or self._collector.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self.in_flight = 0
+            self._collector = loop.create_task(self._collect())
+
+    async def predict(
+        self,
+        request: DocumentPredictionRequest,
+        confidence_threshold: float = 0.5,
+        timings: Optional[StageTimings] = None,
+    ) -> List[DocumentHit]:
+        """
+        Queue one request and wait for its share of a batched inference.
+
+        `timings`, when given, receives the time spent queued plus the stage
+        timings of the batch the request ran in.
+        """
+        self._ensure_running()
+        future = self._loop.create_future()
+        await self._queue.put((request, confidence_threshold, time.perf_counter(), future, timings))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self.in_flight or not self._queue.empty():
+                deadline = loop.time() + self.max_delay
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            # Inference runs as its own task so the next batch can form meanwhile
+            task = loop.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[DocumentPredictionRequest, float, float, asyncio.Future, Optional[StageTimings]]]):
+        now = time.perf_counter()
+        self.batch_sizes.observe(len(batch))
+        for _, _, queued_at, _, timings in batch:
+            self.queue_times_ms.observe((now - queued_at) * 1000)
+            if timings is not None:
+                timings["batch_queue"] = now - queued_at
+
+        by_threshold: Dict[float, List] = {}
+        for item in batch:
+            by_threshold.setdefault(item[1], []).append(item)
+
+        self.in_flight += 1
+        try:
+            await asyncio.gather(*(
+                self._score(threshold, items) for threshold, items in by_threshold.items()
+            ))
+        finally:
+            self.in_flight -= 1
+
+    async def _score(self, threshold: float, items: List):
+        batch_timings = StageTimings()
+        try:
+            results = await self.predictor.predict_batch(
+                [request for request, _, _, _, _ in items],
+                confidence_threshold=threshold,
+                timings=batch_timings,
+            )
+        except Exception as e:
+            if len(items) > 1 and isinstance(e, REQUEST_ERRORS):
+                # Bisect so one bad request cannot fail the unrelated ones scored with it
+                self.failed_splits += 1
+                middle = len(items) // 2
+                await asyncio.gather(self._score(threshold, items[:middle]), self._score(threshold, items[middle:]))
+                return
+            for _, _, _, future, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, _, future, timings), result in zip(items, results):
+            if timings is not None:
+                timings.update(batch_timings)
+            # The caller may have been cancelled while waiting
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batching settings and histograms for monitoring."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_delay_ms": self.max_delay * 1000,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches_in_flight": self.in_flight,
+            "failed_splits": self.failed_splits,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_time_ms": self.queue_times_ms.snapshot(),
+        }
+
+    def close(self):
+        if self._collector is not None:
+            self._collector.cancel()
+        for task in self._dispatches:
+            task.cancel()
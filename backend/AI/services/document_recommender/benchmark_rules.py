@@ -0,0 +1,246 @@
+"""
+Compliance Rule Benchmark
+Times the rule-table providers against the former hard-coded USDA/EU providers, and
+shows how evaluation cost changes as the rule table grows.
+"""
+import argparse
+import json
+import random
+import string
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+
+from api_integration import DocumentRequirement
+from generate_synthetic_data import generate_chunk
+from rule_engine import RuleEngine, Shipment, _read_config, DEFAULT_RULES_PATH
+
+DEFAULT_RULE_COUNTS = [0, 100, 1_000, 10_000]
+EU_DESTINATIONS = ["EU-DE", "EU-FR", "EU-NL", "EU-IT"]
+
+
+def legacy_usda_documents(hs_code, origin_country, destination_country, product_description) -> List[DocumentRequirement]:
+    """USDAProvider.get_required_documents before the rule table, kept as the baseline."""
+    is_food = any(kw in product_description.lower() for kw in ["food", "agricultural", "plant", "meat", "dairy"])
+    if not is_food:
+        return []
+    documents = [
+        DocumentRequirement(
+            name="Health Certificate", provider="USDA", confidence=0.98,
+            description="Food safety certificate from origin country",
+            regulatory_basis="21 CFR Part 1 (FDA)", required=True,
+        ),
+        DocumentRequirement(
+            name="Phytosanitary Certificate", provider="USDA", confidence=0.95,
+            description="Plant health certificate", regulatory_basis="IPPC Standards",
+            required="plant" in product_description.lower(),
+        ),
+    ]
+    if "meat" in product_description.lower() or "poultry" in product_description.lower():
+        documents.append(DocumentRequirement(
+            name="FSIS Import Permit", provider="USDA", confidence=0.99,
+            description="USDA FSIS permit for meat/poultry",
+            regulatory_basis="FSIS Regulations", required=True,
+        ))
+    return documents
+
+
+def legacy_eu_documents(hs_code, origin_country, destination_country, product_description) -> List[DocumentRequirement]:
+    """EuropeanComplianceProvider.get_required_documents before the rule table, kept as the baseline."""
+    if not destination_country.startswith("EU-"):
+        return []
+    documents = []
+    if any(kw in product_description.lower() for kw in ["electronic", "machinery", "medical", "toys"]):
+        documents.append(DocumentRequirement(
+            name="CE Declaration of Conformity", provider="EU", confidence=0.98,
+            description="EU CE marking declaration of conformity",
+            regulatory_basis="EU 2016/425", required=True,
+        ))
+    documents.append(DocumentRequirement(
+        name="EUR-1 Form", provider="EU", confidence=0.95,
+        description="EU form of proof of origin", regulatory_basis="EC 2454/93", required=True,
+    ))
+    return documents
+
+
+def sample_shipments(count: int, seed: int = 42) -> List[Shipment]:
+    """Synthetic shipments, a quarter of them bound for EU destinations."""
+    df = generate_chunk(0, count, count, seed)
+    rng = random.Random(seed)
+    return [
+        (
+            row.hs_code,
+            row.origin_country,
+            rng.choice(EU_DESTINATIONS) if rng.random() < 0.25 else row.destination_country,
+            row.product_description,
+        )
+        for row in df.itertuples(index=False)
+    ]
+
+
+def synthetic_rules(count: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Extra keyword rules spread over destinations and chapters, none of which fire on real descriptions."""
+    rng = random.Random(seed)
+    destinations = ["*", "US", "GB", "JP", "CN", "SG", "EU-*"]
+    rules = []
+    for i in range(count):
+        keywords = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(7, 12))) for _ in range(3)]
+        rule = {
+            "id": f"synthetic-{i}",
+            "document": f"Synthetic Permit {i}",
+            "keywords": keywords,
+            "destinations": [rng.choice(destinations)],
+        }
+        if rng.random() < 0.7:
+            rule["hs_chapters"] = [f"{rng.randint(1, 97):02d}"]
+        rules.append(rule)
+    return rules
+
+
+def scaled_engine(base_config: Dict[str, Any], extra_rules: int, seed: int = 42) -> RuleEngine:
+    """The USDA table plus `extra_rules` synthetic rules."""
+    config = dict(base_config["providers"]["USDA"])
+    config["rules"] = list(config["rules"]) + synthetic_rules(extra_rules, seed)
+    return RuleEngine.from_config(config, config.get("source", "USDA"))
+
+
+def if_chain(rules: Sequence[Dict[str, Any]]) -> Callable:
+    """What the providers' if-chains become with one keyword scan per rule."""
+    keyword_lists = [rule.get("keywords", []) for rule in rules]
+
+    def evaluate(hs_code, origin_country, destination_country, product_description):
+        return [
+            i for i, keywords in enumerate(keyword_lists)
+            if any(kw in product_description.lower() for kw in keywords)
+        ]
+    return evaluate
+
+
+def time_per_shipment(fn: Callable, shipments: Sequence[Shipment], repeats: int) -> float:
+    """Best-of-`repeats` mean microseconds per shipment."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for shipment in shipments:
+            fn(*shipment)
+        best = min(best, time.perf_counter() - start)
+    return best / len(shipments) * 1e6
+
+
+def time_batch(engine: RuleEngine, shipments: Sequence[Shipment], repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        engine.evaluate_batch(shipments)
+        best = min(best, time.perf_counter() - start)
+    return best / len(shipments) * 1e6
+
+
+def run_benchmark(
+    shipments_count: int = 2_000,
+    rule_counts: Sequence[int] = DEFAULT_RULE_COUNTS,
+    rules_path: str = None,
+    repeats: int = 3,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """Per-shipment cost of the legacy providers, the rule tables, and both as the table grows."""
+    config = _read_config(Path(rules_path or DEFAULT_RULES_PATH))
+    engines = {
+        name: RuleEngine.from_config(spec, spec.get("source", name))
+        for name, spec in config["providers"].items()
+    }
+    shipments = sample_shipments(shipments_count, seed)
+
+    def rule_providers(*shipment):
+        return [
+            [DocumentRequirement(**doc) for doc in engine.evaluate(*shipment)]
+            for engine in engines.values()
+        ]
+
+    def legacy_providers(*shipment):
+        return [legacy_usda_documents(*shipment), legacy_eu_documents(*shipment)]
+
+    def rule_providers_batch():
+        return [
+            [[DocumentRequirement(**doc) for doc in docs] for docs in engine.evaluate_batch(shipments)]
+            for engine in engines.values()
+        ]
+
+    batch_best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        rule_providers_batch()
+        batch_best = min(batch_best, time.perf_counter() - start)
+
+    scaling = []
+    for count in rule_counts:
+        engine = scaled_engine(config, count, seed)
+        chain = if_chain(list(config["providers"]["USDA"]["rules"]) + synthetic_rules(count, seed))
+        scaling.append({
+            "rules": len(engine.rules),
+            "engine_us": round(time_per_shipment(engine.evaluate, shipments, repeats), 2),
+            "engine_batch_us": round(time_batch(engine, shipments, repeats), 2),
+            "if_chain_us": round(time_per_shipment(chain, shipments, repeats), 2),
+        })
+
+    return {
+        "shipments": len(shipments),
+        "providers": {
+            "legacy_us": round(time_per_shipment(legacy_providers, shipments, repeats), 2),
+            "rule_table_us": round(time_per_shipment(rule_providers, shipments, repeats), 2),
+            "rule_table_batch_us": round(batch_best / len(shipments) * 1e6, 2),
+        },
+        "scaling": scaling,
+        "engine_growth": _growth(scaling, "engine_us"),
+        "if_chain_growth": _growth(scaling, "if_chain_us"),
+    }
+
+
+def _growth(scaling: List[Dict[str, Any]], key: str) -> float:
+    """Log-log slope of cost against rule count: ~0 is constant, ~1 is linear."""
+    points = [(row["rules"], row[key]) for row in scaling if row["rules"] > 0 and row[key] > 0]
+    if len(points) < 2:
+        return 0.0
+    x, y = np.log([p[0] for p in points]), np.log([p[1] for p in points])
+    return round(float(np.polyfit(x, y, 1)[0]), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compliance rule tables against the former providers")
+    parser.add_argument("--shipments", type=int, default=2_000, help="Synthetic shipments per measurement")
+    parser.add_argument(
+        "--rule-counts",
+        type=int,
+        nargs="+",
+        default=DEFAULT_RULE_COUNTS,
+        help="Synthetic rules added to the USDA table for the scaling run"
+    )
+    parser.add_argument("--rules", type=str, help="Rule table to benchmark (defaults to compliance_rules.yaml)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed repetitions; the best is reported")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=str, help="Optional JSON report path")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.shipments, args.rule_counts, args.rules, args.repeats, args.seed)
+
+    providers = report["providers"]
+    print(f"Per shipment over {report['shipments']:,} shipments (USDA + EU):")
+    print(f"  legacy providers      {providers['legacy_us']:>8.2f} µs")
+    print(f"  rule table            {providers['rule_table_us']:>8.2f} µs")
+    print(f"  rule table (batch)    {providers['rule_table_batch_us']:>8.2f} µs")
+    print(f"\n{'rules':>8} {'engine':>10} {'batch':>10} {'if-chain':>10}   (µs per shipment)")
+    for row in report["scaling"]:
+        print(f"{row['rules']:>8,} {row['engine_us']:>10.2f} {row['engine_batch_us']:>10.2f} {row['if_chain_us']:>10.2f}")
+    print(f"\nGrowth exponent: engine {report['engine_growth']}, if-chain {report['if_chain_growth']}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
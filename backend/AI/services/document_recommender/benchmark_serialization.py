@@ -0,0 +1,187 @@
+"""
+Response Serialization Benchmark
+Times building and encoding /predict-batch responses on the former pydantic path
+against the DocumentHit + FastJSONResponse path
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from fast_json import HAS_ORJSON, FastJSONResponse
+from predict_documents import (
+    DocumentPredictionResponse,
+    DocumentPredictor,
+    PredictedDocument,
+    merge_ml_and_api_predictions,
+)
+
+LABELS = [
+    "Commercial Invoice", "Packing List", "Bill of Lading", "Certificate of Origin",
+    "Health Certificate", "Phytosanitary Certificate", "CE Declaration of Conformity",
+    "EUR-1 Form", "FSIS Import Permit", "Dangerous Goods Declaration", "Import License",
+    "Export Declaration",
+]
+API_DOCUMENTS = {
+    "Health Certificate": {
+        "confidence": 0.98, "description": "Food safety certificate from origin country",
+        "regulatory_basis": "21 CFR Part 1 (FDA)",
+    },
+    "Phytosanitary Certificate": {
+        "confidence": 0.95, "description": "Plant health certificate", "regulatory_basis": "IPPC Standards",
+    },
+    "EUR-1 Form": {
+        "confidence": 0.95, "description": "EU form of proof of origin", "regulatory_basis": "EC 2454/93",
+    },
+}
+
+
+def legacy_select_documents(probabilities: np.ndarray, thresholds: np.ndarray, threshold: float) -> List[List[PredictedDocument]]:
+    """DocumentPredictor._select_documents before DocumentHit, kept as the baseline."""
+    cutoffs = np.maximum(thresholds, threshold)
+    selected = probabilities >= cutoffs
+    order = np.argsort(-probabilities, axis=1, kind="stable")
+    selected_sorted = np.take_along_axis(selected, order, axis=1)
+    return [
+        [
+            PredictedDocument(name=LABELS[idx], confidence=float(row_probs[idx]), provenance="ml")
+            for idx in row_order[row_selected]
+        ]
+        for row_probs, row_order, row_selected in zip(probabilities, order, selected_sorted)
+    ]
+
+
+async def legacy_merge(ml_predictions, api_predictions, ml_weight=0.6, api_weight=0.4) -> List[PredictedDocument]:
+    """merge_ml_and_api_predictions before DocumentHit (deep copies), kept as the baseline."""
+    merged = {}
+    for doc in ml_predictions:
+        merged[doc.name] = doc.model_copy(deep=True)
+    for doc_name, api_doc in api_predictions.items():
+        if doc_name in merged:
+            ml_conf = merged[doc_name].confidence
+            api_conf = api_doc.get("confidence", 0.9)
+            merged[doc_name].confidence = (ml_conf * ml_weight + api_conf * api_weight) / (ml_weight + api_weight)
+            merged[doc_name].provenance = "hybrid"
+        else:
+            merged[doc_name] = PredictedDocument(
+                name=doc_name,
+                confidence=api_doc.get("confidence", 0.9),
+                provenance="api",
+                description=api_doc.get("description"),
+                regulatory_basis=api_doc.get("regulatory_basis"),
+            )
+    results = list(merged.values())
+    results.sort(key=lambda x: x.confidence, reverse=True)
+    return results
+
+
+def _response_fields(i: int, threshold: float) -> Dict[str, Any]:
+    return {
+        "shipment_id": f"batch_{i}",
+        "mode": "hybrid",
+        "model_version": "benchmark",
+        "timestamp": datetime.utcnow().isoformat(),
+        "confidence_threshold": threshold,
+        "partial": False,
+        "unavailable_providers": [],
+    }
+
+
+async def legacy_batch(probabilities, thresholds, threshold) -> bytes:
+    """Former /predict-batch: validated models, deep-copy merge, jsonable_encoder + JSONResponse."""
+    results = []
+    for i, ml in enumerate(legacy_select_documents(probabilities, thresholds, threshold)):
+        merged = await legacy_merge(ml, API_DOCUMENTS)
+        results.append(DocumentPredictionResponse(predicted_documents=merged, **_response_fields(i, threshold)))
+    return JSONResponse(jsonable_encoder({"results": results})).body
+
+
+async def fast_batch(predictor: DocumentPredictor, probabilities, threshold) -> bytes:
+    """Current /predict-batch: DocumentHits, copy-free merge, plain dicts + FastJSONResponse."""
+    results = []
+    for i, ml in enumerate(predictor._select_documents(probabilities, threshold)):
+        merged = await merge_ml_and_api_predictions(ml, API_DOCUMENTS)
+        results.append({"predicted_documents": merged, **_response_fields(i, threshold)})
+    return FastJSONResponse({"results": results}).body
+
+
+def _best_ms(fn: Callable[[], Any], repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run_benchmark(items: int = 1_000, repeats: int = 5, threshold: float = 0.3, seed: int = 42) -> Dict[str, Any]:
+    """Best-of-`repeats` milliseconds to build and encode one `items`-shipment batch response."""
+    rng = np.random.default_rng(seed)
+    probabilities = rng.random((items, len(LABELS)))
+    thresholds = np.full(len(LABELS), 0.5)
+
+    predictor = DocumentPredictor(embedding_cache_size=0)
+    predictor.model_components = SimpleNamespace(decision_thresholds=thresholds, label_names=LABELS)
+
+    legacy = lambda: asyncio.run(legacy_batch(probabilities, thresholds, threshold))
+    fast = lambda: asyncio.run(fast_batch(predictor, probabilities, threshold))
+
+    # Same documents either way; only timestamps differ
+    legacy_body, fast_body = legacy(), fast()
+    documents = lambda body: [r["predicted_documents"] for r in json.loads(body)["results"]]
+    if documents(legacy_body) != documents(fast_body):
+        raise AssertionError("fast path produced different documents")
+
+    stages = {
+        "legacy": {
+            "select_ms": _best_ms(lambda: legacy_select_documents(probabilities, thresholds, threshold), repeats),
+            "total_ms": _best_ms(legacy, repeats),
+        },
+        "fast": {
+            "select_ms": _best_ms(lambda: predictor._select_documents(probabilities, threshold), repeats),
+            "total_ms": _best_ms(fast, repeats),
+        },
+    }
+    return {
+        "items": items,
+        "documents": sum(len(r["predicted_documents"]) for r in json.loads(fast_body)["results"]),
+        "encoder": "orjson" if HAS_ORJSON else "json",
+        "response_bytes": len(fast_body),
+        **{path: {k: round(v, 2) for k, v in timings.items()} for path, timings in stages.items()},
+        "speedup": round(stages["legacy"]["total_ms"] / stages["fast"]["total_ms"], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /predict-batch response building and encoding")
+    parser.add_argument("--items", type=int, default=1_000, help="Shipments per batch response")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed repetitions; the best is reported")
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=str, help="Optional JSON report path")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.items, args.repeats, args.threshold, args.seed)
+
+    print(f"{report['items']:,}-item batch, {report['documents']:,} documents, {report['encoder']} encoder:")
+    for path in ("legacy", "fast"):
+        print(f"  {path:<8} select {report[path]['select_ms']:>8.2f} ms   total {report[path]['total_ms']:>8.2f} ms")
+    print(f"  speedup  {report['speedup']}x")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Training Performance Benchmark
+Times every DocumentRequirementTrainer stage and its peak RSS on synthetic datasets of
+increasing size, and writes a JSON/CSV report with a scaling summary.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import sklearn
+
+from generate_synthetic_data import write_synthetic_dataset
+from train_model import DocumentRequirementTrainer
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+CSV_FIELDS = ["rows", "stage", "seconds", "peak_rss_mb", "rss_delta_mb"]
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process (falls back to the lifetime peak off Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RSSSampler:
+    """Background thread tracking the highest RSS seen since the last reset."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    def reset(self) -> int:
+        self.peak = current_rss_bytes()
+        return self.peak
+
+    def __enter__(self) -> "RSSSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class BenchmarkTrainer(DocumentRequirementTrainer):
+    """Trainer that also records the peak RSS of every timed stage."""
+
+    def __init__(self, sampler: RSSSampler, **kwargs):
+        super().__init__(**kwargs)
+        self.sampler = sampler
+        self.stage_memory: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def _stage(self, name: str):
+        start_rss = self.sampler.reset()
+        with super()._stage(name):
+            yield
+        peak = max(self.sampler.peak, current_rss_bytes())
+        self.stage_memory[name] = {
+            "peak_rss_mb": round(peak / 2 ** 20, 1),
+            "rss_delta_mb": round((peak - start_rss) / 2 ** 20, 1),
+        }
+
+
+def dataset_path(data_dir: Path, rows: int, seed: int) -> Path:
+    return data_dir / f"shipments_{rows}_seed{seed}.csv"
+
+
+def run_size(
+    rows: int,
+    data_dir: str,
+    seed: int = 42,
+    n_jobs: int = -1,
+    tune_thresholds: bool = False,
+    generate_workers: int = 1,
+) -> Dict[str, Any]:
+    """Generate (or reuse) one dataset and benchmark a full training run on it."""
+    data_file = dataset_path(Path(data_dir), rows, seed)
+    generate_seconds = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not data_file.exists():
+            start = time.perf_counter()
+            write_synthetic_dataset(str(data_file), num_records=rows, seed=seed, workers=generate_workers)
+            generate_seconds = round(time.perf_counter() - start, 4)
+
+        with RSSSampler() as sampler:
+            trainer = BenchmarkTrainer(sampler, n_jobs=n_jobs)
+            start = time.perf_counter()
+            trainer.train(data_file=str(data_file), random_state=seed, tune_thresholds=tune_thresholds)
+            total = time.perf_counter() - start
+
+    stages = {
+        name: {"seconds": round(seconds, 4), **trainer.stage_memory.get(name, {})}
+        for name, seconds in trainer.stage_timings.items()
+    }
+    return {
+        "rows": rows,
+        "generate_seconds": generate_seconds,
+        "total_seconds": round(total, 4),
+        "peak_rss_mb": max(stage["peak_rss_mb"] for stage in stages.values()),
+        "f1": trainer.model_metadata["metrics"]["f1"],
+        "num_features": trainer.model_metadata["num_features"],
+        "stages": stages,
+    }
+
+
+def _run_size_isolated(rows: int, **kwargs) -> Dict[str, Any]:
+    """Run one size in a fresh process so earlier sizes do not inflate its peak RSS."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_size, (rows,), kwargs)
+
+
+def scaling_summary(runs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Per-stage scaling exponents from a log-log fit of stage time against rows.
+
+    An exponent near 1.0 means linear growth; clearly above 1.0 flags a stage
+    that will dominate as the data grows.
+    """
+    runs = sorted(runs, key=lambda run: run["rows"])
+    stage_names = list(dict.fromkeys(name for run in runs for name in run["stages"]))
+    summary = {}
+    for name in stage_names + ["total"]:
+        points = [
+            (run["rows"], run["total_seconds"] if name == "total" else run["stages"][name]["seconds"])
+            for run in runs
+            if name == "total" or name in run["stages"]
+        ]
+        rows = np.array([p[0] for p in points], dtype=float)
+        seconds = np.array([p[1] for p in points], dtype=float)
+        largest = points[-1]
+        entry = {
+            "largest_rows": int(largest[0]),
+            "largest_seconds": largest[1],
+            "us_per_row": round(largest[1] / largest[0] * 1e6, 3),
+            "time_exponent": None,
+        }
+        # Sub-millisecond timings are noise, not a trend
+        usable = seconds > 1e-3
+        if usable.sum() >= 2:
+            entry["time_exponent"] = round(float(np.polyfit(np.log(rows[usable]), np.log(seconds[usable]), 1)[0]), 2)
+        if name != "total":
+            entry["peak_rss_mb"] = runs[-1]["stages"].get(name, {}).get("peak_rss_mb")
+        summary[name] = entry
+    return summary
+
+
+def compare_to_baseline(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.25,
+) -> List[Dict[str, Any]]:
+    """Stage timings that grew by more than `tolerance` against a previous report."""
+    previous = {run["rows"]: run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in report["runs"]:
+        old = previous.get(run["rows"])
+        if not old:
+            continue
+        for name, stage in run["stages"].items():
+            old_seconds = old["stages"].get(name, {}).get("seconds")
+            # Ignore stages too short to time reliably
+            if not old_seconds or max(old_seconds, stage["seconds"]) < 0.05:
+                continue
+            ratio = stage["seconds"] / old_seconds
+            if ratio > 1 + tolerance:
+                regressions.append({
+                    "rows": run["rows"],
+                    "stage": name,
+                    "baseline_seconds": old_seconds,
+                    "seconds": stage["seconds"],
+                    "ratio": round(ratio, 2),
+                })
+    return regressions
+
+
+def run_benchmark(
+    sizes: List[int],
+    data_dir: str,
+    seed: int = 42,
+    n_jobs: int = -1,
+    tune_thresholds: bool = False,
+    isolate: bool = True,
+    generate_workers: int = 1,
+) -> Dict[str, Any]:
+    """Benchmark every size in order and assemble the report."""
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    runner = _run_size_isolated if isolate else run_size
+    runs = []
+    for rows in sizes:
+        print(f"Benchmarking {rows:,} rows...")
+        run = runner(
+            rows,
+            data_dir=data_dir,
+            seed=seed,
+            n_jobs=n_jobs,
+            tune_thresholds=tune_thresholds,
+            generate_workers=generate_workers,
+        )
+        print(f"  {run['total_seconds']:.2f}s total, peak RSS {run['peak_rss_mb']:.0f} MB, F1 {run['f1']:.3f}")
+        runs.append(run)
+
+    return {
+        "benchmark": "document_recommender_training",
+        "timestamp": datetime.utcnow().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "sklearn": sklearn.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {"seed": seed, "n_jobs": n_jobs, "tune_thresholds": tune_thresholds, "isolated": isolate},
+        "runs": runs,
+        "scaling": scaling_summary(runs),
+    }
+
+
+def write_report(report: Dict[str, Any], output_prefix: str):
+    """Write `<prefix>.json` (full report) and `<prefix>.csv` (one row per size and stage)."""
+    prefix = Path(output_prefix)
+    prefix.parent.mkdir(parents=True, exist_ok=True)
+    with open(prefix.with_suffix(".json"), "w") as f:
+        json.dump(report, f, indent=2)
+    with open(prefix.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for run in report["runs"]:
+            for name, stage in run["stages"].items():
+                writer.writerow({"rows": run["rows"], "stage": name, **stage})
+            writer.writerow({
+                "rows": run["rows"],
+                "stage": "total",
+                "seconds": run["total_seconds"],
+                "peak_rss_mb": run["peak_rss_mb"],
+            })
+
+
+def print_scaling(report: Dict[str, Any]):
+    print(f"\n{'stage':<20} {'largest':>10} {'seconds':>10} {'us/row':>10} {'exponent':>9} {'peak MB':>9}")
+    for name, entry in report["scaling"].items():
+        exponent = "-" if entry["time_exponent"] is None else f"{entry['time_exponent']:.2f}"
+        peak = entry.get("peak_rss_mb")
+        print(
+            f"{name:<20} {entry['largest_rows']:>10,} {entry['largest_seconds']:>10.3f} "
+            f"{entry['us_per_row']:>10.2f} {exponent:>9} {'-' if peak is None else f'{peak:.0f}':>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark training time and memory as data grows")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Dataset sizes in rows"
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=str(Path(__file__).parent / "data" / "benchmark"),
+        help="Where generated datasets are cached between runs"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=str(Path(__file__).parent / "benchmarks" / "training_benchmark"),
+        help="Report path prefix; .json and .csv are appended"
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for data and splits")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Processes used to fit labels")
+    parser.add_argument("--tune-thresholds", action="store_true", help="Include threshold tuning")
+    parser.add_argument("--generate-workers", type=int, default=1, help="Processes used to generate datasets")
+    parser.add_argument(
+        "--no-isolate",
+        action="store_true",
+        help="Run all sizes in this process (peak RSS then carries over between sizes)"
+    )
+    parser.add_argument("--baseline", type=str, help="Previous JSON report to compare stage timings against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative slowdown against the baseline reported as a regression"
+    )
+
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        sorted(args.sizes),
+        data_dir=args.data_dir,
+        seed=args.seed,
+        n_jobs=args.n_jobs,
+        tune_thresholds=args.tune_thresholds,
+        isolate=not args.no_isolate,
+        generate_workers=args.generate_workers,
+    )
+    write_report(report, args.output)
+    print_scaling(report)
+    print(f"\n✓ Wrote {Path(args.output).with_suffix('.json')} and {Path(args.output).with_suffix('.csv')}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} stage regression(s) against {args.baseline}:")
+            for r in regressions:
+                print(
+                    f"  {r['rows']:>10,} rows  {r['stage']:<20} "
+                    f"{r['baseline_seconds']:.3f}s -> {r['seconds']:.3f}s ({r['ratio']:.2f}x)"
+                )
+            sys.exit(1)
+        print(f"\n✓ No stage slower than {1 + args.tolerance:.2f}x the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Text Embedding Cache
+Bounded in-memory LRU of text embeddings with an optional SQLite backing store,
+plus a memory-mapped embedding store for training runs
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_SQLITE_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU of embeddings keyed by (encoder, exact text).
+
+    When `db_path` is given, every new embedding is also written to SQLite and
+    memory misses fall back to it, so the cache survives restarts.
+    """
+
+    def __init__(self, max_entries: int = 10000, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " encoder TEXT NOT NULL, text TEXT NOT NULL, dtype TEXT NOT NULL, vec BLOB NOT NULL,"
+                " PRIMARY KEY (encoder, text))"
+            )
+            self._db.commit()
+
+    def get_many(self, encoder: str, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return cached embeddings for whichever of `texts` are known."""
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            missing = []
+            for text in texts:
+                key = (encoder, text)
+                vec = self._entries.get(key)
+                if vec is None:
+                    missing.append(text)
+                else:
+                    self._entries.move_to_end(key)
+                    found[text] = vec
+            self.hits += len(found)
+
+            if missing and self._db is not None:
+                from_disk = self._read_disk(encoder, missing)
+                for text, vec in from_disk.items():
+                    self._insert((encoder, text), vec)
+                found.update(from_disk)
+                self.disk_hits += len(from_disk)
+                self.misses += len(missing) - len(from_disk)
+            else:
+                self.misses += len(missing)
+        return found
+
+    def put_many(self, encoder: str, texts: List[str], vectors: np.ndarray):
+        """Store freshly computed embeddings."""
+        with self._lock:
+            for text, vec in zip(texts, vectors):
+                self._insert((encoder, text), vec)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (encoder, text, dtype, vec) VALUES (?, ?, ?, ?)",
+                    [(encoder, text, vec.dtype.str, vec.tobytes()) for text, vec in zip(texts, vectors)],
+                )
+                self._db.commit()
+
+    def _insert(self, key: Tuple[str, str], vec: np.ndarray):
+        self._entries[key] = vec
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, encoder: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        for start in range(0, len(texts), _SQLITE_BATCH):
+            chunk = texts[start:start + _SQLITE_BATCH]
+            rows = self._db.execute(
+                "SELECT text, dtype, vec FROM embeddings WHERE encoder = ? AND text IN "
+                f"({', '.join('?' * len(chunk))})",
+                [encoder, *chunk],
+            )
+            for text, dtype, blob in rows:
+                found[text] = np.frombuffer(blob, dtype=np.dtype(dtype))
+        return found
+
+    def stats(self) -> Dict[str, object]:
+        """Hit/miss counters for the predictor's stats."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "persistent": self._db is not None,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class CachedTextEncoder:
+    """Wraps a pipeline text encoder so only texts not seen before are encoded."""
+
+    def __init__(self, encoder, cache: EmbeddingCache):
+        self.encoder = encoder
+        self.cache = cache
+
+    @property
+    def name(self) -> str:
+        return self.encoder.name
+
+    def transform(self, texts: np.ndarray) -> np.ndarray:
+        fingerprint = self.encoder.fingerprint
+        unique = list(dict.fromkeys(texts))
+        found = self.cache.get_many(fingerprint, unique)
+
+        missing = [text for text in unique if text not in found]
+        if missing:
+            encoded = np.asarray(self.encoder.transform(np.array(missing, dtype=object)))
+            self.cache.put_many(fingerprint, missing, encoded)
+            found.update(zip(missing, encoded))
+
+        return np.vstack([found[text] for text in texts])
+
+
+_worker_encoder = None
+
+
+def _init_encode_worker(encoder):
+    global _worker_encoder
+    _worker_encoder = encoder
+
+
+def _encode_chunk(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_encoder.transform(np.array(texts, dtype=object)))
+
+
+def encode_parallel(encoder, texts: List[str], workers: int = 1, chunk_size: int = 2048) -> np.ndarray:
+    """
+    Encode texts with a fitted pipeline encoder, fanning chunks out to a process pool.
+
+    Each worker receives the encoder once at start-up (sentence-transformer
+    models load lazily per worker), then encodes chunks independently.
+    """
+    if workers <= 1 or len(texts) <= chunk_size:
+        return np.asarray(encoder.transform(np.array(texts, dtype=object)))
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_encode_worker,
+        initargs=(encoder,),
+    ) as pool:
+        return np.vstack(list(pool.map(_encode_chunk, chunks)))
+
+
+def text_hash(text: str) -> bytes:
+    """16-byte content hash used as the training-store key."""
+    return hashlib.sha1(text.encode("utf-8")).digest()[:16]
+
+
+class TrainingEmbeddingStore:
+    """
+    Append-only, memory-mapped embedding store for training runs.
+
+    Embeddings live under `cache_dir/<encoder fingerprint>/` as segments of
+    `<name>.vectors.npy` + `<name>.keys.npy` (16-byte text hashes as uint8 rows). Segments
+    are opened with mmap_mode, so repeated runs only read the rows they need
+    and only texts never seen before are encoded and appended.
+    """
+
+    def __init__(self, cache_dir: str, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.root = Path(cache_dir) / re.sub(r"[^A-Za-z0-9._-]", "_", fingerprint)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._segments: List[np.ndarray] = []
+        self._index: Dict[bytes, Tuple[int, int]] = {}
+        self.last_reused = 0
+        self.last_encoded = 0
+        for keys_path in sorted(self.root.glob("*.keys.npy")):
+            vectors_path = keys_path.with_name(keys_path.name.replace(".keys.npy", ".vectors.npy"))
+            if vectors_path.exists():
+                self._add_segment(np.load(keys_path), np.load(vectors_path, mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _add_segment(self, keys: np.ndarray, vectors: np.ndarray):
+        seg = len(self._segments)
+        self._segments.append(vectors)
+        for row, key in enumerate(keys):
+            self._index[key.tobytes()] = (seg, row)
+
+    def _write_segment(self, keys: List[bytes], vectors: np.ndarray):
+        name = f"{int(time.time() * 1000)}-{os.getpid()}"
+        vectors_path = self.root / f"{name}.vectors.npy"
+        keys_path = self.root / f"{name}.keys.npy"
+        # Keys are written last: a segment only counts once its keys file exists
+        np.save(vectors_path, vectors)
+        tmp_keys = self.root / f"{name}.keys.tmp.npy"
+        np.save(tmp_keys, np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(-1, 16))
+        os.replace(tmp_keys, keys_path)
+        self._add_segment(np.load(keys_path), np.load(vectors_path, mmap_mode="r"))
+
+    def encode(self, encoder, texts: np.ndarray, workers: int = 1) -> np.ndarray:
+        """Return embeddings for `texts`, encoding and persisting only unseen ones."""
+        hashes = [text_hash(text) for text in texts]
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(hashes, texts):
+            if key not in self._index and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = encode_parallel(encoder, list(missing.values()), workers=workers)
+            self._write_segment(list(missing.keys()), vectors)
+        self.last_reused = len(texts) - len(missing)
+        self.last_encoded = len(missing)
+
+        locations = np.array([self._index[key] for key in hashes])
+        out = np.empty((len(texts), self._segments[0].shape[1]), dtype=self._segments[0].dtype)
+        for seg, vectors in enumerate(self._segments):
+            mask = locations[:, 0] == seg
+            if mask.any():
+                out[mask] = vectors[locations[mask, 1]]
+        return out
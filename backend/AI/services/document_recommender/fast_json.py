@@ -0,0 +1,54 @@
+"""
+Fast JSON Responses
+orjson-backed response class for the FastAPI services, with a stdlib fallback
+"""
+import dataclasses
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def _default(obj: Any) -> Any:
+    """Types neither encoder handles natively: pydantic models, and dataclasses/numpy for json."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)}
+    if hasattr(obj, "tolist"):  # numpy scalars and arrays
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encode plain data, dataclasses and numpy values to JSON bytes.
+
+    orjson serializes dataclasses and numpy arrays itself, without an
+    intermediate dict per object; without it the stdlib encoder is used.
+    """
+    if HAS_ORJSON:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with `dumps`.
+
+    Returning one from a route skips FastAPI's response-model validation and
+    jsonable_encoder pass, so the content must already have the documented
+    shape; the route's response_model still describes it in the OpenAPI schema.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
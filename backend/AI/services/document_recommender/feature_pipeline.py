@@ -0,0 +1,266 @@
+"""
+Shipment Feature Pipeline
+Fitted text, categorical and numeric transforms shared by training and inference
+"""
+import hashlib
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+try:
+    from sentence_transformers import SentenceTransformer
+    HAS_SENTENCE_TRANSFORMERS = True
+except ImportError:
+    HAS_SENTENCE_TRANSFORMERS = False
+
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+
+TEXT_COLUMNS = ["product_name", "category", "product_description", "hs_code"]
+CATEGORICAL_COLUMNS = ["origin_country", "destination_country", "package_type", "shipment_type", "service_level"]
+NUMERIC_COLUMNS = ["weight", "declared_value"]
+FEATURE_COLUMNS = TEXT_COLUMNS + CATEGORICAL_COLUMNS + NUMERIC_COLUMNS
+
+# (JSON-serializable description, named NumPy arrays) used by model_artifact
+State = Tuple[Dict[str, Any], Dict[str, np.ndarray]]
+
+
+def build_text_inputs(df: pd.DataFrame) -> np.ndarray:
+    """Combine product fields into the text that gets encoded."""
+    text = df[TEXT_COLUMNS[0]].astype(str)
+    for col in TEXT_COLUMNS[1:]:
+        text = text + " " + df[col].astype(str)
+    return text.values
+
+
+class SentenceTransformerTextEncoder:
+    """Dense sentence embeddings; the model itself is loaded lazily and never pickled."""
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", batch_size: int = 64):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+
+    @property
+    def name(self) -> str:
+        return self.model_name
+
+    @property
+    def fingerprint(self) -> str:
+        """Cache key for this encoder's outputs."""
+        return self.model_name
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def fit(self, texts: np.ndarray) -> "SentenceTransformerTextEncoder":
+        return self
+
+    def transform(self, texts: np.ndarray) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=self.batch_size, show_progress_bar=False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_model"] = None
+        return state
+
+    def get_state(self) -> State:
+        return {"type": "sentence-transformers", "model_name": self.model_name, "batch_size": self.batch_size}, {}
+
+    @classmethod
+    def from_state(cls, manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> "SentenceTransformerTextEncoder":
+        return cls(manifest["model_name"], manifest["batch_size"])
+
+
+class TfidfTextEncoder:
+    """TF-IDF fallback when sentence-transformers is not installed."""
+
+    def __init__(self, max_features: int = 128):
+        self.vectorizer = TfidfVectorizer(max_features=max_features, stop_words="english")
+
+    @property
+    def name(self) -> str:
+        return "tfidf"
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the fitted vocabulary, so cached vectors never outlive a retrain."""
+        if getattr(self, "_fingerprint", None) is None:
+            digest = hashlib.sha1()
+            for term, idx in sorted(self.vectorizer.vocabulary_.items()):
+                digest.update(f"{term}:{idx};".encode())
+            digest.update(self.vectorizer.idf_.tobytes())
+            self._fingerprint = f"tfidf-{digest.hexdigest()[:16]}"
+        return self._fingerprint
+
+    def fit(self, texts: np.ndarray) -> "TfidfTextEncoder":
+        self.vectorizer.fit(texts)
+        return self
+
+    def transform(self, texts: np.ndarray) -> np.ndarray:
+        return self.vectorizer.transform(texts).toarray()
+
+    def get_state(self) -> State:
+        vocabulary = sorted(self.vectorizer.vocabulary_, key=self.vectorizer.vocabulary_.get)
+        manifest = {"type": "tfidf", "max_features": self.vectorizer.max_features, "vocabulary": vocabulary}
+        return manifest, {"tfidf_idf": self.vectorizer.idf_}
+
+    @classmethod
+    def from_state(cls, manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> "TfidfTextEncoder":
+        """Rebuild the fitted vectorizer from its vocabulary and IDF weights, without refitting."""
+        encoder = cls(manifest["max_features"])
+        encoder.vectorizer = TfidfVectorizer(
+            stop_words="english",
+            vocabulary={term: idx for idx, term in enumerate(manifest["vocabulary"])},
+        )
+        encoder.vectorizer.idf_ = np.asarray(arrays["tfidf_idf"])
+        return encoder
+
+
+def make_text_encoder(text_model: str = "all-MiniLM-L6-v2"):
+    """Pick the best available text encoder."""
+    if HAS_SENTENCE_TRANSFORMERS:
+        return SentenceTransformerTextEncoder(text_model)
+    return TfidfTextEncoder()
+
+
+class ShipmentFeaturePipeline:
+    """
+    Text embedding + one-hot categoricals + scaled numerics.
+
+    Fitted once during training and persisted in the model artifact, so inference
+    is a single transform over a batch with no per-request fitting.
+    """
+
+    def __init__(self, text_encoder=None):
+        self.text_encoder = text_encoder or make_text_encoder()
+        self.ohe = OneHotEncoder(sparse_output=False, handle_unknown="ignore")
+        self.scaler = StandardScaler()
+
+    def fit(self, df: pd.DataFrame) -> "ShipmentFeaturePipeline":
+        """Fit all transforms on training data."""
+        self.text_encoder.fit(build_text_inputs(df))
+        self.ohe.fit(df[CATEGORICAL_COLUMNS].astype(str))
+        self.scaler.fit(df[NUMERIC_COLUMNS].astype(float))
+        return self
+
+    def fit_transform(self, df: pd.DataFrame) -> np.ndarray:
+        """Fit all transforms on training data and return the feature matrix."""
+        return self.fit(df).transform(df)
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        """Transform a batch of shipments into one feature matrix."""
+        return np.hstack([
+            self.text_encoder.transform(build_text_inputs(df)),
+            self.transform_tabular(df),
+        ])
+
+    def transform_tabular(self, df: pd.DataFrame) -> np.ndarray:
+        """One-hot categoricals and scaled numerics (everything except text)."""
+        return np.hstack([
+            self.ohe.transform(df[CATEGORICAL_COLUMNS].astype(str)),
+            self.scaler.transform(df[NUMERIC_COLUMNS].astype(float)),
+        ])
+
+    def get_state(self) -> State:
+        """Fitted vocabularies and statistics as plain JSON and arrays."""
+        encoder_manifest, arrays = self.text_encoder.get_state()
+        manifest = {
+            "type": "dense",
+            "text_encoder": encoder_manifest,
+            "categories": {
+                col: [str(v) for v in cats]
+                for col, cats in zip(CATEGORICAL_COLUMNS, self.ohe.categories_)
+            },
+            "scaler_samples_seen": int(self.scaler.n_samples_seen_),
+        }
+        arrays.update({
+            "scaler_mean": self.scaler.mean_,
+            "scaler_scale": self.scaler.scale_,
+            "scaler_var": self.scaler.var_,
+        })
+        return manifest, arrays
+
+    @classmethod
+    def from_state(cls, manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> "ShipmentFeaturePipeline":
+        encoder_types = {"sentence-transformers": SentenceTransformerTextEncoder, "tfidf": TfidfTextEncoder}
+        encoder_manifest = manifest["text_encoder"]
+        pipeline = cls(encoder_types[encoder_manifest["type"]].from_state(encoder_manifest, arrays))
+
+        # Fixed categories make fit a no-op beyond sklearn's bookkeeping; one row suffices
+        categories = [manifest["categories"][col] for col in CATEGORICAL_COLUMNS]
+        pipeline.ohe = OneHotEncoder(categories=categories, sparse_output=False, handle_unknown="ignore")
+        pipeline.ohe.fit(pd.DataFrame([[cats[0] for cats in categories]], columns=CATEGORICAL_COLUMNS))
+
+        pipeline.scaler.mean_ = np.asarray(arrays["scaler_mean"])
+        pipeline.scaler.scale_ = np.asarray(arrays["scaler_scale"])
+        pipeline.scaler.var_ = np.asarray(arrays["scaler_var"])
+        pipeline.scaler.n_samples_seen_ = manifest["scaler_samples_seen"]
+        pipeline.scaler.n_features_in_ = len(NUMERIC_COLUMNS)
+        pipeline.scaler.feature_names_in_ = np.array(NUMERIC_COLUMNS, dtype=object)
+        return pipeline
+
+
+class HashedFeaturePipeline:
+    """
+    Stateless hashed features with a fixed dimensionality.
+
+    Used for streaming training on logs too large to fit: nothing has to be
+    fitted up front, so every chunk maps to the same sparse feature space.
+    Numerics are log-scaled instead of standardized for the same reason.
+    """
+
+    def __init__(self, n_text_features: int = 2 ** 16, n_categorical_features: int = 2 ** 10):
+        self.text_hasher = HashingVectorizer(
+            n_features=n_text_features,
+            alternate_sign=False,
+            stop_words="english",
+        )
+        self.categorical_hasher = FeatureHasher(
+            n_features=n_categorical_features,
+            input_type="string",
+            alternate_sign=False,
+        )
+
+    @property
+    def n_features(self) -> int:
+        return self.text_hasher.n_features + self.categorical_hasher.n_features + len(NUMERIC_COLUMNS)
+
+    def fit(self, df: pd.DataFrame) -> "HashedFeaturePipeline":
+        return self
+
+    def transform(self, df: pd.DataFrame) -> sparse.csr_matrix:
+        """Transform a batch of shipments into one sparse feature matrix."""
+        tokens = np.column_stack([
+            (col + "=" + df[col].astype(str)).values
+            for col in CATEGORICAL_COLUMNS
+        ])
+        numeric = np.log1p(np.clip(df[NUMERIC_COLUMNS].astype(float).values, 0, None))
+        return sparse.hstack([
+            self.text_hasher.transform(build_text_inputs(df)),
+            self.categorical_hasher.transform(tokens),
+            sparse.csr_matrix(numeric),
+        ], format="csr")
+
+    def get_state(self) -> State:
+        return {
+            "type": "hashed",
+            "n_text_features": self.text_hasher.n_features,
+            "n_categorical_features": self.categorical_hasher.n_features,
+        }, {}
+
+    @classmethod
+    def from_state(cls, manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> "HashedFeaturePipeline":
+        return cls(manifest["n_text_features"], manifest["n_categorical_features"])
+
+
+def pipeline_from_state(manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+    """Rebuild whichever feature pipeline a manifest describes."""
+    pipeline_types = {"dense": ShipmentFeaturePipeline, "hashed": HashedFeaturePipeline}
+    return pipeline_types[manifest["type"]].from_state(manifest, arrays)
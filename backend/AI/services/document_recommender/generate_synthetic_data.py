@@ -4,8 +4,13 @@ Generates realistic shipment records with appropriate required documents.
 """
 import csv
 import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
 
 # Product categories and their typical required documents
 PRODUCT_MAPPINGS = {
@@ -60,6 +65,12 @@ HS_CODES = {
     "machinery": ["8401", "8402", "8403", "8407"],
 }
 
+FIELDNAMES = [
+    "product_name", "category", "product_description", "hs_code",
+    "origin_country", "destination_country", "package_type", "weight",
+    "declared_value", "shipment_type", "service_level", "required_documents"
+]
+
 
 def generate_synthetic_documents(
     num_records: int = 1000, seed: int = 42, output_file: str = None
@@ -122,12 +133,7 @@ def generate_synthetic_documents(
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
         with open(output_path, "w", newline="") as f:
-            fieldnames = [
-                "product_name", "category", "product_description", "hs_code",
-                "origin_country", "destination_country", "package_type", "weight",
-                "declared_value", "shipment_type", "service_level", "required_documents"
-            ]
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
             writer.writeheader()
             writer.writerows(records)
         
@@ -136,15 +142,198 @@ def generate_synthetic_documents(
     return records
 
 
+def _category_tables():
+    """Per-category lookup arrays shared by every vectorized chunk."""
+    categories = list(PRODUCT_MAPPINGS)
+    weight = np.array([PRODUCT_MAPPINGS[c]["weight_range"] for c in categories], dtype=float)
+    value = np.array([PRODUCT_MAPPINGS[c]["value_range"] for c in categories], dtype=float)
+    hs_counts = np.array([len(HS_CODES.get(c, ["9999"])) for c in categories])
+    hs_table = np.array(
+        [HS_CODES.get(c, ["9999"]) + [""] * (hs_counts.max() - len(HS_CODES.get(c, ["9999"]))) for c in categories],
+        dtype=object,
+    )
+
+    # required_documents for every (category, heavy, high value, international) combination,
+    # built with the same rules as the record-by-record generator
+    docs = np.empty((len(categories), 2, 2, 2), dtype=object)
+    for c, category in enumerate(categories):
+        for heavy in (0, 1):
+            for high_value in (0, 1):
+                for international in (0, 1):
+                    text = ", ".join(PRODUCT_MAPPINGS[category]["docs"])
+                    if heavy and "Inspection Certificate" not in text:
+                        text += ", Inspection Certificate"
+                    if high_value and "Broker Review" not in text:
+                        text += ", Broker Review"
+                    if international and "Certificate of Origin" not in text:
+                        text += ", Certificate of Origin"
+                    docs[c, heavy, high_value, international] = text
+
+    return {
+        "categories": np.array(categories, dtype=object),
+        "titles": np.array([f"{c.title()} Product " for c in categories], dtype=object),
+        "descriptions": np.array([f"High-quality {c} product for industrial use" for c in categories], dtype=object),
+        "weight": weight,
+        "value": value,
+        "hs_counts": hs_counts,
+        "hs_table": hs_table,
+        "docs": docs,
+    }
+
+
+_TABLES = None
+
+
+def generate_chunk(chunk_idx: int, chunk_size: int, num_records: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Generate one chunk of records with NumPy array operations.
+
+    Each chunk draws from its own generator seeded with (seed, chunk_idx), so
+    the output is identical whichever process generates it and however many
+    workers are used.
+    """
+    global _TABLES
+    if _TABLES is None:
+        _TABLES = _category_tables()
+    t = _TABLES
+
+    start = chunk_idx * chunk_size
+    n = min(chunk_size, num_records - start)
+    rng = np.random.default_rng([seed, chunk_idx])
+
+    cat = rng.integers(0, len(t["categories"]), n)
+    hs_code = t["hs_table"][cat, (rng.random(n) * t["hs_counts"][cat]).astype(int)]
+    low, high = t["weight"][cat].T
+    weight = np.round(rng.uniform(low, high), 2)
+    low, high = t["value"][cat].T
+    declared_value = np.round(rng.uniform(low, high), 2)
+    international = rng.integers(0, len(SHIPMENT_TYPES), n)
+    countries = np.array(COUNTRIES, dtype=object)
+
+    return pd.DataFrame({
+        "product_name": t["titles"][cat] + np.arange(start + 1, start + n + 1).astype(str).astype(object),
+        "category": t["categories"][cat],
+        "product_description": t["descriptions"][cat],
+        "hs_code": hs_code,
+        "origin_country": countries[rng.integers(0, len(COUNTRIES), n)],
+        "destination_country": countries[rng.integers(0, len(COUNTRIES), n)],
+        "package_type": np.array(PACKAGE_TYPES, dtype=object)[rng.integers(0, len(PACKAGE_TYPES), n)],
+        "weight": weight,
+        "declared_value": declared_value,
+        "shipment_type": np.array(SHIPMENT_TYPES, dtype=object)[international],
+        "service_level": np.array(SERVICE_LEVELS, dtype=object)[rng.integers(0, len(SERVICE_LEVELS), n)],
+        "required_documents": t["docs"][
+            cat,
+            (weight > 100).astype(int),
+            (declared_value > 10000).astype(int),
+            (international == SHIPMENT_TYPES.index("International")).astype(int),
+        ],
+    }, columns=FIELDNAMES)
+
+
+def _generate_csv_chunk(chunk_idx: int, chunk_size: int, num_records: int, seed: int) -> bytes:
+    # CSV formatting costs ~10x generation, so it happens in the worker too
+    return generate_chunk(chunk_idx, chunk_size, num_records, seed).to_csv(
+        header=chunk_idx == 0, index=False
+    ).encode("utf-8")
+
+
+def _map_chunks(fn, num_records: int, seed: int, chunk_size: int, workers: int) -> Iterator:
+    """Apply `fn` to every chunk index in order, optionally across a process pool."""
+    n_chunks = -(-num_records // chunk_size)
+    tasks = [(idx, chunk_size, num_records, seed) for idx in range(n_chunks)]
+    if workers <= 1:
+        for task in tasks:
+            yield fn(*task)
+        return
+
+    # At most two chunks per worker in flight keeps memory bounded by the chunk size
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(fn, *task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_synthetic_chunks(
+    num_records: int,
+    seed: int = 42,
+    chunk_size: int = 100_000,
+    workers: int = 1,
+) -> Iterator[pd.DataFrame]:
+    """Yield generated chunks as DataFrames, in order."""
+    return _map_chunks(generate_chunk, num_records, seed, chunk_size, workers)
+
+
+def write_synthetic_dataset(
+    output_file: str,
+    num_records: int,
+    seed: int = 42,
+    chunk_size: int = 100_000,
+    workers: int = 1,
+) -> int:
+    """
+    Stream vectorized records to CSV or Parquet (chosen by the file extension).
+
+    Returns the number of records written. Parquet output requires pyarrow.
+    """
+    output_path = Path(output_file)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+
+    if output_path.suffix == ".parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in iter_synthetic_chunks(num_records, seed, chunk_size, workers):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+                written += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(output_path, "wb") as f:
+            for data in _map_chunks(_generate_csv_chunk, num_records, seed, chunk_size, workers):
+                f.write(data)
+        written = num_records
+
+    print(f"✓ Generated {written} synthetic records to {output_file}")
+    return written
+
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Generate synthetic training data for document recommender")
     parser.add_argument("--rows", type=int, default=1000, help="Number of records to generate")
     parser.add_argument("--seed", type=int, default=42, help="Random seed")
-    parser.add_argument("--output", type=str, help="Output CSV file path")
+    parser.add_argument("--output", type=str, help="Output CSV or .parquet file path")
+    parser.add_argument(
+        "--vectorized",
+        action="store_true",
+        help="Generate with NumPy in chunks and stream to disk (required for .parquet)"
+    )
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Rows per chunk (if --vectorized)")
+    parser.add_argument("--workers", type=int, default=1, help="Generator processes (if --vectorized)")
     
     args = parser.parse_args()
     
     output_path = args.output or str(Path(__file__).parent / "data" / "synthetic_documents_data.csv")
-    generate_synthetic_documents(num_records=args.rows, seed=args.seed, output_file=output_path)
+    if args.vectorized or output_path.endswith(".parquet"):
+        write_synthetic_dataset(
+            output_path,
+            num_records=args.rows,
+            seed=args.seed,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+        )
+    else:
+        generate_synthetic_documents(num_records=args.rows, seed=args.seed, output_file=output_path)
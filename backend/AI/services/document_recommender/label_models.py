@@ -0,0 +1,159 @@
+"""
+Per-Label Models for the Document Requirement Classifier
+Estimators shared by the training pipeline and the model artifact
+"""
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.base import clone
+from sklearn.linear_model import LogisticRegression
+from sklearn.multioutput import MultiOutputClassifier
+
+# Logit used for labels that were constant in training (probability ~0.999999)
+CONSTANT_LABEL_LOGIT = 13.8
+
+
+class BinaryLogisticRegression(LogisticRegression):
+    """
+    LogisticRegression that tolerates labels with a single class.
+
+    Documents such as "Commercial Invoice" appear on every training shipment,
+    which plain LogisticRegression rejects. Those labels are fitted as a
+    constant: zero weights and an intercept that saturates the sigmoid.
+    """
+
+    def fit(self, X, y, sample_weight=None):
+        y = np.asarray(y)
+        if np.unique(y).size > 1:
+            return super().fit(X, y, sample_weight=sample_weight)
+
+        self.classes_ = np.array([0, 1])
+        self.coef_ = np.zeros((1, np.asarray(X).shape[1]))
+        self.intercept_ = np.array([CONSTANT_LABEL_LOGIT if y[0] else -CONSTANT_LABEL_LOGIT])
+        self.n_features_in_ = self.coef_.shape[1]
+        self.n_iter_ = np.array([0])
+        return self
+
+
+@dataclass
+class LinearScorer:
+    """
+    All per-label logistic models stacked into one weight matrix.
+
+    Scores every label for a batch with a single matrix product and a sigmoid,
+    without touching sklearn at serve time.
+    """
+    coef: np.ndarray       # (n_features, n_labels)
+    intercept: np.ndarray  # (n_labels,)
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        return X @ self.coef + self.intercept
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Positive-class probability for every label, shape (n_samples, n_labels)."""
+        # Stable sigmoid: 1 / (1 + exp(-z)) without overflow for large |z|
+        return np.exp(-np.logaddexp(0.0, -self.decision_function(X)))
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.decision_function(X) > 0
+
+
+def stack_linear_models(estimators: List) -> LinearScorer:
+    """Stack fitted binary linear models (one per label) into a LinearScorer."""
+    coef = np.column_stack([est.coef_[0] for est in estimators])
+    intercept = np.array([est.intercept_[0] for est in estimators])
+    return LinearScorer(coef=np.ascontiguousarray(coef), intercept=intercept)
+
+
+def export_linear_scorer(classifier: MultiOutputClassifier) -> LinearScorer:
+    """Stack the coefficients of a fitted MultiOutputClassifier of logistic models."""
+    return stack_linear_models(classifier.estimators_)
+
+
+def _fit_one_label(
+    estimator,
+    X: np.ndarray,
+    y: np.ndarray,
+    init: Optional[Tuple[np.ndarray, float]],
+):
+    """Fit a single label, optionally starting from previous coefficients."""
+    start = time.process_time()
+    if init is not None:
+        estimator.set_params(warm_start=True)
+        estimator.coef_ = init[0].reshape(1, -1).copy()
+        estimator.intercept_ = np.array([init[1]])
+    estimator.fit(X, y)
+    return estimator, time.process_time() - start
+
+
+def fit_label_models(
+    base_estimator,
+    X: np.ndarray,
+    y: np.ndarray,
+    n_jobs: int = 1,
+    warm_start: Optional[List[Optional[Tuple[np.ndarray, float]]]] = None,
+) -> Tuple[MultiOutputClassifier, Dict]:
+    """
+    Fit one binary model per label across a process pool.
+
+    `warm_start` holds, per label, the (coef, intercept) of a previous model
+    to start from, or None to start cold. Returns the fitted classifier and a
+    report with wall-clock time and CPU time summed over workers.
+    """
+    warm_start = warm_start or [None] * y.shape[1]
+    n_workers = min(effective_n_jobs(n_jobs), y.shape[1])
+
+    wall_start = time.perf_counter()
+    results = Parallel(n_jobs=n_workers)(
+        delayed(_fit_one_label)(clone(base_estimator), X, y[:, j], warm_start[j])
+        for j in range(y.shape[1])
+    )
+    wall = time.perf_counter() - wall_start
+
+    # Assemble the same fitted object MultiOutputClassifier.fit would produce
+    classifier = MultiOutputClassifier(base_estimator)
+    classifier.estimators_ = [estimator for estimator, _ in results]
+    classifier.n_features_in_ = X.shape[1]
+
+    cpu = sum(cpu_seconds for _, cpu_seconds in results)
+    report = {
+        "mode": "warm" if any(init is not None for init in warm_start) else "cold",
+        "workers": n_workers,
+        "labels": y.shape[1],
+        "warm_started_labels": sum(init is not None for init in warm_start),
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        # Average number of cores kept busy during the fit
+        "cpu_utilization": round(cpu / wall, 2) if wall else 0.0,
+    }
+    return classifier, report
+
+
+def tune_decision_thresholds(
+    y_true: np.ndarray,
+    probabilities: np.ndarray,
+    grid: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Pick the per-label probability cut-off that maximizes F1 on held-out data.
+
+    Labels with no positive examples in the held-out data keep the default 0.5.
+    """
+    grid = np.linspace(0.05, 0.95, 19) if grid is None else np.asarray(grid)
+    y_true = np.asarray(y_true, dtype=bool)
+
+    # (n_thresholds, n_samples, n_labels) decisions evaluated in one shot
+    decisions = probabilities[None, :, :] >= grid[:, None, None]
+    tp = (decisions & y_true).sum(axis=1)
+    fp = (decisions & ~y_true).sum(axis=1)
+    fn = (~decisions & y_true).sum(axis=1)
+    f1 = 2 * tp / np.maximum(2 * tp + fp + fn, 1)
+
+    # Among equally good cut-offs prefer the one closest to 0.5
+    tie_break = 1e-6 * np.abs(grid - 0.5)[:, None]
+    thresholds = grid[np.argmax(f1 - tie_break, axis=0)]
+    thresholds[~y_true.any(axis=0)] = 0.5
+    return thresholds
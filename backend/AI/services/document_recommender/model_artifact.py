@@ -0,0 +1,221 @@
+"""
+Memory-Mappable Model Artifact
+JSON manifest plus one .npy file per array, loadable in milliseconds with mmap_mode
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from sklearn.preprocessing import MultiLabelBinarizer
+
+from feature_pipeline import pipeline_from_state
+from label_models import LinearScorer, export_linear_scorer
+
+ARTIFACT_DIRNAME = "required_docs_model"
+POINTER_NAME = "required_docs_model.current"
+LEGACY_PICKLE_NAME = "required_docs_model.pkl"
+MANIFEST_NAME = "manifest.json"
+FORMAT_NAME = "preclear-document-model"
+FORMAT_VERSION = 1
+
+
+def artifact_path(models_dir) -> Path:
+    """The current artifact directory: the version the pointer file names, else the unversioned one."""
+    models_dir = Path(models_dir)
+    try:
+        version = (models_dir / POINTER_NAME).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return models_dir / ARTIFACT_DIRNAME
+    return models_dir / version
+
+
+def _prune_versions(models_dir: Path, keep):
+    """Remove artifact versions other than `keep`, including a pre-versioning directory."""
+    candidates = list(models_dir.glob(f"{ARTIFACT_DIRNAME}.v-*")) + [models_dir / ARTIFACT_DIRNAME]
+    for path in candidates:
+        if path.name not in keep and path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _json_default(value):
+    """Let numpy scalars and arrays in training metadata through json.dump."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def save_artifact(
+    models_dir,
+    feature_pipeline,
+    scorer: LinearScorer,
+    decision_thresholds: np.ndarray,
+    label_names,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Path:
+    """
+    Write the serving artifact to a new `required_docs_model.v-*` directory.
+
+    The version is published by replacing the `required_docs_model.current`
+    pointer file with os.replace, so a loader sees either the previous
+    complete artifact or the new one, never a missing or half-written one.
+    The previous version is kept for loaders and workers still reading it;
+    older ones are removed.
+    """
+    models_dir = Path(models_dir)
+    models_dir.mkdir(parents=True, exist_ok=True)
+    previous = artifact_path(models_dir)
+    target = models_dir / f"{ARTIFACT_DIRNAME}.v-{time.time_ns()}-{os.getpid()}"
+    target.mkdir()
+
+    pipeline_manifest, arrays = feature_pipeline.get_state()
+    arrays = dict(arrays)
+    arrays.update({
+        "coef": scorer.coef,
+        "intercept": scorer.intercept,
+        "decision_thresholds": decision_thresholds,
+    })
+
+    array_index = {}
+    for name, array in arrays.items():
+        # C-contiguous files map straight into the matrix products at serve time
+        array = np.ascontiguousarray(array)
+        np.save(target / f"{name}.npy", array, allow_pickle=False)
+        array_index[name] = {"file": f"{name}.npy", "dtype": array.dtype.str, "shape": list(array.shape)}
+
+    manifest = {
+        "format": FORMAT_NAME,
+        "format_version": FORMAT_VERSION,
+        "label_names": list(label_names),
+        "feature_pipeline": pipeline_manifest,
+        "arrays": array_index,
+        "metadata": metadata or {},
+    }
+    with open(target / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, default=_json_default)
+
+    pointer_tmp = models_dir / f"{POINTER_NAME}.tmp-{os.getpid()}"
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(target.name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, models_dir / POINTER_NAME)
+
+    _prune_versions(models_dir, keep={target.name, previous.name})
+    return target
+
+
+def load_artifact(path, mmap_mode: Optional[str] = "r") -> Dict[str, Any]:
+    """
+    Load an artifact directory into the same components the pickle provided.
+
+    With `mmap_mode="r"` the weights stay in the OS page cache and are shared
+    by every process that maps them, including forked workers; pass "c" for
+    private copy-on-write arrays, or None to read them into memory.
+    """
+    path = Path(path)
+    with open(path / MANIFEST_NAME, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_NAME or manifest.get("format_version", 0) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported model artifact at {path}")
+
+    arrays = {}
+    for name, spec in manifest["arrays"].items():
+        array = np.load(path / spec["file"], mmap_mode=mmap_mode, allow_pickle=False)
+        if list(array.shape) != spec["shape"]:
+            raise ValueError(f"Array {name} in {path} has shape {array.shape}, expected {spec['shape']}")
+        arrays[name] = array
+
+    label_names = manifest["label_names"]
+    return {
+        "classifier": None,
+        "feature_pipeline": pipeline_from_state(manifest["feature_pipeline"], arrays),
+        "scorer": LinearScorer(coef=arrays["coef"], intercept=arrays["intercept"]),
+        "decision_thresholds": arrays["decision_thresholds"],
+        "mlb": MultiLabelBinarizer(classes=label_names).fit([]),
+        "label_names": label_names,
+        "metadata": manifest["metadata"],
+    }
+
+
+def load_model_version(models_dir, mmap_mode: Optional[str] = "r") -> Tuple[Path, Dict[str, Any]]:
+    """
+    Load a models directory, preferring the artifact over a legacy pickle.
+
+    Returns the version directory (or pickle file) that was loaded with its
+    data; passing that path back in loads exactly the same version. The legacy
+    pickle is only used when no artifact was ever published. If a version is
+    pruned while it is being loaded, the now-current one is loaded.
+    """
+    models_dir = Path(models_dir)
+    if models_dir.is_file():
+        with open(models_dir, "rb") as f:
+            return models_dir, pickle.load(f)
+    if (models_dir / MANIFEST_NAME).exists():
+        return models_dir, load_artifact(models_dir, mmap_mode=mmap_mode)
+
+    if (models_dir / POINTER_NAME).exists() or (models_dir / ARTIFACT_DIRNAME / MANIFEST_NAME).exists():
+        path = artifact_path(models_dir)
+        while True:
+            try:
+                return path, load_artifact(path, mmap_mode=mmap_mode)
+            except FileNotFoundError:
+                current = artifact_path(models_dir)
+                if current == path:
+                    raise
+                path = current
+
+    pickle_path = models_dir / LEGACY_PICKLE_NAME
+    if not pickle_path.exists():
+        raise FileNotFoundError(f"Model not found at {artifact_path(models_dir)} or {pickle_path}")
+    with open(pickle_path, "rb") as f:
+        return pickle_path, pickle.load(f)
+
+
+def load_model_data(models_dir, mmap_mode: Optional[str] = "r") -> Dict[str, Any]:
+    """Load a models directory, artifact version directory, or pickle file; see load_model_version."""
+    return load_model_version(models_dir, mmap_mode=mmap_mode)[1]
+
+
+def convert_pickle(pickle_path, models_dir=None) -> Path:
+    """Convert a legacy `required_docs_model.pkl` into an artifact next to it."""
+    pickle_path = Path(pickle_path)
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    if "feature_pipeline" not in data:
+        raise ValueError(f"Model at {pickle_path} has no fitted feature pipeline. Retrain it with train_model.py.")
+
+    return save_artifact(
+        models_dir or pickle_path.parent,
+        feature_pipeline=data["feature_pipeline"],
+        # Older pickles predate the exported scorer; build it from the classifier
+        scorer=data.get("scorer") or export_linear_scorer(data["classifier"]),
+        decision_thresholds=data.get("decision_thresholds", np.full(len(data["label_names"]), 0.5)),
+        label_names=data["label_names"],
+        metadata=data.get("metadata", {}),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a pickled document model into a memory-mappable artifact")
+    parser.add_argument("pickle_path", help="Path to required_docs_model.pkl")
+    parser.add_argument("--models-dir", help="Where to write the artifact (defaults to the pickle's directory)")
+    args = parser.parse_args()
+
+    target = convert_pickle(args.pickle_path, args.models_dir)
+    print(f"✓ Wrote artifact to {target}")
+
+    start = time.perf_counter()
+    load_artifact(target)
+    print(f"✓ Verified: loads in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
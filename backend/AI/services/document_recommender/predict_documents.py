@@ -2,26 +2,27 @@
 Document Requirement Inference Module
 Loads trained model and generates predictions for shipments
 """
-import pickle
 import numpy as np
+import pandas as pd
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Union
 from dataclasses import dataclass, asdict
 from enum import Enum
 import asyncio
+import hashlib
+import json
 import logging
+import time
 
-try:
-    from sentence_transformers import SentenceTransformer
-    HAS_SENTENCE_TRANSFORMERS = True
-except ImportError:
-    HAS_SENTENCE_TRANSFORMERS = False
-    from sklearn.feature_extraction.text import TfidfVectorizer
-
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.preprocessing import MultiLabelBinarizer
 from pydantic import BaseModel, Field
 
+from feature_pipeline import FEATURE_COLUMNS, HashedFeaturePipeline, ShipmentFeaturePipeline, build_text_inputs
+from embedding_cache import CachedTextEncoder, EmbeddingCache
+from label_models import LinearScorer, export_linear_scorer
+from model_artifact import load_model_version
+from service_metrics import StageTimings
+
 logger = logging.getLogger(__name__)
 
 
@@ -56,6 +57,26 @@ class PredictedDocument(BaseModel):
     regulatory_basis: Optional[str] = None
 
 
+@dataclass
+class DocumentHit:
+    """
+    A predicted document as produced inside the service.
+    
+    Same fields as PredictedDocument, but a plain dataclass: inference and
+    merging build thousands of these per batch, their values are already in
+    range by construction, and they are serialized once at the response edge.
+    """
+    name: str
+    confidence: float
+    provenance: str = "ml"
+    description: Optional[str] = None
+    regulatory_basis: Optional[str] = None
+    
+    def to_model(self) -> PredictedDocument:
+        """Validated public model, for callers that need one."""
+        return PredictedDocument(**asdict(self))
+
+
 class DocumentPredictionResponse(BaseModel):
     """Response containing predicted documents."""
     shipment_id: Optional[str] = None
@@ -64,12 +85,17 @@ class DocumentPredictionResponse(BaseModel):
     model_version: str
     timestamp: str
     confidence_threshold: float
+    partial: bool = Field(False, description="True when a prediction source (ML or a provider) is missing")
+    unavailable_providers: List[str] = Field(default_factory=list)
 
 
 @dataclass
 class ModelComponents:
     """Loaded model components."""
     classifier: object
+    feature_pipeline: Union[ShipmentFeaturePipeline, HashedFeaturePipeline]
+    scorer: LinearScorer
+    decision_thresholds: np.ndarray
     mlb: MultiLabelBinarizer
     label_names: List[str]
     metadata: Dict
@@ -78,187 +104,197 @@ class ModelComponents:
 class DocumentPredictor:
     """Loads and uses trained model for predictions."""
     
-    def __init__(self, models_dir: str = None):
+    def __init__(
+        self,
+        models_dir: str = None,
+        embedding_cache_size: int = 10000,
+        embedding_cache_path: Optional[str] = None,
+        mmap_mode: Optional[str] = "r",
+    ):
         self.models_dir = Path(models_dir or Path(__file__).parent / "models")
+        self.mmap_mode = mmap_mode
         self.model_components: Optional[ModelComponents] = None
-        self.text_encoder = None
-        self.tfidf = None
-        self.ohe = None
-        self.scaler = None
+        # The artifact version directory (or pickle) the loaded model came from
+        self.model_path: Optional[Path] = None
+        self.model_fingerprint = "unloaded"
+        self.embedding_cache: Optional[EmbeddingCache] = None
+        if embedding_cache_size > 0:
+            self.embedding_cache = EmbeddingCache(
+                max_entries=embedding_cache_size,
+                db_path=embedding_cache_path,
+            )
     
     def load_model(self):
         """Load trained model and preprocessing components."""
-        model_path = self.models_dir / "required_docs_model.pkl"
+        start = time.perf_counter()
+        self.model_path, data = load_model_version(self.models_dir, mmap_mode=self.mmap_mode)
         
-        if not model_path.exists():
-            raise FileNotFoundError(f"Model not found at {model_path}")
-        
-        with open(model_path, "rb") as f:
-            data = pickle.load(f)
+        if "feature_pipeline" not in data:
+            raise ValueError(
+                f"Model in {self.models_dir} has no fitted feature pipeline. "
+                "Retrain it with train_model.py."
+            )
         
         self.model_components = ModelComponents(
-            classifier=data["classifier"],
+            classifier=data.get("classifier"),
+            feature_pipeline=data["feature_pipeline"],
+            # Older artifacts predate the exported scorer; build it from the classifier
+            scorer=data.get("scorer") or export_linear_scorer(data["classifier"]),
+            decision_thresholds=data.get(
+                "decision_thresholds",
+                np.full(len(data["label_names"]), 0.5),
+            ),
             mlb=data["mlb"],
             label_names=data["label_names"],
             metadata=data.get("metadata", {})
         )
         
-        # Initialize text encoder
-        if self.model_components.metadata.get("text_encoder") == "sentence-transformers":
-            if HAS_SENTENCE_TRANSFORMERS:
-                model_name = self.model_components.metadata.get("text_model", "all-MiniLM-L6-v2")
-                self.text_encoder = SentenceTransformer(model_name)
-            else:
-                logger.warning("sentence-transformers not available, using TF-IDF")
-                self.tfidf = TfidfVectorizer(max_features=128, stop_words="english")
-        else:
-            self.tfidf = TfidfVectorizer(max_features=128, stop_words="english")
+        # Hashed (streaming) pipelines have no encoder worth caching
+        pipeline = self.model_components.feature_pipeline
+        if self.embedding_cache and isinstance(pipeline, ShipmentFeaturePipeline):
+            pipeline.text_encoder = CachedTextEncoder(pipeline.text_encoder, self.embedding_cache)
         
-        logger.info(f"✓ Loaded model with {len(self.model_components.label_names)} document types")
+        self.model_fingerprint = self._fingerprint(self.model_components)
+        logger.info(
+            f"✓ Loaded model with {len(self.model_components.label_names)} document types "
+            f"in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+    
+    @staticmethod
+    def _fingerprint(components: ModelComponents) -> str:
+        """Identifies a trained model; two trainings never share one, even at the same version."""
+        digest = hashlib.sha1()
+        digest.update(json.dumps(components.label_names).encode())
+        digest.update(str(components.metadata.get("model_version", "")).encode())
+        digest.update(str(components.metadata.get("training_timestamp", "")).encode())
+        digest.update(np.ascontiguousarray(components.decision_thresholds).tobytes())
+        digest.update(np.ascontiguousarray(components.scorer.intercept).tobytes())
+        return digest.hexdigest()[:16]
+    
+    def stats(self) -> Dict:
+        """Runtime statistics for monitoring."""
+        return {
+            "embedding_cache": self.embedding_cache.stats() if self.embedding_cache else None,
+        }
     
     def _prepare_features(
         self,
-        product_name: str,
-        category: str,
-        product_description: str,
-        hs_code: str,
-        origin_country: str,
-        destination_country: str,
-        package_type: str,
-        weight: float,
-        declared_value: float,
-        shipment_type: str,
-        service_level: str,
+        requests: List[DocumentPredictionRequest],
+        timings: Optional[StageTimings] = None,
     ) -> np.ndarray:
-        """Prepare feature vector for prediction."""
-        
-        # Text features
-        text_input = (
-            f"{product_name} {category} {product_description} {hs_code}"
-        )
-        
-        if HAS_SENTENCE_TRANSFORMERS and self.text_encoder:
-            text_features = self.text_encoder.encode([text_input], show_progress_bar=False)[0]
-        else:
-            # Fallback: TF-IDF
-            if self.tfidf is None:
-                self.tfidf = TfidfVectorizer(max_features=128, stop_words="english")
-                self.tfidf.fit([text_input])
-            text_features = self.tfidf.transform([text_input]).toarray()[0]
-        
-        # Categorical features (one-hot encode)
-        if self.ohe is None:
-            self.ohe = OneHotEncoder(sparse_output=False, handle_unknown="ignore")
-            categorical_data = np.array([[
-                origin_country, destination_country, package_type, shipment_type, service_level
-            ]])
-            self.ohe.fit(categorical_data)
-        
-        categorical_features = self.ohe.transform(np.array([[
-            origin_country, destination_country, package_type, shipment_type, service_level
-        ]]))[0]
-        
-        # Numeric features
-        if self.scaler is None:
-            self.scaler = StandardScaler()
-            self.scaler.fit(np.array([[weight, declared_value]]))
-        
-        numeric_features = self.scaler.transform(np.array([[weight, declared_value]]))[0]
-        
-        # Combine all features
-        features = np.hstack([text_features, categorical_features, numeric_features])
-        return features.reshape(1, -1)
+        """Transform a batch of requests into one feature matrix, timing text encoding separately."""
+        timings = StageTimings() if timings is None else timings
+        pipeline = self.model_components.feature_pipeline
+        with timings.stage("transform"):
+            frame = pd.DataFrame(
+                [[getattr(req, col) for col in FEATURE_COLUMNS] for req in requests],
+                columns=FEATURE_COLUMNS,
+            )
+            if not isinstance(pipeline, ShipmentFeaturePipeline):
+                return pipeline.transform(frame)
+            tabular = pipeline.transform_tabular(frame)
+        # Same result as pipeline.transform(frame), with the encoder on its own clock
+        with timings.stage("encode"):
+            text = pipeline.text_encoder.transform(build_text_inputs(frame))
+        return np.hstack([text, tabular])
     
     def predict(
         self,
         request: DocumentPredictionRequest,
         confidence_threshold: float = 0.5,
-    ) -> List[PredictedDocument]:
+        timings: Optional[StageTimings] = None,
+    ) -> List[DocumentHit]:
         """Generate document predictions for a shipment."""
+        return self.predict_batch([request], confidence_threshold=confidence_threshold, timings=timings)[0]
+    
+    def predict_batch(
+        self,
+        requests: List[DocumentPredictionRequest],
+        confidence_threshold: float = 0.5,
+        timings: Optional[StageTimings] = None,
+    ) -> List[List[DocumentHit]]:
+        """
+        Predict for multiple shipments as one feature matrix.
         
+        Features are built in a single pipeline transform and all label
+        probabilities come from one scorer pass; hard decisions are derived
+        from those probabilities rather than a second inference call.
+        `timings`, when given, receives the seconds spent encoding text,
+        transforming the other features, scoring and selecting documents.
+        """
         if not self.model_components:
             raise RuntimeError("Model not loaded. Call load_model() first.")
+        if not requests:
+            return []
         
-        # Prepare features
-        features = self._prepare_features(
-            product_name=request.product_name,
-            category=request.category,
-            product_description=request.product_description,
-            hs_code=request.hs_code,
-            origin_country=request.origin_country,
-            destination_country=request.destination_country,
-            package_type=request.package_type,
-            weight=request.weight,
-            declared_value=request.declared_value,
-            shipment_type=request.shipment_type,
-            service_level=request.service_level,
-        )
-        
-        # Get predictions and probabilities
-        predictions = self.model_components.classifier.predict(features)[0]
+        timings = StageTimings() if timings is None else timings
+        features = self._prepare_features(requests, timings)
+        with timings.stage("score"):
+            probabilities = self.model_components.scorer.predict_proba(features)
+        with timings.stage("select"):
+            return self._select_documents(probabilities, confidence_threshold)
+    
+    def _select_documents(
+        self,
+        probabilities: np.ndarray,
+        confidence_threshold: float,
+    ) -> List[List[DocumentHit]]:
+        """
+        Apply the decision rule to an (n_samples, n_labels) probability matrix.
         
-        # Get probability estimates from individual classifiers
-        probabilities = []
-        for estimator in self.model_components.classifier.estimators_:
-            proba = estimator.predict_proba(features)[0]
-            probabilities.append(proba[1])  # Probability of positive class
-        probabilities = np.array(probabilities)
+        A label is returned when its probability clears both the label's own
+        decision threshold and the caller's confidence threshold; results are
+        sorted highest confidence first.
+        """
+        cutoffs = np.maximum(self.model_components.decision_thresholds, confidence_threshold)
+        selected = probabilities >= cutoffs
+        order = np.argsort(-probabilities, axis=1, kind="stable")
+        selected_sorted = np.take_along_axis(selected, order, axis=1)
         
-        # Build results
+        label_names = self.model_components.label_names
         results = []
-        for idx, label_name in enumerate(self.model_components.label_names):
-            if predictions[idx]:  # If predicted as required
-                confidence = float(probabilities[idx])
-                if confidence >= confidence_threshold:
-                    results.append(PredictedDocument(
-                        name=label_name,
-                        confidence=confidence,
-                        provenance="ml",
-                    ))
-        
-        # Sort by confidence (highest first)
-        results.sort(key=lambda x: x.confidence, reverse=True)
-        
+        for row_probs, row_order, row_selected in zip(probabilities, order, selected_sorted):
+            chosen = row_order[row_selected]
+            # tolist() yields Python ints and floats in one call instead of per-element numpy scalars
+            results.append([
+                DocumentHit(label_names[idx], confidence)
+                for idx, confidence in zip(chosen.tolist(), row_probs[chosen].tolist())
+            ])
         return results
-    
-    def predict_batch(
-        self,
-        requests: List[DocumentPredictionRequest],
-        confidence_threshold: float = 0.5,
-    ) -> List[List[PredictedDocument]]:
-        """Predict for multiple shipments."""
-        return [
-            self.predict(req, confidence_threshold=confidence_threshold)
-            for req in requests
-        ]
 
 
 async def merge_ml_and_api_predictions(
-    ml_predictions: List[PredictedDocument],
+    ml_predictions: List[Union[DocumentHit, PredictedDocument]],
     api_predictions: Dict[str, Dict],
     ml_weight: float = 0.6,
     api_weight: float = 0.4,
-) -> List[PredictedDocument]:
-    """Merge ML and API predictions using weighted confidence."""
+) -> List[DocumentHit]:
+    """
+    Merge ML and API predictions using weighted confidence.
     
-    merged = {}
+    Inputs are never modified: ML documents without an API match are passed
+    through as they are, and merged or API-only documents are new DocumentHits,
+    so no copies are needed.
+    """
     
-    # Add ML predictions
-    for doc in ml_predictions:
-        merged[doc.name] = doc.copy(deep=True)
+    merged = {doc.name: doc for doc in ml_predictions}
     
     # Merge with API predictions
     for doc_name, api_doc in api_predictions.items():
-        if doc_name in merged:
+        ml_doc = merged.get(doc_name)
+        if ml_doc is not None:
             # Weight the confidences
-            ml_conf = merged[doc_name].confidence
             api_conf = api_doc.get("confidence", 0.9)
-            merged_conf = (ml_conf * ml_weight + api_conf * api_weight) / (ml_weight + api_weight)
-            merged[doc_name].confidence = merged_conf
-            merged[doc_name].provenance = "hybrid"
+            merged[doc_name] = DocumentHit(
+                name=doc_name,
+                confidence=(ml_doc.confidence * ml_weight + api_conf * api_weight) / (ml_weight + api_weight),
+                provenance="hybrid",
+                description=ml_doc.description,
+                regulatory_basis=ml_doc.regulatory_basis,
+            )
         else:
             # Add new API prediction
-            merged[doc_name] = PredictedDocument(
+            merged[doc_name] = DocumentHit(
                 name=doc_name,
                 confidence=api_doc.get("confidence", 0.9),
                 provenance="api",
@@ -273,8 +309,8 @@ async def merge_ml_and_api_predictions(
     return results
 
 
-def load_predictor(models_dir: str = None) -> DocumentPredictor:
+def load_predictor(models_dir: str = None, **kwargs) -> DocumentPredictor:
     """Helper to load and return a predictor."""
-    predictor = DocumentPredictor(models_dir=models_dir)
+    predictor = DocumentPredictor(models_dir=models_dir, **kwargs)
     predictor.load_model()
     return predictor
@@ -0,0 +1,243 @@
+"""
+Sampled Query Log
+Captures normalized service requests to rotating local files for cache warming and replay
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+
+def normalize_query(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonicalize a request payload so identical queries log identically."""
+    normalized = {}
+    for key in sorted(payload):
+        value = payload[key]
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = " ".join(value.split())
+        normalized[key] = value
+    return normalized
+
+
+def query_key(endpoint: str, query: Dict[str, Any], params: Optional[Dict[str, Any]] = None) -> str:
+    """Stable string key for counting identical queries."""
+    return json.dumps([endpoint, query, params or {}], sort_keys=True, separators=(",", ":"))
+
+
+class QueryLogger:
+    """
+    Low-overhead query log.
+
+    Requests are sampled and normalized on the caller's thread, then handed to a
+    background writer through a bounded queue, so logging never blocks a handler.
+    When the queue is full the entry is dropped and counted instead.
+    """
+
+    def __init__(
+        self,
+        log_dir: str,
+        service: str,
+        sample_rate: float = 1.0,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        backup_count: int = DEFAULT_BACKUP_COUNT,
+        queue_size: int = 10000,
+    ):
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.service = service
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.path = self.log_dir / f"{service}.queries.jsonl"
+
+        self.logged = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=queue_size)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._writer = threading.Thread(target=self._run, name=f"query-log-{service}", daemon=True)
+        self._writer.start()
+
+    def log(
+        self,
+        endpoint: str,
+        query: Dict[str, Any],
+        params: Optional[Dict[str, Any]] = None,
+    ):
+        """Record a request if it falls within the sample."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+
+        entry = {
+            "ts": time.time(),
+            "endpoint": endpoint,
+            "query": normalize_query(query),
+        }
+        params = normalize_query(params or {})
+        if params:
+            entry["params"] = params
+
+        try:
+            self._queue.put_nowait(json.dumps(entry, separators=(",", ":")))
+            self.logged += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        """Writer thread: drain the queue in batches and rotate by size."""
+        while True:
+            line = self._queue.get()
+            lines = [line]
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in lines
+            lines = [l for l in lines if l is not None]
+            if lines:
+                try:
+                    if self._file.closed:
+                        # A rotation failed to reopen the file; try again
+                        self._file = open(self.path, "a", encoding="utf-8")
+                    self._file.write("\n".join(lines) + "\n")
+                    self._file.flush()
+                    if self._file.tell() >= self.max_bytes:
+                        self._rotate()
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Query log write failed: {e}")
+            if stop:
+                return
+
+    def _rotate(self):
+        """Shift `name.jsonl` -> `name.jsonl.1` -> ... and drop the oldest."""
+        self._file.close()
+        try:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = self.path.with_name(f"{self.path.name}.{i}")
+                if src.exists():
+                    os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+            if self.backup_count > 0:
+                os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+            else:
+                self.path.unlink()
+        finally:
+            # After a failed shift, keep appending to the unrotated file
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self, timeout: float = 5.0):
+        """Flush pending entries, stop the writer and close the file once it has exited."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=timeout)
+            if self._writer.is_alive():
+                # Closing the file under a running writer would lose its pending entries
+                logger.warning(f"Query log writer for {self.service} did not stop within {timeout}s")
+                return
+        if not self._file.closed:
+            self._file.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring."""
+        return {
+            "path": str(self.path),
+            "sample_rate": self.sample_rate,
+            "logged": self.logged,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize(),
+        }
+
+
+def query_logger_from_env(service: str) -> Optional[QueryLogger]:
+    """Create a logger from QUERY_LOG_* settings; disabled unless QUERY_LOG_DIR is set."""
+    log_dir = os.getenv("QUERY_LOG_DIR", "")
+    if not log_dir:
+        return None
+    return QueryLogger(
+        log_dir=log_dir,
+        service=service,
+        sample_rate=float(os.getenv("QUERY_LOG_SAMPLE_RATE", "1.0")),
+        max_bytes=int(os.getenv("QUERY_LOG_MAX_BYTES", str(DEFAULT_MAX_BYTES))),
+        backup_count=int(os.getenv("QUERY_LOG_BACKUPS", str(DEFAULT_BACKUP_COUNT))),
+    )
+
+
+def iter_query_log(
+    log_dir: str,
+    service: str,
+    endpoint: Optional[str] = None,
+    max_age_seconds: Optional[float] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yield logged entries oldest-first across rotated files."""
+    base = Path(log_dir) / f"{service}.queries.jsonl"
+    rotated = sorted(
+        base.parent.glob(f"{base.name}.*"),
+        key=lambda p: int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0,
+        reverse=True,
+    )
+    cutoff = time.time() - max_age_seconds if max_age_seconds else None
+
+    for path in rotated + [base]:
+        if not path.exists():
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partial line from an interrupted write
+                    continue
+                if endpoint and entry.get("endpoint") != endpoint:
+                    continue
+                if cutoff and entry.get("ts", 0) < cutoff:
+                    continue
+                yield entry
+
+
+def top_queries(
+    log_dir: str,
+    service: str,
+    endpoint: str,
+    limit: int = 100,
+    max_age_seconds: Optional[float] = None,
+) -> List[Tuple[Dict[str, Any], int]]:
+    """Most frequent recent entries as (entry, count), most frequent first."""
+    counts: Counter = Counter()
+    first_seen: Dict[str, Dict[str, Any]] = {}
+    for entry in iter_query_log(log_dir, service, endpoint, max_age_seconds):
+        key = query_key(endpoint, entry["query"], entry.get("params"))
+        counts[key] += 1
+        first_seen.setdefault(key, entry)
+    return [(first_seen[key], count) for key, count in counts.most_common(limit)]
+
+
+def warm_from_log(
+    handler: Callable[[Dict[str, Any], Dict[str, Any]], Any],
+    log_dir: str,
+    service: str,
+    endpoint: str,
+    top_n: int,
+    max_age_seconds: Optional[float] = None,
+) -> int:
+    """Run `handler(query, params)` for the most frequent recent queries."""
+    warmed = 0
+    for entry, _ in top_queries(log_dir, service, endpoint, top_n, max_age_seconds):
+        try:
+            handler(entry["query"], entry.get("params", {}))
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Cache warm failed for {entry['query']}: {e}")
+    return warmed
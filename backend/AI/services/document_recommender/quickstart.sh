@@ -76,7 +76,17 @@ fi
 echo ""
 echo "Checking trained model..."
 
-MODEL_FILE="$MODELS_DIR/required_docs_model.pkl"
+# Published artifacts are named by a pointer file; older ones are an unversioned directory
+MODEL_FILE="$MODELS_DIR/required_docs_model.current"
+if [ ! -f "$MODEL_FILE" ] && [ -f "$MODELS_DIR/required_docs_model/manifest.json" ]; then
+    MODEL_FILE="$MODELS_DIR/required_docs_model/manifest.json"
+fi
+LEGACY_MODEL_FILE="$MODELS_DIR/required_docs_model.pkl"
+
+if [ ! -f "$MODEL_FILE" ] && [ -f "$LEGACY_MODEL_FILE" ]; then
+    echo "Converting pickled model to the memory-mappable format..."
+    python3 "$SCRIPT_DIR/model_artifact.py" "$LEGACY_MODEL_FILE"
+fi
 
 if [ ! -f "$MODEL_FILE" ]; then
     echo "Training model..."
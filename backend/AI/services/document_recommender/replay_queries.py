@@ -0,0 +1,126 @@
+"""
+Query Log Replay Tool
+Lists the most frequent logged queries and replays query logs against a running
+service at a configurable speed-up as a realistic load test.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+import numpy as np
+
+from query_log import iter_query_log, top_queries
+
+
+async def replay_log(
+    base_url: str,
+    entries: List[Dict[str, Any]],
+    speedup: float = 1.0,
+    concurrency: int = 64,
+    timeout: float = 30.0,
+) -> Dict[str, Any]:
+    """
+    Replay logged entries preserving their relative timing.
+
+    Inter-arrival gaps are divided by `speedup`; a speedup of 0 sends requests
+    as fast as `concurrency` allows.
+    """
+    if not entries:
+        return {"requests": 0}
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    t0_log = entries[0]["ts"]
+
+    async def send(session: aiohttp.ClientSession, entry: Dict[str, Any], t0: float):
+        if speedup > 0:
+            delay = (entry["ts"] - t0_log) / speedup - (time.perf_counter() - t0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(
+                    base_url.rstrip("/") + entry["endpoint"],
+                    json=entry["query"],
+                    params=entry.get("params") or None,
+                ) as resp:
+                    await resp.read()
+                    status = str(resp.status)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=client_timeout, connector=connector) as session:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(send(session, entry, t0) for entry in entries))
+        elapsed = time.perf_counter() - t0
+
+    lat_ms = np.array(latencies) * 1000
+    return {
+        "requests": len(entries),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(entries) / elapsed, 1) if elapsed else None,
+        "statuses": statuses,
+        "latency_ms": {
+            "p50": round(float(np.percentile(lat_ms, 50)), 2),
+            "p95": round(float(np.percentile(lat_ms, 95)), 2),
+            "p99": round(float(np.percentile(lat_ms, 99)), 2),
+            "max": round(float(lat_ms.max()), 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay service query logs")
+    parser.add_argument("--log-dir", required=True, help="Directory containing query logs")
+    parser.add_argument(
+        "--service",
+        default="document_recommender",
+        help="Service log name (document_recommender or hs_service)",
+    )
+    parser.add_argument("--endpoint", help="Only use entries for this endpoint, e.g. /predict")
+    parser.add_argument("--max-age-hours", type=float, help="Ignore entries older than this")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    top_parser = subparsers.add_parser("top", help="Print the most frequent queries")
+    top_parser.add_argument("--limit", type=int, default=20)
+
+    replay_parser = subparsers.add_parser("replay", help="Replay the log against a running service")
+    replay_parser.add_argument("--url", default="http://localhost:8002", help="Service base URL")
+    replay_parser.add_argument(
+        "--speedup",
+        type=float,
+        default=1.0,
+        help="Divide recorded inter-arrival gaps by this factor (0 = no pacing)",
+    )
+    replay_parser.add_argument("--concurrency", type=int, default=64)
+    replay_parser.add_argument("--limit", type=int, help="Replay at most this many entries")
+
+    args = parser.parse_args()
+    max_age: Optional[float] = args.max_age_hours * 3600 if args.max_age_hours else None
+
+    if args.command == "top":
+        if not args.endpoint:
+            parser.error("top requires --endpoint")
+        for entry, count in top_queries(args.log_dir, args.service, args.endpoint, args.limit, max_age):
+            print(f"{count:8d}  {json.dumps(entry['query'], sort_keys=True)}")
+        return
+
+    entries = list(iter_query_log(args.log_dir, args.service, args.endpoint, max_age))
+    if args.limit:
+        entries = entries[:args.limit]
+    print(f"Replaying {len(entries)} queries against {args.url} (speedup={args.speedup}x)...")
+    report = asyncio.run(replay_log(args.url, entries, args.speedup, args.concurrency))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Prediction Response Cache
+Memory-bounded LRU of final /predict results, keyed by request, mode, threshold and model
+"""
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from predict_documents import DocumentHit, DocumentPredictionRequest
+from query_log import normalize_query
+from service_metrics import Histogram
+
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+# Rough per-entry bookkeeping (key, OrderedDict node, tuple) on top of the payload
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def bucket_value(value: float, width: float) -> float:
+    """Snap a number to the lower edge of its bucket; width 0 keeps it exact."""
+    if not width:
+        return float(value)
+    return math.floor(value / width) * width
+
+
+def request_cache_key(
+    request: DocumentPredictionRequest,
+    mode: str,
+    confidence_threshold: float,
+    model_version: str,
+    numeric_buckets: Optional[Dict[str, float]] = None,
+) -> str:
+    """
+    Canonical hash of everything that determines a /predict result.
+
+    Strings are whitespace-normalized the same way the query log does it.
+    `numeric_buckets` maps numeric fields (weight, declared_value) to a bucket
+    width, so shipments that differ only by a few grams share an entry; only
+    enable it for widths that never straddle a rule cut-off.
+    """
+    query = normalize_query(request.model_dump())
+    for field, width in (numeric_buckets or {}).items():
+        if field in query:
+            query[field] = bucket_value(query[field], width)
+    payload = json.dumps(
+        [query, mode, round(confidence_threshold, 6), model_version],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _estimate_size(documents: List[DocumentHit]) -> int:
+    size = ENTRY_OVERHEAD_BYTES
+    for doc in documents:
+        size += 64 + len(doc.name) + len(doc.provenance)
+        size += len(doc.description or "") + len(doc.regulatory_basis or "")
+    return size
+
+
+class ResponseCache:
+    """
+    LRU of predicted document lists with a byte budget and a TTL.
+
+    Entries are evicted least-recently-used first once `max_bytes` is exceeded,
+    and treated as misses after `ttl_seconds`. The model fingerprint is part
+    of every key, so a different model never sees another model's entries;
+    theirs age out through the TTL and LRU. Hit and miss latencies are
+    recorded by the caller through `observe`.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 300.0,
+        numeric_buckets: Optional[Dict[str, float]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.numeric_buckets = {k: v for k, v in (numeric_buckets or {}).items() if v}
+        self._entries: "OrderedDict[str, Tuple[float, int, List[DocumentHit]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.hit_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.miss_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+
+    def key(
+        self,
+        request: DocumentPredictionRequest,
+        mode: str,
+        confidence_threshold: float,
+        model_version: str,
+    ) -> str:
+        return request_cache_key(request, mode, confidence_threshold, model_version, self.numeric_buckets)
+
+    def get(self, key: str) -> Optional[List[DocumentHit]]:
+        """Cached documents for a key, or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, size, documents = entry
+            if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.bytes -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return documents
+
+    def put(self, key: str, documents: List[DocumentHit]):
+        size = _estimate_size(documents)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (time.monotonic(), size, list(documents))
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def observe(self, hit: bool, seconds: float):
+        (self.hit_latency_ms if hit else self.miss_latency_ms).observe(seconds * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit ratio, memory use and hit-vs-miss latency for monitoring."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "numeric_buckets": self.numeric_buckets,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_latency_ms": self.hit_latency_ms.snapshot(),
+            "miss_latency_ms": self.miss_latency_ms.snapshot(),
+        }
@@ -0,0 +1,313 @@
+"""
+Declarative Compliance Rule Engine
+Rule tables indexed by destination and HS chapter, with keywords matched in one regex pass
+"""
+import bisect
+import json
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+DEFAULT_RULES_PATH = Path(__file__).parent / "compliance_rules.yaml"
+ANY = "*"
+
+# (hs_code, origin_country, destination_country, product_description)
+Shipment = Tuple[str, str, str, str]
+
+# Never part of a keyword, so descriptions can be joined for a single batch scan
+_SEPARATOR = "\x00"
+
+
+@dataclass(frozen=True)
+class Rule:
+    """One compiled rule: where it applies, what it emits and the keywords it checks."""
+    id: str
+    document: str
+    source: str
+    confidence: float
+    description: Optional[str]
+    regulatory_basis: Optional[str]
+    destinations: Tuple[str, ...]
+    chapters: Optional[FrozenSet[str]]  # None means any chapter
+    keywords: FrozenSet[str]
+    also_keywords: Optional[FrozenSet[str]]  # one of these must occur as well
+    required_keywords: Optional[FrozenSet[str]]
+
+    def applies_to(self, destination: str, chapter: Optional[str]) -> bool:
+        if self.chapters is not None and chapter not in self.chapters:
+            return False
+        return any(
+            d == ANY or d == destination or (d.endswith(ANY) and destination.startswith(d[:-1]))
+            for d in self.destinations
+        )
+
+
+def hs_chapter(hs_code: str) -> Optional[str]:
+    """Two-digit HS chapter of a code such as "2106.10", or None if it has none."""
+    digits = "".join(ch for ch in str(hs_code) if ch.isdigit())
+    return digits[:2] if len(digits) >= 2 else None
+
+
+def _expand_chapters(specs: Iterable[Any]) -> List[str]:
+    chapters = []
+    for spec in specs:
+        spec = str(spec)
+        if "-" in spec:
+            low, high = (int(part) for part in spec.split("-", 1))
+            chapters.extend(f"{chapter:02d}" for chapter in range(low, high + 1))
+        else:
+            chapters.append(f"{int(spec):02d}")
+    return chapters
+
+
+def _build_trie(words: Iterable[str]) -> Dict[str, Any]:
+    """Character trie; the "" key marks the end of a word."""
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    return trie
+
+
+def _trie_pattern(trie: Dict[str, Any]) -> str:
+    """
+    Regex for the words in a trie, factored by common prefixes.
+
+    A flat alternation tries every word at every position; the factored form
+    follows one branch per character, so matching cost hardly grows with the
+    number of words. Optional suffixes are greedy, so the longest word wins.
+    """
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        terminal = "" in node
+        if len(branches) == 1 and not terminal:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if terminal else group
+
+    return build(trie)
+
+
+def _prefix_words(trie: Dict[str, Any], text: str) -> List[str]:
+    """Words in the trie that are prefixes of `text`."""
+    found, node = [], trie
+    for i, ch in enumerate(text):
+        node = node.get(ch)
+        if node is None:
+            break
+        if "" in node:
+            found.append(text[:i + 1])
+    return found
+
+
+class KeywordMatcher:
+    """
+    Finds every keyword occurring in a text with one regex scan.
+
+    The keyword trie is searched from each position where a keyword can
+    start, yielding the longest keyword starting there; the scan resumes one
+    character later, so keywords overlapping a match are still found. Any
+    shorter keyword inside a match is added from a precomputed table of the
+    keywords contained in each keyword ("plant" inside "plantation").
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = sorted({kw.lower() for kw in keywords if kw})
+        trie = _build_trie(self.keywords)
+        self._pattern = re.compile(_trie_pattern(trie)) if self.keywords else None
+
+        # Keywords contained in each keyword: its keyword prefixes, plus (shortest
+        # first, so they are already known) whatever is contained in the longest
+        # keyword starting at each later position
+        self._contained: Dict[str, FrozenSet[str]] = {}
+        for kw in sorted(self.keywords, key=len):
+            contained = set(_prefix_words(trie, kw))
+            for _, match in self._scan(kw, 1):
+                contained |= self._contained[match]
+            self._contained[kw] = frozenset(contained)
+
+    def _scan(self, text: str, pos: int = 0):
+        """(start, longest keyword) for every position where a keyword starts."""
+        search = self._pattern.search
+        match = search(text, pos)
+        while match is not None:
+            yield match.start(), match.group()
+            match = search(text, match.start() + 1)
+
+    def find(self, text: str) -> Set[str]:
+        """Keywords occurring in `text`, which must already be lowercased."""
+        found: Set[str] = set()
+        if self._pattern is None:
+            return found
+        for _, match in self._scan(text):
+            found |= self._contained[match]
+        return found
+
+    def find_many(self, texts: Sequence[str]) -> List[Set[str]]:
+        """Keywords per text, scanning all texts in one pass."""
+        found: List[Set[str]] = [set() for _ in texts]
+        if self._pattern is None or not texts:
+            return found
+        starts, offset = [], 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + 1
+        for start, match in self._scan(_SEPARATOR.join(texts)):
+            found[bisect.bisect_right(starts, start) - 1] |= self._contained[match]
+        return found
+
+
+class RuleEngine:
+    """
+    Evaluates one provider's rule table.
+
+    Rules without keywords are indexed by (destination, HS chapter); rules
+    with keywords are indexed by keyword, and all keywords share one
+    KeywordMatcher. A lookup is one scan of the description plus the rules
+    indexed under its destination and chapter or under a keyword that
+    occurred, so rules that cannot fire cost nothing, however many there are.
+    """
+
+    def __init__(self, rules: Sequence[Rule]):
+        self.rules = list(rules)
+        self._exact: Dict[Tuple[str, str], List[int]] = {}
+        self._prefixed: Dict[str, Dict[str, List[int]]] = {}
+        self._by_keyword: Dict[str, List[int]] = {}
+        for position, rule in enumerate(self.rules):
+            if rule.keywords:
+                for keyword in rule.keywords:
+                    self._by_keyword.setdefault(keyword, []).append(position)
+                continue
+            for destination in rule.destinations:
+                for chapter in (rule.chapters or (ANY,)):
+                    if destination.endswith(ANY) and destination != ANY:
+                        bucket = self._prefixed.setdefault(destination[:-1], {})
+                        bucket.setdefault(chapter, []).append(position)
+                    else:
+                        self._exact.setdefault((destination, chapter), []).append(position)
+        self.matcher = KeywordMatcher(
+            kw for rule in self.rules
+            for kw in rule.keywords | (rule.also_keywords or frozenset()) | (rule.required_keywords or frozenset())
+        )
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], source: str) -> "RuleEngine":
+        rules = []
+        for position, spec in enumerate(config.get("rules", [])):
+            rules.append(Rule(
+                id=spec.get("id", f"{source}-{position}"),
+                document=spec["document"],
+                source=source,
+                confidence=float(spec.get("confidence", 0.9)),
+                description=spec.get("description"),
+                regulatory_basis=spec.get("regulatory_basis"),
+                destinations=tuple(str(d).strip() for d in spec.get("destinations", [ANY])),
+                chapters=frozenset(_expand_chapters(spec["hs_chapters"])) if "hs_chapters" in spec else None,
+                keywords=frozenset(kw.lower() for kw in spec.get("keywords", [])),
+                also_keywords=(
+                    frozenset(kw.lower() for kw in spec["also_keywords"])
+                    if "also_keywords" in spec else None
+                ),
+                required_keywords=(
+                    frozenset(kw.lower() for kw in spec["required_keywords"])
+                    if "required_keywords" in spec else None
+                ),
+            ))
+        return cls(rules)
+
+    def candidates(self, destination: str, chapter: Optional[str], keywords: Set[str]) -> List[int]:
+        """Positions of the rules that fire for this shipment, in table order."""
+        chapters = (chapter, ANY) if chapter else (ANY,)
+        positions: Set[int] = set()
+        for dest in (destination, ANY):
+            for chap in chapters:
+                positions.update(self._exact.get((dest, chap), ()))
+        for prefix, bucket in self._prefixed.items():
+            if destination.startswith(prefix):
+                for chap in chapters:
+                    positions.update(bucket.get(chap, ()))
+        for keyword in keywords:
+            for position in self._by_keyword.get(keyword, ()):
+                if position not in positions and self.rules[position].applies_to(destination, chapter):
+                    positions.add(position)
+        return sorted(positions)
+
+    def _apply(self, hs_code: str, destination_country: str, keywords: Set[str]) -> List[Dict[str, Any]]:
+        positions = self.candidates(destination_country, hs_chapter(hs_code), keywords)
+        documents: Dict[str, Dict[str, Any]] = {}
+        for position in positions:
+            rule = self.rules[position]
+            if rule.also_keywords is not None and not rule.also_keywords & keywords:
+                continue
+            required = rule.required_keywords is None or bool(rule.required_keywords & keywords)
+            existing = documents.get(rule.document)
+            if existing is None:
+                documents[rule.document] = {
+                    "name": rule.document,
+                    "provider": rule.source,
+                    "confidence": rule.confidence,
+                    "description": rule.description,
+                    "regulatory_basis": rule.regulatory_basis,
+                    "required": required,
+                }
+            else:
+                # Several rules emitting one document: it is required if any says so
+                existing["required"] = existing["required"] or required
+                existing["confidence"] = max(existing["confidence"], rule.confidence)
+        return list(documents.values())
+
+    def evaluate(
+        self,
+        hs_code: str,
+        origin_country: str,
+        destination_country: str,
+        product_description: str,
+    ) -> List[Dict[str, Any]]:
+        """Documents the table requires for one shipment, as DocumentRequirement fields."""
+        return self._apply(hs_code, destination_country, self.matcher.find(product_description.lower()))
+
+    def evaluate_batch(self, shipments: Sequence[Shipment]) -> List[List[Dict[str, Any]]]:
+        """Documents for many shipments, with one keyword scan over all descriptions."""
+        texts = [description.lower().replace(_SEPARATOR, " ") for _, _, _, description in shipments]
+        keywords = self.matcher.find_many(texts)
+        return [
+            self._apply(hs_code, destination, found)
+            for (hs_code, _, destination, _), found in zip(shipments, keywords)
+        ]
+
+
+def _read_config(path: Path) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        if path.suffix.lower() == ".json":
+            return json.load(f)
+        import yaml
+        return yaml.safe_load(f)
+
+
+@lru_cache(maxsize=8)
+def _load_cached(path: str, mtime: float) -> Dict[str, RuleEngine]:
+    config = _read_config(Path(path))
+    if config.get("version", 1) != 1:
+        raise ValueError(f"Unsupported rule table version in {path}")
+    return {
+        provider: RuleEngine.from_config(spec, spec.get("source", provider))
+        for provider, spec in config.get("providers", {}).items()
+    }
+
+
+def load_rule_table(path: Optional[str] = None) -> Dict[str, RuleEngine]:
+    """
+    Compile a YAML or JSON rule table into one RuleEngine per provider.
+
+    Defaults to COMPLIANCE_RULES_PATH, else the bundled compliance_rules.yaml.
+    Compiled tables are shared until the file changes.
+    """
+    path = Path(path or os.getenv("COMPLIANCE_RULES_PATH") or DEFAULT_RULES_PATH).resolve()
+    return _load_cached(str(path), path.stat().st_mtime)
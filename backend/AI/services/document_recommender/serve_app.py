@@ -5,28 +5,46 @@ Serves ML model predictions with optional API integration
 import os
 import asyncio
 import logging
+import time
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, Tuple
 from pathlib import Path
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import uvicorn
 from pydantic import BaseModel
 
 from predict_documents import (
     DocumentPredictor,
     DocumentPredictionRequest,
+    DocumentHit,
     DocumentPredictionResponse,
-    PredictedDocument,
     merge_ml_and_api_predictions,
     load_predictor,
 )
 from api_integration import (
     DocumentRecommendationMode,
     ComplianceIntegration,
+    HTTPClientConfig,
+    ProviderResultCache,
+    ProviderResults,
+    RetryPolicy,
     create_default_integration,
 )
+from async_predictor import AsyncDocumentPredictor, MicroBatcher
+from fast_json import FastJSONResponse
+from query_log import QueryLogger, query_logger_from_env, top_queries
+from response_cache import ResponseCache
+from service_metrics import (
+    PROMETHEUS_CONTENT_TYPE,
+    STAGE_BUCKETS_MS,
+    Histogram,
+    LoopLagMonitor,
+    PrometheusExposition,
+    StageTimings,
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -43,15 +61,65 @@ DOCUMENT_MODEL_PATH = os.getenv(
 )
 COMPLIANCE_API_BASE_URL = os.getenv("COMPLIANCE_API_BASE_URL", "")
 COMPLIANCE_API_KEY = os.getenv("COMPLIANCE_API_KEY", "")
+COMPLIANCE_HTTP_MAX_CONNECTIONS = int(os.getenv("COMPLIANCE_HTTP_MAX_CONNECTIONS", "100"))
+COMPLIANCE_HTTP_MAX_PER_HOST = int(os.getenv("COMPLIANCE_HTTP_MAX_PER_HOST", "10"))
+COMPLIANCE_HTTP_KEEPALIVE_SECONDS = float(os.getenv("COMPLIANCE_HTTP_KEEPALIVE_SECONDS", "30"))
+COMPLIANCE_HTTP_DNS_TTL_SECONDS = int(os.getenv("COMPLIANCE_HTTP_DNS_TTL_SECONDS", "300"))
+COMPLIANCE_HTTP_CONNECT_TIMEOUT = float(os.getenv("COMPLIANCE_HTTP_CONNECT_TIMEOUT", "5"))
+COMPLIANCE_HTTP_READ_TIMEOUT = float(os.getenv("COMPLIANCE_HTTP_READ_TIMEOUT", "0")) or None
+COMPLIANCE_HTTP_TOTAL_TIMEOUT = float(os.getenv("COMPLIANCE_HTTP_TOTAL_TIMEOUT", "30"))
+PROVIDER_BUDGET_MS = float(os.getenv("PROVIDER_BUDGET_MS", "1500"))
+PROVIDER_BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", "5"))
+PROVIDER_BREAKER_RESET_SECONDS = float(os.getenv("PROVIDER_BREAKER_RESET_SECONDS", "30"))
+PROVIDER_HEDGE_AFTER_MS = float(os.getenv("PROVIDER_HEDGE_AFTER_MS", "0"))
+PROVIDER_RETRY_MAX_ATTEMPTS = int(os.getenv("PROVIDER_RETRY_MAX_ATTEMPTS", "3"))
+PROVIDER_RETRY_BASE_DELAY_MS = float(os.getenv("PROVIDER_RETRY_BASE_DELAY_MS", "250"))
+PROVIDER_RETRY_MAX_DELAY_MS = float(os.getenv("PROVIDER_RETRY_MAX_DELAY_MS", "4000"))
+PROVIDER_RETRY_TOTAL_SECONDS = float(os.getenv("PROVIDER_RETRY_TOTAL_SECONDS", "15"))
+PROVIDER_CACHE_MAX_ENTRIES = int(os.getenv("PROVIDER_CACHE_MAX_ENTRIES", "10000"))
+PROVIDER_CACHE_MAX_STALE_SECONDS = float(os.getenv("PROVIDER_CACHE_MAX_STALE_SECONDS", "86400"))
+PROVIDER_CACHE_PATH = os.getenv("PROVIDER_CACHE_PATH") or None
+# Per-provider TTL overrides, e.g. "Descartes=600,USDA=0"
+PROVIDER_CACHE_TTLS = {
+    name.strip(): float(ttl)
+    for name, ttl in (
+        item.split("=", 1) for item in os.getenv("PROVIDER_CACHE_TTLS", "").split(",") if "=" in item
+    )
+}
 CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.5"))
 ML_WEIGHT = float(os.getenv("ML_WEIGHT", "0.6"))
 API_WEIGHT = float(os.getenv("API_WEIGHT", "0.4"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or None
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0")) or None
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("INFERENCE_MAX_CONCURRENCY", "0")) or None
+BATCH_PROVIDER_CONCURRENCY = int(os.getenv("BATCH_PROVIDER_CONCURRENCY", "16"))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "32"))
+MICRO_BATCH_MAX_DELAY_MS = float(os.getenv("MICRO_BATCH_MAX_DELAY_MS", "2"))
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+RESPONSE_CACHE_WEIGHT_BUCKET = float(os.getenv("RESPONSE_CACHE_WEIGHT_BUCKET", "0"))
+RESPONSE_CACHE_VALUE_BUCKET = float(os.getenv("RESPONSE_CACHE_VALUE_BUCKET", "0"))
+QUERY_LOG_SERVICE = "document_recommender"
+QUERY_LOG_WARM_TOP_N = int(os.getenv("QUERY_LOG_WARM_TOP_N", "0"))
+QUERY_LOG_WARM_MAX_AGE_HOURS = float(os.getenv("QUERY_LOG_WARM_MAX_AGE_HOURS", "24"))
+# Warming calls external providers only when opted in, and then at most one query per interval
+QUERY_LOG_WARM_PROVIDERS = os.getenv("QUERY_LOG_WARM_PROVIDERS", "0").lower() in ("1", "true", "yes")
+QUERY_LOG_WARM_PROVIDER_INTERVAL_MS = float(os.getenv("QUERY_LOG_WARM_PROVIDER_INTERVAL_MS", "200"))
+# SERVER_TIMING=1 adds a Server-Timing header with per-stage durations to prediction responses
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+
+# Request-level stages; inference and provider stages are timed by their own components
+REQUEST_STAGES = ("cache", "ml", "api", "merge", "serialize")
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Document Requirement Predictor",
     description="Predicts required shipping documents using ML and optional API integration",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
 )
 
 # Add CORS middleware
@@ -65,21 +133,78 @@ app.add_middleware(
 
 # Global state
 predictor: Optional[DocumentPredictor] = None
+async_predictor: Optional[AsyncDocumentPredictor] = None
+micro_batcher: Optional[MicroBatcher] = None
+response_cache: Optional[ResponseCache] = None
 compliance_integration: Optional[ComplianceIntegration] = None
+query_logger: Optional[QueryLogger] = None
+loop_lag_monitor: Optional[LoopLagMonitor] = None
+request_duration_ms: Dict[str, Histogram] = {}
+request_stage_ms: Dict[Tuple[str, str], Histogram] = {}
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize ML model and providers on startup."""
-    global predictor, compliance_integration
+    global predictor, async_predictor, micro_batcher, response_cache, compliance_integration, query_logger
+    global loop_lag_monitor
     
     logger.info("Starting Document Requirement Predictor Service...")
     
+    # LOOP_LAG_INTERVAL_MS=0 disables the event-loop lag probe
+    if LOOP_LAG_INTERVAL_MS > 0:
+        loop_lag_monitor = LoopLagMonitor(interval=LOOP_LAG_INTERVAL_MS / 1000)
+        loop_lag_monitor.start()
+    
+    # RESPONSE_CACHE_MAX_MB=0 disables the /predict response cache
+    if RESPONSE_CACHE_MAX_MB > 0:
+        response_cache = ResponseCache(
+            max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+            ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+            numeric_buckets={
+                "weight": RESPONSE_CACHE_WEIGHT_BUCKET,
+                "declared_value": RESPONSE_CACHE_VALUE_BUCKET,
+            },
+        )
+        logger.info(f"✓ Response cache: {RESPONSE_CACHE_MAX_MB:g} MB, {RESPONSE_CACHE_TTL_SECONDS:g}s TTL")
+    
     try:
         # Load ML model
         logger.info(f"Loading ML model from {DOCUMENT_MODEL_PATH}...")
-        predictor = load_predictor(models_dir=DOCUMENT_MODEL_PATH)
+        predictor = load_predictor(
+            models_dir=DOCUMENT_MODEL_PATH,
+            embedding_cache_size=EMBEDDING_CACHE_SIZE,
+            embedding_cache_path=EMBEDDING_CACHE_PATH,
+        )
         logger.info("✓ ML model loaded successfully")
+        
+        # Inference runs off the event loop so health checks and provider calls stay responsive
+        async_predictor = AsyncDocumentPredictor(
+            predictor,
+            executor=INFERENCE_EXECUTOR,
+            max_workers=INFERENCE_WORKERS,
+            max_concurrency=INFERENCE_MAX_CONCURRENCY,
+            predictor_kwargs={
+                "embedding_cache_size": EMBEDDING_CACHE_SIZE,
+                "embedding_cache_path": EMBEDDING_CACHE_PATH,
+            },
+        )
+        logger.info(
+            f"✓ Inference pool: {async_predictor.max_workers} {INFERENCE_EXECUTOR} workers, "
+            f"max {async_predictor.max_concurrency} concurrent"
+        )
+        
+        # MICRO_BATCH_MAX_SIZE=1 sends every /predict straight to the pool
+        if MICRO_BATCH_MAX_SIZE > 1:
+            micro_batcher = MicroBatcher(
+                async_predictor,
+                max_batch_size=MICRO_BATCH_MAX_SIZE,
+                max_delay_ms=MICRO_BATCH_MAX_DELAY_MS,
+            )
+            logger.info(
+                f"✓ Micro-batching /predict: up to {MICRO_BATCH_MAX_SIZE} requests, "
+                f"{MICRO_BATCH_MAX_DELAY_MS}ms max delay"
+            )
     except Exception as e:
         logger.error(f"Failed to load ML model: {e}")
         if DOCUMENT_RECOMMENDER_MODE.lower() == "ml_only":
@@ -90,19 +215,113 @@ async def startup_event():
         try:
             logger.info(f"Initializing compliance providers (mode: {DOCUMENT_RECOMMENDER_MODE})...")
             mode = DocumentRecommendationMode(DOCUMENT_RECOMMENDER_MODE.lower())
+            # PROVIDER_CACHE_MAX_ENTRIES=0 sends every lookup to the providers
+            result_cache = None
+            if PROVIDER_CACHE_MAX_ENTRIES > 0:
+                result_cache = ProviderResultCache(
+                    ttls=PROVIDER_CACHE_TTLS,
+                    max_stale=PROVIDER_CACHE_MAX_STALE_SECONDS,
+                    max_entries=PROVIDER_CACHE_MAX_ENTRIES,
+                    db_path=PROVIDER_CACHE_PATH,
+                )
             compliance_integration = create_default_integration(
                 mode=mode,
                 descartes_api_key=COMPLIANCE_API_KEY if COMPLIANCE_API_KEY else None,
+                http_config=HTTPClientConfig(
+                    limit=COMPLIANCE_HTTP_MAX_CONNECTIONS,
+                    limit_per_host=COMPLIANCE_HTTP_MAX_PER_HOST,
+                    keepalive_timeout=COMPLIANCE_HTTP_KEEPALIVE_SECONDS,
+                    dns_cache_ttl=COMPLIANCE_HTTP_DNS_TTL_SECONDS,
+                    connect_timeout=COMPLIANCE_HTTP_CONNECT_TIMEOUT,
+                    read_timeout=COMPLIANCE_HTTP_READ_TIMEOUT,
+                    total_timeout=COMPLIANCE_HTTP_TOTAL_TIMEOUT,
+                ),
+                result_cache=result_cache,
+                retry_policy=RetryPolicy(
+                    max_attempts=PROVIDER_RETRY_MAX_ATTEMPTS,
+                    base_delay=PROVIDER_RETRY_BASE_DELAY_MS / 1000,
+                    max_delay=PROVIDER_RETRY_MAX_DELAY_MS / 1000,
+                    total_timeout=PROVIDER_RETRY_TOTAL_SECONDS,
+                ),
+                failure_threshold=PROVIDER_BREAKER_FAILURES,
+                reset_timeout=PROVIDER_BREAKER_RESET_SECONDS,
+                hedge_after=PROVIDER_HEDGE_AFTER_MS / 1000 if PROVIDER_HEDGE_AFTER_MS > 0 else None,
+                batch_concurrency=BATCH_PROVIDER_CONCURRENCY,
             )
+            # One pooled session for every provider call, closed on shutdown
+            await compliance_integration.start()
             logger.info("✓ Compliance integration initialized")
         except Exception as e:
             logger.error(f"Failed to initialize compliance integration: {e}")
             if DOCUMENT_RECOMMENDER_MODE.lower() == "api_only":
                 raise
     
+    if QUERY_LOG_WARM_TOP_N > 0 and os.getenv("QUERY_LOG_DIR"):
+        await warm_caches_from_query_log()
+    
+    query_logger = query_logger_from_env(QUERY_LOG_SERVICE)
+    if query_logger:
+        logger.info(f"Query log enabled at {query_logger.path} (sample rate {query_logger.sample_rate})")
+    
     logger.info(f"Service ready in {DOCUMENT_RECOMMENDER_MODE} mode")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush the query log, close provider connections and stop the inference pool."""
+    if loop_lag_monitor:
+        loop_lag_monitor.close()
+    if compliance_integration:
+        await compliance_integration.close()
+    if query_logger:
+        query_logger.close()
+    if micro_batcher:
+        micro_batcher.close()
+    if async_predictor:
+        async_predictor.close()
+
+
+async def warm_caches_from_query_log():
+    """
+    Replay the most frequent recent /predict queries to warm the caches.
+    
+    By default no provider is called: in ml_only mode queries go through the
+    handler, filling the response cache, and otherwise only the ML model is
+    warmed. With QUERY_LOG_WARM_PROVIDERS set, hybrid and api_only queries go
+    through the handler too, one per QUERY_LOG_WARM_PROVIDER_INTERVAL_MS.
+    """
+    mode = DOCUMENT_RECOMMENDER_MODE.lower()
+    through_handler = mode == "ml_only" or QUERY_LOG_WARM_PROVIDERS
+    if not through_handler and mode != "hybrid":
+        logger.info("Cache warming skipped: api_only mode without QUERY_LOG_WARM_PROVIDERS")
+        return
+    
+    entries = top_queries(
+        os.getenv("QUERY_LOG_DIR"),
+        QUERY_LOG_SERVICE,
+        "/predict",
+        limit=QUERY_LOG_WARM_TOP_N,
+        max_age_seconds=QUERY_LOG_WARM_MAX_AGE_HOURS * 3600,
+    )
+    warmed = 0
+    for i, (entry, _) in enumerate(entries):
+        threshold = entry.get("params", {}).get("confidence_threshold")
+        try:
+            request = DocumentPredictionRequest(**entry["query"])
+            if not through_handler:
+                await (micro_batcher or async_predictor).predict(
+                    request, confidence_threshold=threshold or CONFIDENCE_THRESHOLD
+                )
+            else:
+                if i > 0 and mode != "ml_only":
+                    await asyncio.sleep(QUERY_LOG_WARM_PROVIDER_INTERVAL_MS / 1000)
+                await predict_documents(request, confidence_threshold=threshold)
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Cache warm failed: {e}")
+    logger.info(f"✓ Warmed caches with {warmed}/{len(entries)} logged queries")
+
+
 class HealthResponse(BaseModel):
     """Health check response."""
     status: str
@@ -129,6 +348,7 @@ class ModelInfoResponse(BaseModel):
     num_document_types: int
     document_types: List[str]
     timestamp: str
+    stats: Dict[str, Any] = {}
 
 
 @app.get("/model-info", response_model=ModelInfoResponse)
@@ -143,6 +363,13 @@ async def model_info():
         num_document_types=len(predictor.model_components.label_names),
         document_types=predictor.model_components.label_names,
         timestamp=predictor.model_components.metadata.get("training_timestamp", ""),
+        stats={
+            **predictor.stats(),
+            "inference_pool": async_predictor.stats() if async_predictor else None,
+            "micro_batching": micro_batcher.stats() if micro_batcher else None,
+            "response_cache": response_cache.stats() if response_cache else None,
+            "compliance": compliance_integration.stats() if compliance_integration else None,
+        },
     )
 
 
@@ -151,6 +378,7 @@ async def predict_documents(
     request: DocumentPredictionRequest,
     shipment_id: Optional[str] = None,
     confidence_threshold: Optional[float] = None,
+    budget_ms: Optional[float] = None,
 ):
     """
     Predict required documents for a shipment.
@@ -159,51 +387,170 @@ async def predict_documents(
         request: Shipment details
         shipment_id: Optional shipment ID for reference
         confidence_threshold: Override default confidence threshold (0.0-1.0)
+        budget_ms: Override PROVIDER_BUDGET_MS, the time providers get to answer
     
     Returns:
         DocumentPredictionResponse with predicted documents
-    """
     
+    Providers that miss the budget, fail or are skipped by their circuit
+    breaker are left out and the response is flagged `partial`. Identical
+    requests within RESPONSE_CACHE_TTL_SECONDS are answered from the response
+    cache; partial results are not cached.
+    """
+    start = time.perf_counter()
+    timings = StageTimings()
+    deadline = _deadline(budget_ms)
     threshold = confidence_threshold or CONFIDENCE_THRESHOLD
     
-    # ML predictions
-    ml_predictions = []
-    if DOCUMENT_RECOMMENDER_MODE.lower() in ["ml_only", "hybrid"]:
-        if not predictor:
-            raise HTTPException(status_code=503, detail="ML model not loaded")
-        try:
-            ml_predictions = predictor.predict(request, confidence_threshold=threshold)
-        except Exception as e:
-            logger.error(f"ML prediction error: {e}")
-            if DOCUMENT_RECOMMENDER_MODE.lower() == "ml_only":
-                raise HTTPException(status_code=500, detail=str(e))
+    if query_logger:
+        query_logger.log(
+            "/predict",
+            request.model_dump(),
+            params={"confidence_threshold": confidence_threshold},
+        )
     
-    # API predictions
-    api_predictions = {}
-    if DOCUMENT_RECOMMENDER_MODE.lower() in ["api_only", "hybrid"]:
-        if not compliance_integration:
-            raise HTTPException(status_code=503, detail="Compliance integration not initialized")
-        try:
-            api_docs = await compliance_integration.get_documents_from_providers(
-                hs_code=request.hs_code,
-                origin_country=request.origin_country,
-                destination_country=request.destination_country,
-                product_description=request.product_description,
+    mode = DOCUMENT_RECOMMENDER_MODE.lower()
+    _check_ready(mode)
+    
+    cache_key = None
+    if response_cache:
+        with timings.stage("cache"):
+            cache_key = response_cache.key(request, mode, threshold, _model_version_key())
+            cached = response_cache.get(cache_key)
+        if cached is not None:
+            response = _respond("/predict", _make_response(shipment_id, cached, threshold), timings, start)
+            response_cache.observe(True, time.perf_counter() - start)
+            return response
+    
+    async def ml():
+        if mode not in ["ml_only", "hybrid"]:
+            return []
+        with timings.stage("ml"):
+            return await (micro_batcher or async_predictor).predict(
+                request, confidence_threshold=threshold, timings=timings
             )
-            api_predictions = {
-                name: {
-                    "confidence": doc.confidence or 0.9,
-                    "description": doc.description,
-                    "regulatory_basis": doc.regulatory_basis,
-                }
-                for name, doc in api_docs.items()
-            }
-        except Exception as e:
-            logger.error(f"API prediction error: {e}")
-            if DOCUMENT_RECOMMENDER_MODE.lower() == "api_only":
-                raise HTTPException(status_code=500, detail=str(e))
     
-    # Merge predictions based on mode
+    async def api():
+        if mode not in ["api_only", "hybrid"]:
+            return {}, []
+        with timings.stage("api"):
+            return await _api_predictions(request, deadline, timings)
+    
+    # Inference and provider lookups overlap; the deadline bounds the providers
+    ml_predictions, api_result = await asyncio.gather(ml(), api(), return_exceptions=True)
+    degraded = False
+    
+    if isinstance(ml_predictions, Exception):
+        logger.error(f"ML prediction error: {ml_predictions}")
+        if mode == "ml_only":
+            raise HTTPException(status_code=500, detail=str(ml_predictions))
+        ml_predictions = []
+        degraded = True
+    
+    api_predictions, unavailable = {}, []
+    if isinstance(api_result, Exception):
+        logger.error(f"API prediction error: {api_result}")
+        if mode == "api_only":
+            raise HTTPException(status_code=500, detail=str(api_result))
+        degraded = True
+    else:
+        api_predictions, unavailable = api_result
+    
+    with timings.stage("merge"):
+        response = await _build_response(
+            shipment_id, ml_predictions, api_predictions, threshold,
+            partial=degraded, unavailable_providers=unavailable,
+        )
+    if cache_key is not None:
+        if not response["partial"]:
+            response_cache.put(cache_key, response["predicted_documents"])
+        response_cache.observe(False, time.perf_counter() - start)
+    return _respond("/predict", response, timings, start)
+
+
+def _respond(endpoint: str, content: Any, timings: StageTimings, start: float) -> FastJSONResponse:
+    """
+    Serialize a response and record its request-level stage timings.
+    
+    With SERVER_TIMING on, every stage timed during the request (including
+    inference and per-provider stages) is returned in a Server-Timing header.
+    """
+    with timings.stage("serialize"):
+        response = FastJSONResponse(content)
+    total = time.perf_counter() - start
+    
+    request_duration_ms.setdefault(endpoint, Histogram(STAGE_BUCKETS_MS)).observe(total * 1000)
+    for stage in REQUEST_STAGES:
+        if stage in timings:
+            key = (endpoint, stage)
+            request_stage_ms.setdefault(key, Histogram(STAGE_BUCKETS_MS)).observe(timings[stage] * 1000)
+    
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = StageTimings(timings, total=total).server_timing()
+    return response
+
+
+def _deadline(budget_ms: Optional[float]) -> Optional[float]:
+    """Monotonic deadline for provider lookups, or None when unbounded."""
+    budget = PROVIDER_BUDGET_MS if budget_ms is None else budget_ms
+    return time.monotonic() + budget / 1000 if budget > 0 else None
+
+
+def _model_version_key() -> str:
+    """Identity of the loaded model, so cached results never outlive it."""
+    return predictor.model_fingerprint if predictor else "none"
+
+
+def _check_ready(mode: str):
+    """Fail fast when a component the current mode needs is not loaded."""
+    if mode in ["ml_only", "hybrid"] and not async_predictor:
+        raise HTTPException(status_code=503, detail="ML model not loaded")
+    if mode in ["api_only", "hybrid"] and not compliance_integration:
+        raise HTTPException(status_code=503, detail="Compliance integration not initialized")
+
+
+async def _api_predictions(
+    request: DocumentPredictionRequest,
+    deadline: Optional[float] = None,
+    timings: Optional[StageTimings] = None,
+) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """Documents from all compliance providers for one shipment, and the providers that did not answer."""
+    results = await compliance_integration.lookup_documents(
+        hs_code=request.hs_code,
+        origin_country=request.origin_country,
+        destination_country=request.destination_country,
+        product_description=request.product_description,
+        deadline=deadline,
+    )
+    if timings is not None:
+        for name, seconds in results.timings.items():
+            timings[f"provider.{name}"] = seconds
+    return _api_documents(results)
+
+
+def _api_documents(results: ProviderResults) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """Provider documents in the shape merge_ml_and_api_predictions expects, and the providers that did not answer."""
+    # Clamped here because responses are no longer validated against PredictedDocument
+    api_predictions = {
+        name: {
+            "confidence": min(max(doc.confidence or 0.9, 0.0), 1.0),
+            "description": doc.description,
+            "regulatory_basis": doc.regulatory_basis,
+        }
+        for name, doc in results.documents.items()
+    }
+    return api_predictions, results.unavailable
+
+
+async def _build_response(
+    shipment_id: Optional[str],
+    ml_predictions: List[DocumentHit],
+    api_predictions: Dict[str, Dict[str, Any]],
+    threshold: float,
+    partial: bool = False,
+    unavailable_providers: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Merge ML and API predictions according to the service mode."""
     if DOCUMENT_RECOMMENDER_MODE.lower() == "hybrid":
         final_predictions = await merge_ml_and_api_predictions(
             ml_predictions,
@@ -213,7 +560,7 @@ async def predict_documents(
         )
     elif DOCUMENT_RECOMMENDER_MODE.lower() == "api_only":
         final_predictions = [
-            PredictedDocument(
+            DocumentHit(
                 name=name,
                 confidence=data["confidence"],
                 provenance="api",
@@ -225,41 +572,195 @@ async def predict_documents(
     else:  # ml_only
         final_predictions = ml_predictions
     
-    return DocumentPredictionResponse(
-        shipment_id=shipment_id,
-        predicted_documents=final_predictions,
-        mode=DOCUMENT_RECOMMENDER_MODE,
-        model_version=predictor.model_components.metadata.get("model_version", "unknown")
+    return _make_response(shipment_id, final_predictions, threshold, partial, unavailable_providers)
+
+
+def _make_response(
+    shipment_id: Optional[str],
+    predictions: List[DocumentHit],
+    threshold: float,
+    partial: bool = False,
+    unavailable_providers: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    A DocumentPredictionResponse as plain data, ready for FastJSONResponse.
+    
+    The fields are built from already-valid values, so the pydantic model is
+    only used to document the schema, not to validate every response.
+    """
+    return {
+        "shipment_id": shipment_id,
+        "predicted_documents": predictions,
+        "mode": DOCUMENT_RECOMMENDER_MODE,
+        "model_version": predictor.model_components.metadata.get("model_version", "unknown")
             if predictor else "unknown",
-        timestamp=datetime.utcnow().isoformat(),
-        confidence_threshold=threshold,
-    )
+        "timestamp": datetime.utcnow().isoformat(),
+        "confidence_threshold": threshold,
+        "partial": partial or bool(unavailable_providers),
+        "unavailable_providers": unavailable_providers or [],
+    }
 
 
 @app.post("/predict-batch")
 async def predict_batch(
     requests: List[DocumentPredictionRequest],
     confidence_threshold: Optional[float] = None,
+    budget_ms: Optional[float] = None,
 ):
-    """Predict documents for multiple shipments."""
+    """
+    Predict documents for multiple shipments.
     
-    results = []
-    for i, request in enumerate(requests):
-        try:
-            result = await predict_documents(
-                request,
-                shipment_id=f"batch_{i}",
-                confidence_threshold=confidence_threshold,
+    ML inference for the whole batch runs as one vectorized call while the
+    provider lookups for the batch run as one deduplicated batch lookup:
+    identical shipments are looked up once, rule-table providers answer in
+    bulk and the others are called at most BATCH_PROVIDER_CONCURRENCY at a
+    time, all within one provider budget for the request. Results come back in
+    input order; a failing item gets an error entry without affecting the others.
+    Each item is query-logged as a /predict query, so batch traffic is warmed
+    and replayed like single predictions.
+    """
+    start = time.perf_counter()
+    timings = StageTimings()
+    deadline = _deadline(budget_ms)
+    threshold = confidence_threshold or CONFIDENCE_THRESHOLD
+    
+    if query_logger:
+        for r in requests:
+            query_logger.log(
+                "/predict",
+                r.model_dump(),
+                params={"confidence_threshold": confidence_threshold},
             )
-            results.append(result)
-        except Exception as e:
-            logger.error(f"Batch item {i} error: {e}")
-            results.append({
-                "error": str(e),
-                "shipment_id": f"batch_{i}",
-            })
+    mode = DOCUMENT_RECOMMENDER_MODE.lower()
+    _check_ready(mode)
     
-    return {"results": results}
+    async def ml_batch():
+        if mode not in ["ml_only", "hybrid"] or not requests:
+            return [[] for _ in requests]
+        with timings.stage("ml"):
+            return await async_predictor.predict_batch(
+                requests, confidence_threshold=threshold, timings=timings
+            )
+    
+    async def api_batch():
+        if mode not in ["api_only", "hybrid"] or not requests:
+            return [({}, []) for _ in requests]
+        with timings.stage("api"):
+            batch = await compliance_integration.lookup_documents_batch(
+                [
+                    (r.hs_code, r.origin_country, r.destination_country, r.product_description)
+                    for r in requests
+                ],
+                deadline=deadline,
+            )
+        return [
+            results if isinstance(results, Exception) else _api_documents(results)
+            for results in batch
+        ]
+    
+    # Provider round trips overlap with the batched inference
+    ml_results, api_results = await asyncio.gather(ml_batch(), api_batch(), return_exceptions=True)
+    if isinstance(api_results, Exception):
+        api_results = [api_results for _ in requests]
+    if isinstance(ml_results, Exception):
+        logger.error(f"Batch ML prediction error: {ml_results}")
+        ml_error = ml_results
+        ml_results = [[] for _ in requests]
+    else:
+        ml_error = None
+    
+    results = []
+    with timings.stage("merge"):
+        for i, api_result in enumerate(api_results):
+            shipment_id = f"batch_{i}"
+            error = None
+            degraded = ml_error is not None
+            if ml_error is not None and mode == "ml_only":
+                error = ml_error
+            elif isinstance(api_result, Exception):
+                logger.error(f"Batch item {i} API prediction error: {api_result}")
+                if mode == "api_only":
+                    error = api_result
+                api_result = ({}, [])
+                degraded = True
+            
+            if error is not None:
+                results.append({"error": str(error), "shipment_id": shipment_id})
+                continue
+            api_predictions, unavailable = api_result
+            try:
+                results.append(await _build_response(
+                    shipment_id, ml_results[i], api_predictions, threshold,
+                    partial=degraded, unavailable_providers=unavailable,
+                ))
+            except Exception as e:
+                logger.error(f"Batch item {i} error: {e}")
+                results.append({"error": str(e), "shipment_id": shipment_id})
+    
+    return _respond("/predict-batch", {"results": results}, timings, start)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Service metrics in the Prometheus text format.
+    
+    Request and per-stage latency, inference stages inside the worker pool,
+    per-provider latency and outcomes, response cache and event-loop lag.
+    Latencies are reported in seconds.
+    """
+    page = PrometheusExposition(prefix="document_recommender_")
+    page.histogram(
+        "request_duration_seconds", "End-to-end prediction request latency.",
+        [({"endpoint": endpoint}, h) for endpoint, h in request_duration_ms.items()],
+        scale=0.001,
+    )
+    page.histogram(
+        "request_stage_duration_seconds", "Time spent per request stage (cache, ml, api, merge, serialize).",
+        [({"endpoint": endpoint, "stage": stage}, h) for (endpoint, stage), h in request_stage_ms.items()],
+        scale=0.001,
+    )
+    if async_predictor:
+        page.histogram(
+            "inference_stage_duration_seconds", "Time spent per inference stage (pool_wait, transform, encode, score, select).",
+            [({"stage": stage}, h) for stage, h in async_predictor.stage_ms.items()],
+            scale=0.001,
+        )
+    if micro_batcher:
+        page.histogram(
+            "micro_batch_queue_seconds", "Time single requests wait to join a micro-batch.",
+            [({}, micro_batcher.queue_times_ms)], scale=0.001,
+        )
+        page.histogram("micro_batch_size", "Requests per micro-batch.", [({}, micro_batcher.batch_sizes)])
+    if compliance_integration:
+        page.histogram(
+            "provider_call_duration_seconds", "Compliance provider call latency.",
+            [({"provider": name}, h) for name, h in compliance_integration.provider_latency_ms.items()],
+            scale=0.001,
+        )
+        page.counter(
+            "provider_calls_total", "Compliance provider calls by outcome.",
+            [
+                ({"provider": name, "outcome": outcome}, count)
+                for name, outcomes in compliance_integration.provider_outcomes.items()
+                for outcome, count in outcomes.items()
+            ],
+        )
+    if response_cache:
+        page.counter(
+            "response_cache_requests_total", "Response cache lookups by result.",
+            [({"result": "hit"}, response_cache.hits), ({"result": "miss"}, response_cache.misses)],
+        )
+    if loop_lag_monitor:
+        page.histogram(
+            "event_loop_lag_seconds", "How late periodic event-loop wake-ups run.",
+            [({}, loop_lag_monitor.lag_ms)], scale=0.001,
+        )
+        page.gauge(
+            "event_loop_lag_max_seconds", "Largest event-loop lag observed.",
+            [({}, loop_lag_monitor.max_lag_ms / 1000)],
+        )
+    return PlainTextResponse(page.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 
 @app.get("/")
@@ -273,6 +774,7 @@ async def root():
             "model_info": "/model-info",
             "predict": "/predict",
             "predict_batch": "/predict-batch",
+            "metrics": "/metrics",
         }
     }
 
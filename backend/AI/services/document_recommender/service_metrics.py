@@ -0,0 +1,178 @@
+"""
+Service Metrics
+Lightweight in-process counters and histograms reported by the serving endpoints
+"""
+import asyncio
+import bisect
+import math
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+STAGE_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+LOOP_LAG_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class Histogram:
+    """Fixed-bucket histogram with cumulative `le` counts, as Prometheus reports them."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """(upper bound, observations <= bound) per bucket, ending with +Inf."""
+        counts, running = [], 0
+        for bound, n in zip(self.buckets, self._counts):
+            running += n
+            counts.append((bound, running))
+        counts.append((float("inf"), self.count))
+        return counts
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = {
+            "+Inf" if bound == float("inf") else f"{bound:g}": n
+            for bound, n in self.cumulative()
+        }
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else 0.0,
+            "buckets": cumulative,
+        }
+
+
+class StageTimings(dict):
+    """
+    Seconds spent per named stage of one request or inference batch.
+
+    A plain dict, so it pickles to and from process-pool workers; stages
+    entered more than once accumulate.
+    """
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self[name] = self.get(name, 0.0) + time.perf_counter() - start
+
+    def server_timing(self) -> str:
+        """The stages as a Server-Timing header value, in milliseconds."""
+        return ", ".join(
+            f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)};dur={seconds * 1000:.2f}"
+            for name, seconds in self.items()
+        )
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: how late a periodic wake-up actually runs.
+
+    Anything that blocks the loop (inline CPU work, a synchronous call) delays
+    every request on it by the same amount, and shows up here directly.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag_ms = Histogram(LOOP_LAG_BUCKETS_MS)
+        self.max_lag_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected) * 1000
+            self.lag_ms.observe(lag)
+            self.max_lag_ms = max(self.max_lag_ms, lag)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    """A sample value without rounding: exact integers, shortest round-trip floats."""
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class PrometheusExposition:
+    """
+    Builds a Prometheus text-format (0.0.4) page from in-process metrics.
+
+    Components keep their own Histograms and counters; the /metrics handler
+    adds them here under one name prefix. Millisecond histograms are reported
+    in seconds, Prometheus' base unit, by passing `scale=0.001`.
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._lines: List[str] = []
+
+    def _header(self, name: str, help_text: str, kind: str) -> str:
+        name = self.prefix + name
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        return name
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        series: Iterable[Tuple[Dict[str, Any], Histogram]],
+        scale: float = 1.0,
+    ):
+        name = self._header(name, help_text, "histogram")
+        for labels, histogram in series:
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == float("inf") else f"{bound * scale:g}"
+                self._lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {count}")
+            self._lines.append(f"{name}_sum{_labels(labels)} {_number(histogram.sum * scale)}")
+            self._lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def counter(self, name: str, help_text: str, series: Iterable[Tuple[Dict[str, Any], float]]):
+        name = self._header(name, help_text, "counter")
+        for labels, value in series:
+            self._lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    def gauge(self, name: str, help_text: str, series: Iterable[Tuple[Dict[str, Any], float]]):
+        name = self._header(name, help_text, "gauge")
+        for labels, value in series:
+            self._lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
@@ -3,28 +3,39 @@ Training Pipeline for Multi-Label Document Requirement Classifier
 Trains a model to predict required shipping documents based on shipment attributes.
 """
 import argparse
-import pickle
+import time
 import numpy as np
 import pandas as pd
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional, Iterator
 from datetime import datetime
 
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler, OneHotEncoder, FunctionTransformer
-from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import SGDClassifier
 from sklearn.multioutput import MultiOutputClassifier
-from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import precision_score, recall_score, f1_score, hamming_loss
 from sklearn.preprocessing import MultiLabelBinarizer
 
-try:
-    from sentence_transformers import SentenceTransformer
-    HAS_SENTENCE_TRANSFORMERS = True
-except ImportError:
-    HAS_SENTENCE_TRANSFORMERS = False
-    from sklearn.feature_extraction.text import TfidfVectorizer
+from embedding_cache import TrainingEmbeddingStore, encode_parallel
+from feature_pipeline import (
+    CATEGORICAL_COLUMNS,
+    FEATURE_COLUMNS,
+    TEXT_COLUMNS,
+    HashedFeaturePipeline,
+    ShipmentFeaturePipeline,
+    build_text_inputs,
+    make_text_encoder,
+)
+from label_models import (
+    BinaryLogisticRegression,
+    LinearScorer,
+    export_linear_scorer,
+    fit_label_models,
+    stack_linear_models,
+    tune_decision_thresholds,
+)
+from model_artifact import load_model_data, save_artifact
 
 import warnings
 warnings.filterwarnings("ignore")
@@ -33,22 +44,57 @@ warnings.filterwarnings("ignore")
 class DocumentRequirementTrainer:
     """Multi-label document requirement classifier trainer."""
     
-    def __init__(self, text_model: str = "all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        text_model: str = "all-MiniLM-L6-v2",
+        embedding_cache_dir: Optional[str] = None,
+        encode_workers: int = 1,
+        n_jobs: int = -1,
+        warm_start_from: Optional[str] = None,
+    ):
         self.text_model = text_model
+        self.embedding_cache_dir = embedding_cache_dir
+        self.encode_workers = encode_workers
+        self.n_jobs = n_jobs
+        self.stage_timings: Dict[str, float] = {}
+        self.fit_report: Dict = {}
+        
+        # Previous artifact whose feature pipeline and coefficients seed retraining
+        self.previous_model: Optional[Dict] = None
+        if warm_start_from:
+            # Read into memory: the previous pipeline is reused and may be rewritten by save_model
+            self.previous_model = load_model_data(warm_start_from, mmap_mode=None)
+            pipeline = self.previous_model.get("feature_pipeline")
+            if not isinstance(pipeline, ShipmentFeaturePipeline):
+                found = type(pipeline).__name__ if pipeline is not None else "no feature pipeline"
+                raise ValueError(
+                    f"Cannot warm-start from {warm_start_from}: it needs a model trained with "
+                    f"ShipmentFeaturePipeline, found {found}. Hashed models from --streaming "
+                    "cannot seed this trainer; retrain without --warm-start-from."
+                )
+            print(f"✓ Warm-starting from {warm_start_from}")
         self.mlb = MultiLabelBinarizer()
-        self.feature_preprocessor = None
+        self.feature_pipeline: ShipmentFeaturePipeline = None
         self.classifier = None
+        self.scorer: LinearScorer = None
+        self.decision_thresholds: np.ndarray = None
         self.label_names = None
         self.model_metadata = {}
     
+    @contextmanager
+    def _stage(self, name: str):
+        """Time a pipeline stage and record it in `stage_timings`."""
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.stage_timings[name] = self.stage_timings.get(name, 0.0) + elapsed
+        print(f"  [{name}] {elapsed:.2f}s")
+    
     def load_and_validate_data(self, data_file: str) -> pd.DataFrame:
         """Load CSV and validate required columns."""
-        df = pd.read_csv(data_file)
-        required_cols = [
-            "product_name", "category", "product_description", "hs_code",
-            "origin_country", "destination_country", "package_type", "weight",
-            "declared_value", "shipment_type", "service_level", "required_documents"
-        ]
+        # HS codes like "0201" must stay strings
+        df = pd.read_csv(data_file, dtype={col: str for col in TEXT_COLUMNS + CATEGORICAL_COLUMNS})
+        required_cols = FEATURE_COLUMNS + ["required_documents"]
         missing = [col for col in required_cols if col not in df.columns]
         if missing:
             raise ValueError(f"Missing required columns: {missing}")
@@ -60,37 +106,30 @@ class DocumentRequirementTrainer:
         return df
     
     def preprocess_features(self, df: pd.DataFrame) -> np.ndarray:
-        """Preprocess and combine all features."""
-        # Text features: combine product info
-        text_features = (
-            df["product_name"] + " " +
-            df["category"] + " " +
-            df["product_description"] + " " +
-            df["hs_code"]
-        ).values
-        
-        # Encode text
-        if HAS_SENTENCE_TRANSFORMERS:
-            print(f"  Encoding text with SentenceTransformer ({self.text_model})...")
-            model = SentenceTransformer(self.text_model)
-            text_embeddings = model.encode(text_features, show_progress_bar=False)
+        """Fit the feature pipeline and return the combined feature matrix."""
+        if self.previous_model:
+            # Keep the previous feature layout so its coefficients still apply
+            self.feature_pipeline = self.previous_model["feature_pipeline"]
         else:
-            print("  Encoding text with TF-IDF...")
-            tfidf = TfidfVectorizer(max_features=128, stop_words="english")
-            text_embeddings = tfidf.fit_transform(text_features).toarray()
-        
-        # Categorical features
-        categorical_features = df[["origin_country", "destination_country", "package_type", "shipment_type", "service_level"]]
-        ohe = OneHotEncoder(sparse_output=False, handle_unknown="ignore")
-        cat_embeddings = ohe.fit_transform(categorical_features)
-        
-        # Numeric features
-        numeric_features = df[["weight", "declared_value"]].values
-        scaler = StandardScaler()
-        numeric_scaled = scaler.fit_transform(numeric_features)
-        
-        # Combine all
-        features = np.hstack([text_embeddings, cat_embeddings, numeric_scaled])
+            self.feature_pipeline = ShipmentFeaturePipeline(make_text_encoder(self.text_model))
+            with self._stage("fit_transforms"):
+                self.feature_pipeline.fit(df)
+        encoder = self.feature_pipeline.text_encoder
+        
+        print(f"  Encoding text with {encoder.name}...")
+        with self._stage("text_encoding"):
+            texts = build_text_inputs(df)
+            if self.embedding_cache_dir:
+                store = TrainingEmbeddingStore(self.embedding_cache_dir, encoder.fingerprint)
+                text_features = store.encode(encoder, texts, workers=self.encode_workers)
+                print(f"  Embedding cache: {store.last_reused} rows reused, {store.last_encoded} newly encoded")
+            else:
+                text_features = encode_parallel(encoder, list(texts), workers=self.encode_workers)
+        
+        with self._stage("tabular_transforms"):
+            tabular_features = self.feature_pipeline.transform_tabular(df)
+        
+        features = np.hstack([text_features, tabular_features])
         print(f"  Feature matrix shape: {features.shape}")
         
         return features
@@ -122,15 +161,25 @@ class DocumentRequirementTrainer:
         self,
         data_file: str,
         test_size: float = 0.2,
-        random_state: int = 42
+        random_state: int = 42,
+        tune_thresholds: bool = False,
     ):
-        """Train the multi-label classifier."""
+        """
+        Train the multi-label classifier.
+        
+        With `tune_thresholds`, a validation slice of the training split is
+        used to pick a per-label decision threshold that maximizes F1;
+        otherwise every label uses 0.5.
+        """
         print(f"\n{'='*60}")
         print("DOCUMENT REQUIREMENT CLASSIFIER TRAINING")
         print(f"{'='*60}\n")
         
+        self.stage_timings = {}
+        
         # Load data
-        df = self.load_and_validate_data(data_file)
+        with self._stage("load_data"):
+            df = self.load_and_validate_data(data_file)
         
         # Preprocess features
         print("\nPreprocessing features...")
@@ -138,7 +187,8 @@ class DocumentRequirementTrainer:
         
         # Parse labels
         print("\nParsing labels...")
-        y = self.parse_labels(df)
+        with self._stage("parse_labels"):
+            y = self.parse_labels(df)
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
@@ -146,22 +196,45 @@ class DocumentRequirementTrainer:
         )
         print(f"\nTrain/test split: {len(X_train)} / {len(X_test)}")
         
+        # Decision thresholds
+        self.decision_thresholds = np.full(y.shape[1], 0.5)
+        if tune_thresholds:
+            print("\nTuning per-label decision thresholds...")
+            X_fit, X_val, y_fit, y_val = train_test_split(
+                X_train, y_train, test_size=0.2, random_state=random_state
+            )
+            with self._stage("tune_thresholds"):
+                val_classifier, _ = self._fit_classifier(X_fit, y_fit, random_state)
+                val_scorer = export_linear_scorer(val_classifier)
+                self.decision_thresholds = tune_decision_thresholds(y_val, val_scorer.predict_proba(X_val))
+            for label, threshold in zip(self.label_names, self.decision_thresholds):
+                print(f"    {label}: {threshold:.2f}")
+        
         # Train classifier
         print("\nTraining multi-output classifier...")
-        self.classifier = MultiOutputClassifier(
-            LogisticRegression(max_iter=1000, random_state=random_state, n_jobs=-1)
+        with self._stage("fit"):
+            self.classifier, self.fit_report = self._fit_classifier(X_train, y_train, random_state)
+        print(
+            f"  {self.fit_report['labels']} labels ({self.fit_report['mode']} start, "
+            f"{self.fit_report['warm_started_labels']} warm) on {self.fit_report['workers']} workers: "
+            f"wall {self.fit_report['wall_seconds']:.2f}s, CPU {self.fit_report['cpu_seconds']:.2f}s "
+            f"({self.fit_report['cpu_utilization']:.1f} cores busy)"
         )
-        self.classifier.fit(X_train, y_train)
         
-        # Evaluate
-        print("\nEvaluating model...")
-        y_pred = self.classifier.predict(X_test)
+        # Export the serve-time scorer: one weight matrix for all labels
+        self.scorer = export_linear_scorer(self.classifier)
+        print(f"  Exported linear scorer: {self.scorer.coef.shape[0]} features x {self.scorer.coef.shape[1]} labels")
         
-        # Compute metrics
-        precision = precision_score(y_test, y_pred, average="micro", zero_division=0)
-        recall = recall_score(y_test, y_pred, average="micro", zero_division=0)
-        f1 = f1_score(y_test, y_pred, average="micro", zero_division=0)
-        h_loss = hamming_loss(y_test, y_pred)
+        # Evaluate with the same decision rule used at serve time
+        print("\nEvaluating model...")
+        with self._stage("evaluate"):
+            y_pred = (self.scorer.predict_proba(X_test) >= self.decision_thresholds).astype(int)
+            
+            # Compute metrics
+            precision = precision_score(y_test, y_pred, average="micro", zero_division=0)
+            recall = recall_score(y_test, y_pred, average="micro", zero_division=0)
+            f1 = f1_score(y_test, y_pred, average="micro", zero_division=0)
+            h_loss = hamming_loss(y_test, y_pred)
         
         print(f"  Precision (micro): {precision:.4f}")
         print(f"  Recall (micro):    {recall:.4f}")
@@ -182,30 +255,229 @@ class DocumentRequirementTrainer:
                 "f1": float(f1),
                 "hamming_loss": float(h_loss),
             },
-            "text_encoder": self.text_model if HAS_SENTENCE_TRANSFORMERS else "tfidf",
+            "thresholds_tuned": tune_thresholds,
+            "text_encoder": self.feature_pipeline.text_encoder.name,
+            "num_features": int(X.shape[1]),
+            "stage_timings": {name: round(secs, 4) for name, secs in self.stage_timings.items()},
+            "fit_report": self.fit_report,
         }
+        
+        print("\nStage timings:")
+        for name, secs in self.stage_timings.items():
+            print(f"  {name:<20} {secs:8.2f}s")
+    
+    def _fit_classifier(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        random_state: int,
+    ) -> Tuple[MultiOutputClassifier, Dict]:
+        """Fit one logistic model per document type in parallel."""
+        return fit_label_models(
+            BinaryLogisticRegression(max_iter=1000, random_state=random_state),
+            X,
+            y,
+            n_jobs=self.n_jobs,
+            warm_start=self._warm_start_coefficients(X.shape[1]),
+        )
+    
+    def _warm_start_coefficients(self, n_features: int) -> Optional[List]:
+        """Per-label (coef, intercept) from the previous model, matched by label name."""
+        if not self.previous_model:
+            return None
+        previous = self.previous_model["scorer"]
+        if previous.coef.shape[0] != n_features:
+            print("  Previous model has a different feature layout; starting cold")
+            return None
+        previous_labels = {name: j for j, name in enumerate(self.previous_model["label_names"])}
+        return [
+            (previous.coef[:, previous_labels[name]], previous.intercept[previous_labels[name]])
+            if name in previous_labels else None
+            for name in self.label_names
+        ]
     
     def save_model(self, models_dir: str = None):
         """Save trained model and preprocessing pipeline."""
         models_dir = Path(models_dir or Path(__file__).parent / "models")
         models_dir.mkdir(parents=True, exist_ok=True)
         
-        # Save classifier
-        model_path = models_dir / "required_docs_model.pkl"
-        with open(model_path, "wb") as f:
-            pickle.dump({
-                "classifier": self.classifier,
-                "mlb": self.mlb,
-                "label_names": self.label_names,
-                "metadata": self.model_metadata,
-            }, f)
+        # Serving needs only the exported scorer, not the sklearn estimators
+        model_path = save_artifact(
+            models_dir,
+            feature_pipeline=self.feature_pipeline,
+            scorer=self.scorer,
+            decision_thresholds=self.decision_thresholds,
+            label_names=self.label_names,
+            metadata=self.model_metadata,
+        )
         print(f"\n✓ Saved model to {model_path}")
+
+
+def iter_data_chunks(
+    data_file: str,
+    chunksize: int,
+    columns: Optional[List[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Read a CSV or Parquet file in fixed-size chunks."""
+    string_cols = [col for col in TEXT_COLUMNS + CATEGORICAL_COLUMNS if columns is None or col in columns]
+    if str(data_file).endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(data_file).iter_batches(batch_size=chunksize, columns=columns):
+            chunk = batch.to_pandas()
+            yield chunk.astype({col: str for col in string_cols if col in chunk.columns})
+    else:
+        yield from pd.read_csv(
+            data_file,
+            chunksize=chunksize,
+            usecols=columns,
+            dtype={col: str for col in string_cols},
+        )
+
+
+class StreamingDocumentTrainer(DocumentRequirementTrainer):
+    """
+    Out-of-core trainer for shipment logs that do not fit in memory.
+    
+    Reads CSV or Parquet in chunks, hashes features into a fixed-size sparse
+    space and updates one SGD logistic model per label with partial_fit.
+    A deterministic per-chunk holdout is never trained on and is scored in a
+    final streaming pass, so memory stays flat regardless of dataset size.
+    """
+    
+    def __init__(
+        self,
+        chunksize: int = 100_000,
+        n_text_features: int = 2 ** 16,
+        n_categorical_features: int = 2 ** 10,
+        epochs: int = 1,
+        holdout_fraction: float = 0.05,
+        alpha: float = 1e-4,
+        random_state: int = 42,
+    ):
+        super().__init__()
+        self.chunksize = chunksize
+        self.epochs = epochs
+        self.holdout_fraction = holdout_fraction
+        self.alpha = alpha
+        self.random_state = random_state
+        self.feature_pipeline = HashedFeaturePipeline(n_text_features, n_categorical_features)
+        self.learners: List[SGDClassifier] = []
+    
+    def _holdout_mask(self, chunk_idx: int, n_rows: int) -> np.ndarray:
+        """Same rows are held out on every pass over the data."""
+        rng = np.random.default_rng([self.random_state, chunk_idx])
+        return rng.random(n_rows) < self.holdout_fraction
+    
+    def _chunk_labels(self, chunk: pd.DataFrame) -> np.ndarray:
+        return self.mlb.transform([
+            [doc.strip() for doc in docs_str.split(",")]
+            for docs_str in chunk["required_documents"]
+        ])
+    
+    def collect_labels(self, data_file: str):
+        """First pass over the label column only, to fix the label space."""
+        all_labels = set()
+        rows = 0
+        for chunk in iter_data_chunks(data_file, self.chunksize, columns=["required_documents"]):
+            if chunk["required_documents"].isna().any():
+                raise ValueError("required_documents column contains null values")
+            rows += len(chunk)
+            for docs_str in chunk["required_documents"]:
+                all_labels.update(doc.strip() for doc in docs_str.split(","))
+        
+        self.label_names = sorted(all_labels)
+        self.mlb = MultiLabelBinarizer(classes=self.label_names)
+        self.mlb.fit([])
+        print(f"  {rows} rows, {len(self.label_names)} document types")
+        return rows
+    
+    def train(self, data_file: str):
+        """Stream the data, fit per-label SGD models and evaluate on the holdout."""
+        print(f"\n{'='*60}")
+        print("DOCUMENT REQUIREMENT CLASSIFIER TRAINING (STREAMING)")
+        print(f"{'='*60}\n")
+        self.stage_timings = {}
+        
+        print("Collecting labels...")
+        with self._stage("collect_labels"):
+            total_rows = self.collect_labels(data_file)
+        
+        self.learners = [
+            SGDClassifier(loss="log_loss", alpha=self.alpha, random_state=self.random_state)
+            for _ in self.label_names
+        ]
+        classes = np.array([0, 1])
+        train_rows = 0
+        
+        print(f"\nTraining on {self.feature_pipeline.n_features} hashed features...")
+        with self._stage("stream_fit"):
+            for epoch in range(self.epochs):
+                for chunk_idx, chunk in enumerate(iter_data_chunks(data_file, self.chunksize)):
+                    if chunk_idx == 0 and epoch == 0:
+                        missing = [col for col in FEATURE_COLUMNS + ["required_documents"] if col not in chunk.columns]
+                        if missing:
+                            raise ValueError(f"Missing required columns: {missing}")
+                    
+                    train_mask = ~self._holdout_mask(chunk_idx, len(chunk))
+                    if not train_mask.any():
+                        continue
+                    X = self.feature_pipeline.transform(chunk[train_mask])
+                    y = self._chunk_labels(chunk[train_mask])
+                    for label_idx, learner in enumerate(self.learners):
+                        learner.partial_fit(X, y[:, label_idx], classes=classes)
+                    if epoch == 0:
+                        train_rows += int(train_mask.sum())
+                print(f"  Epoch {epoch + 1}/{self.epochs} done")
+        
+        self.scorer = stack_linear_models(self.learners)
+        self.decision_thresholds = np.full(len(self.label_names), 0.5)
         
-        # Save metadata separately for easy access
-        metadata_path = models_dir / "model_metadata.pkl"
-        with open(metadata_path, "wb") as f:
-            pickle.dump(self.model_metadata, f)
-        print(f"✓ Saved metadata to {metadata_path}")
+        print("\nEvaluating on streamed holdout...")
+        with self._stage("stream_evaluate"):
+            metrics = self.evaluate_stream(data_file)
+        for name, value in metrics.items():
+            print(f"  {name}: {value:.4f}" if isinstance(value, float) else f"  {name}: {value}")
+        
+        self.model_metadata = {
+            "model_version": "v1",
+            "training_mode": "streaming",
+            "training_timestamp": datetime.utcnow().isoformat(),
+            "training_samples": train_rows,
+            "test_samples": metrics.pop("holdout_samples"),
+            "total_rows": total_rows,
+            "num_labels": len(self.label_names),
+            "label_names": self.label_names,
+            "metrics": metrics,
+            "text_encoder": "hashing",
+            "num_features": self.feature_pipeline.n_features,
+            "stage_timings": {name: round(secs, 4) for name, secs in self.stage_timings.items()},
+        }
+    
+    def evaluate_stream(self, data_file: str) -> Dict:
+        """Micro-averaged metrics over the holdout rows, accumulated chunk by chunk."""
+        tp = fp = fn = cells = rows = 0
+        for chunk_idx, chunk in enumerate(iter_data_chunks(data_file, self.chunksize)):
+            holdout = self._holdout_mask(chunk_idx, len(chunk))
+            if not holdout.any():
+                continue
+            y_true = self._chunk_labels(chunk[holdout]).astype(bool)
+            proba = self.scorer.predict_proba(self.feature_pipeline.transform(chunk[holdout]))
+            y_pred = proba >= self.decision_thresholds
+            tp += int((y_pred & y_true).sum())
+            fp += int((y_pred & ~y_true).sum())
+            fn += int((~y_pred & y_true).sum())
+            cells += y_true.size
+            rows += len(y_true)
+        
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        return {
+            "precision": precision,
+            "recall": recall,
+            "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            "hamming_loss": (fp + fn) / cells if cells else 0.0,
+            "holdout_samples": rows,
+        }
 
 
 def main():
@@ -213,7 +485,7 @@ def main():
     parser.add_argument(
         "--data-file",
         type=str,
-        help="Path to training CSV file"
+        help="Path to training CSV (or Parquet with --streaming) file"
     )
     parser.add_argument(
         "--use-synthetic",
@@ -237,8 +509,66 @@ def main():
         default=0.2,
         help="Test set fraction"
     )
+    parser.add_argument(
+        "--embedding-cache-dir",
+        type=str,
+        help="Reuse text embeddings from earlier runs stored in this directory"
+    )
+    parser.add_argument(
+        "--encode-workers",
+        type=int,
+        default=1,
+        help="Processes used to encode text not found in the embedding cache"
+    )
+    parser.add_argument(
+        "--tune-thresholds",
+        action="store_true",
+        help="Tune per-label decision thresholds on a validation split"
+    )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=-1,
+        help="Processes used to fit labels in parallel (-1 = all cores)"
+    )
+    parser.add_argument(
+        "--warm-start-from",
+        type=str,
+        help="Models directory of a previous run to warm-start from when retraining on appended data"
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Out-of-core training over CSV/Parquet chunks with hashed features"
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="Rows per chunk (if --streaming)"
+    )
+    parser.add_argument(
+        "--epochs",
+        type=int,
+        default=1,
+        help="Passes over the data (if --streaming)"
+    )
+    parser.add_argument(
+        "--hash-features",
+        type=int,
+        default=2 ** 16,
+        help="Hashed text feature dimensionality (if --streaming)"
+    )
+    parser.add_argument(
+        "--sgd-alpha",
+        type=float,
+        default=1e-4,
+        help="L2 regularization for the per-label SGD models (if --streaming)"
+    )
     
     args = parser.parse_args()
+    if args.streaming and args.warm_start_from:
+        parser.error("--warm-start-from is not supported with --streaming")
     
     # Determine data file
     if args.use_synthetic:
@@ -266,8 +596,27 @@ def main():
             return
     
     # Train
-    trainer = DocumentRequirementTrainer()
-    trainer.train(data_file=str(data_file), test_size=args.test_size)
+    if args.streaming:
+        trainer = StreamingDocumentTrainer(
+            chunksize=args.chunksize,
+            n_text_features=args.hash_features,
+            epochs=args.epochs,
+            holdout_fraction=args.test_size,
+            alpha=args.sgd_alpha,
+        )
+        trainer.train(data_file=str(data_file))
+    else:
+        trainer = DocumentRequirementTrainer(
+            embedding_cache_dir=args.embedding_cache_dir,
+            encode_workers=args.encode_workers,
+            n_jobs=args.n_jobs,
+            warm_start_from=args.warm_start_from,
+        )
+        trainer.train(
+            data_file=str(data_file),
+            test_size=args.test_size,
+            tune_thresholds=args.tune_thresholds,
+        )
     
     # Save
     trainer.save_model(models_dir=args.save_dir)
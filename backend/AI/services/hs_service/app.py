@@ -1,5 +1,6 @@
 import os
-from typing import List
+from functools import lru_cache
+from typing import List, Tuple
 from pydantic import BaseModel
 from fastapi import FastAPI
 import numpy as np
@@ -7,12 +8,29 @@ import pandas as pd
 from sentence_transformers import SentenceTransformer
 import faiss
 
+# Vendored from document_recommender; run scripts/sync_shared_modules.py after a checkout or change
+try:
+    from fast_json import FastJSONResponse
+    from query_log import query_logger_from_env, warm_from_log
+except ModuleNotFoundError as e:
+    if e.name not in ('fast_json', 'query_log'):
+        raise
+    raise ModuleNotFoundError(
+        f"{e.name} is not vendored into hs_service; run backend/AI/scripts/sync_shared_modules.py",
+        name=e.name,
+    ) from e
+
 BASE_DIR = os.path.dirname(__file__)
 # Navigate up 3 levels: hs_service -> services -> AI -> models
 MODELS_DIR = os.path.join(BASE_DIR, '..', '..', 'models')
 MODELS_DIR = os.path.normpath(MODELS_DIR)
 
-app = FastAPI(title='HS Code Suggestion Service')
+SUGGEST_CACHE_SIZE = int(os.getenv('HS_SUGGEST_CACHE_SIZE', '4096'))
+QUERY_LOG_SERVICE = 'hs_service'
+QUERY_LOG_WARM_TOP_N = int(os.getenv('QUERY_LOG_WARM_TOP_N', '0'))
+QUERY_LOG_WARM_MAX_AGE_HOURS = float(os.getenv('QUERY_LOG_WARM_MAX_AGE_HOURS', '24'))
+
+app = FastAPI(title='HS Code Suggestion Service', default_response_class=FastJSONResponse)
 
 class SuggestRequest(BaseModel):
     name: str = ''
@@ -31,10 +49,11 @@ class SuggestResponse(BaseModel):
 model = None
 index = None
 meta = None
+query_logger = None
 
 @app.on_event('startup')
 def load_resources():
-    global model, index, meta
+    global model, index, meta, query_logger
     # Paths
     fs_index = os.path.join(MODELS_DIR, 'hs_index.faiss')
     meta_csv = os.path.join(MODELS_DIR, 'hs_meta.csv')
@@ -51,21 +70,50 @@ def load_resources():
     meta = pd.read_csv(meta_csv)
     print('Loaded HS model and index. Rows:', len(meta))
 
-@app.post('/suggest-hs', response_model=SuggestResponse)
-def suggest_hs(req: SuggestRequest):
-    if index is None or model is None or meta is None:
-        return {'suggestions': []}
-    q = f"{req.name or ''} {req.category or ''} {req.description or ''}".strip().lower()
+    if QUERY_LOG_WARM_TOP_N > 0 and os.getenv('QUERY_LOG_DIR'):
+        warmed = warm_from_log(
+            lambda query, params: _search(_query_text(SuggestRequest(**query)), query.get('k', 5)),
+            os.getenv('QUERY_LOG_DIR'), QUERY_LOG_SERVICE, '/suggest-hs',
+            QUERY_LOG_WARM_TOP_N, QUERY_LOG_WARM_MAX_AGE_HOURS * 3600,
+        )
+        print('Warmed suggestion cache with', warmed, 'logged queries')
+
+    query_logger = query_logger_from_env(QUERY_LOG_SERVICE)
+
+@app.on_event('shutdown')
+def close_query_log():
+    if query_logger is not None:
+        query_logger.close()
+
+def _query_text(req: SuggestRequest) -> str:
+    return ' '.join(f"{req.name or ''} {req.category or ''} {req.description or ''}".lower().split())
+
+@lru_cache(maxsize=SUGGEST_CACHE_SIZE)
+def _search(q: str, k: int) -> Tuple[Tuple[str, str, float], ...]:
     emb = model.encode([q], convert_to_numpy=True)
     faiss.normalize_L2(emb)
-    D, I = index.search(emb, req.k)
-    suggestions = []
+    D, I = index.search(emb, k)
+    hits = []
     for score, idx in zip(D[0], I[0]):
         if idx < 0:
             continue
         row = meta.iloc[int(idx)]
-        suggestions.append({'hscode': str(row.get('hscode', '')), 'description': str(row.get('description', '')), 'score': float(score)})
-    return {'suggestions': suggestions}
+        hits.append((str(row.get('hscode', '')), str(row.get('description', '')), float(score)))
+    return tuple(hits)
+
+@app.post('/suggest-hs', response_model=SuggestResponse)
+def suggest_hs(req: SuggestRequest):
+    if index is None or model is None or meta is None:
+        return FastJSONResponse({'suggestions': []})
+    if query_logger is not None:
+        query_logger.log('/suggest-hs', req.model_dump())
+    # _search already returns typed (str, str, float) tuples, so the response
+    # skips SuggestResponse validation and is encoded straight from them
+    suggestions = [
+        {'hscode': hscode, 'description': description, 'score': score}
+        for hscode, description, score in _search(_query_text(req), req.k)
+    ]
+    return FastJSONResponse({'suggestions': suggestions})
 
 @app.get('/health')
 def health():
@@ -75,4 +123,7 @@ def health():
 def model_info():
     if meta is None:
         return {'loaded': False}
-    return {'loaded': True, 'rows': len(meta)}
+    info = {'loaded': True, 'rows': len(meta), 'suggest_cache': _search.cache_info()._asdict()}
+    if query_logger is not None:
+        info['query_log'] = query_logger.stats()
+    return info